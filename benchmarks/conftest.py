@@ -0,0 +1,174 @@
+"""
+Synthetic studies for the orchestration benchmarks.
+
+Everything is generated under pytest's tmp folder once
+per session and shared by every benchmark at that scale.
+Images are empty files as only their names are read.
+"""
+
+import os
+import pytest
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+STAGES = ["pre_freesurfer", "freesurfer", "post_freesurfer"]
+
+
+def scales() -> list:
+    """
+    Function to return the number of subjects
+    to benchmark at. Can be set with
+    QPIPELINE_BENCHMARK_SCALES (e.g. 10,1000)
+    """
+    return [
+        int(scale)
+        for scale in os.environ.get(
+            "QPIPELINE_BENCHMARK_SCALES", "10,1000,50000"
+        ).split(",")
+    ]
+
+
+def subject_ids(subjects: int) -> list:
+    """
+    Function to return the ids
+    of synthetic subjects
+    """
+    return [f"{subject:05d}" for subject in range(1, subjects + 1)]
+
+
+def scan_names() -> dict:
+    """
+    Function to return the images
+    of each modality of a session
+    """
+    return {
+        "anat": ["T1w", "T2w"],
+        "dwi": ["dir98-AP_dwi", "dir98-PA_dwi", "dir99-AP_dwi", "dir99-PA_dwi"],
+    }
+
+
+def make_bids_tree(raw_data: str, subjects: int) -> str:
+    """
+    Function to make a bids tree with one session
+    per subject. Every 50th subject has no dwi so
+    some sessions are reported as missing it.
+    """
+    for subject in subject_ids(subjects):
+        for modality, scans in scan_names().items():
+            if modality == "dwi" and int(subject) % 50 == 0:
+                continue
+            folder = os.path.join(raw_data, f"sub-{subject}", "ses-1", modality)
+            os.makedirs(folder)
+            for scan in scans:
+                open(
+                    os.path.join(folder, f"sub-{subject}_ses-1_{scan}.nii.gz"), "w"
+                ).close()
+    return raw_data
+
+
+def import_bids_output(subjects: int) -> str:
+    """
+    Function to make the stdout of qunex
+    import_bids for every subject
+    """
+    lines = []
+    for subject in subject_ids(subjects):
+        lines.append(f"---> Processing session sub-{subject}_ses-1")
+        number = 1
+        for scans in scan_names().values():
+            for scan in scans:
+                lines.append(
+                    f"---> linked {number}.nii.gz <-- sub-{subject}_ses-1_{scan}.nii.gz"
+                )
+                number += 1
+        lines.append(f"---> sorted {number - 1} images for {subject}_1")
+    return "\n".join(lines) + "\n"
+
+
+def make_comlogs(study_folder: str, subjects: int) -> str:
+    """
+    Function to make the comlogs of a study where
+    setup and every structural stage have ran for
+    every session, with every 20th session having
+    failed freesurfer once before finishing.
+    """
+    comlogs = os.path.join(study_folder, "processing", "logs", "comlogs")
+    os.makedirs(comlogs)
+    names = [
+        f"done_{command}_2026-01-01_09.00.00.000001.log"
+        for command in ["create_study", "import_bids", "create_session_info"]
+    ]
+    for number, subject in enumerate(subject_ids(subjects)):
+        session = f"{subject}_1"
+        for hour, stage in enumerate(STAGES, start=10):
+            names.append(
+                f"done_hcp_{stage}_{session}_2026-01-01_{hour}.00.00.{number:06d}.log"
+            )
+        if number % 20 == 0:
+            names.append(
+                f"error_hcp_freesurfer_{session}_2026-01-01_08.00.00.{number:06d}.log"
+            )
+    for name in names:
+        open(os.path.join(comlogs, name), "w").close()
+    with open(os.path.join(study_folder, "processing", "batch.txt"), "w") as batch:
+        batch.writelines(
+            f"---\nsession: {subject}_1\n" for subject in subject_ids(subjects)
+        )
+    return study_folder
+
+
+@pytest.fixture(scope="session")
+def synthetic_studies(tmp_path_factory) -> dict:
+    """
+    Fixture of synthetic studies by scale,
+    each made the first time it is used
+    """
+    studies = {}
+
+    def study(subjects: int) -> dict:
+        if subjects not in studies:
+            root = str(tmp_path_factory.mktemp(f"study_{subjects}"))
+            studies[subjects] = {
+                "subjects": subjects,
+                "raw_data": make_bids_tree(os.path.join(root, "raw_data"), subjects),
+                "study_folder": make_comlogs(os.path.join(root, "study"), subjects),
+                "import_bids_output": import_bids_output(subjects),
+            }
+        return studies[subjects]
+
+    return study
+
+
+@pytest.fixture(scope="session")
+def per_subject_medians() -> dict:
+    """
+    Fixture of the median seconds per subject
+    of each benchmark at each scale, so larger
+    scales can be checked against smaller ones
+    """
+    return {}
+
+
+@pytest.fixture
+def stub_qunex_container(tmp_path, monkeypatch) -> str:
+    """
+    Fixture putting a stub qunex_container on
+    PATH that prints the file given by
+    QPIPELINE_BENCHMARK_OUTPUT, so run_cmd can
+    be benchmarked offline
+    """
+    stub = tmp_path / "qunex_container"
+    stub.write_text('#!/bin/sh\ncat "$QPIPELINE_BENCHMARK_OUTPUT"\n')
+    stub.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    return str(stub)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config) -> None:
+    """
+    Store saved benchmark results in
+    benchmarks/results rather than the
+    current folder, unless told otherwise
+    """
+    if getattr(config.option, "benchmark_storage", None) == "file://./.benchmarks":
+        config.option.benchmark_storage = f"file://{BENCHMARKS}/results"
@@ -0,0 +1,192 @@
+"""
+Benchmarks of the parts of qpipeline that grow with
+the number of subjects, on synthetic studies of 10,
+1k and 50k subjects (see conftest.py). qunex is
+replaced by a stub qunex_container so they run offline.
+
+Run with: python -m pytest benchmarks/test_orchestration.py
+
+Before a release save the results and compare them
+with the last saved run, failing if anything is slower:
+
+    python -m pytest benchmarks/test_orchestration.py \\
+        --benchmark-autosave --benchmark-compare \\
+        --benchmark-compare-fail=median:25%
+
+Results are saved in benchmarks/results. The scales can
+be changed with QPIPELINE_BENCHMARK_SCALES. Within a run
+the time per subject at each scale must be within
+QPIPELINE_SCALING_LIMIT (default 4) times the time per
+subject at the scale before, so anything that scales
+worse than linearly fails without a saved run.
+"""
+
+import os
+import shutil
+import pytest
+from conftest import scales
+
+pytest.importorskip("pytest_benchmark")
+
+from qpipeline.base.utils import run_cmd, check_logs  # noqa: E402
+from qpipeline.base.check_inputs import check_bids_folder  # noqa: E402
+from qpipeline.base.comlogs import comlog_index_path  # noqa: E402
+from qpipeline.qunex_setup.study_setup import (  # noqa: E402
+    Scan_Mapping,
+    parse_output,
+    map_scans,
+    map_files,
+)
+
+SCALING_LIMIT = float(os.environ.get("QPIPELINE_SCALING_LIMIT", 4))
+
+
+def rounds(subjects: int) -> int:
+    """
+    Function to return how many rounds
+    to run a benchmark for, fewer for
+    larger studies
+    """
+    return max(3, min(50, 10000 // subjects))
+
+
+def check_scaling(benchmark, per_subject_medians: dict, name: str, subjects: int):
+    """
+    Function to record the median time per subject
+    of a benchmark and check it hasn't grown more
+    than SCALING_LIMIT times since the scale before
+    """
+    if benchmark.disabled or not benchmark.stats:
+        return None
+    per_subject = benchmark.stats.stats.median / subjects
+    benchmark.extra_info["subjects"] = subjects
+    benchmark.extra_info["us_per_subject"] = per_subject * 1e6
+    medians = per_subject_medians.setdefault(name, {})
+    smaller = [scale for scale in medians if scale < subjects]
+    medians[subjects] = per_subject
+    if not smaller:
+        return None
+    previous = medians[max(smaller)]
+    assert per_subject < previous * SCALING_LIMIT, (
+        f"{name} took {per_subject * 1e6:.1f}us per subject at {subjects} subjects, "
+        f"over {SCALING_LIMIT}x the {previous * 1e6:.1f}us at {max(smaller)} subjects"
+    )
+
+
+@pytest.fixture
+def bids_cache(tmp_path, monkeypatch) -> str:
+    """
+    Fixture of an empty bids index cache
+    """
+    cache = str(tmp_path / "bids_index")
+    monkeypatch.setenv("QPIPELINE_BIDS_CACHE", cache)
+    return cache
+
+
+@pytest.mark.parametrize("subjects", scales())
+def test_check_bids_folder_cold(
+    benchmark, synthetic_studies, per_subject_medians, bids_cache, subjects
+):
+    raw_data = synthetic_studies(subjects)["raw_data"]
+    benchmark.pedantic(
+        check_bids_folder,
+        args=(raw_data,),
+        setup=lambda: shutil.rmtree(bids_cache, ignore_errors=True),
+        rounds=rounds(subjects),
+    )
+    check_scaling(benchmark, per_subject_medians, "check_bids_folder_cold", subjects)
+
+
+@pytest.mark.parametrize("subjects", scales())
+def test_check_bids_folder_cached(
+    benchmark, synthetic_studies, per_subject_medians, bids_cache, subjects
+):
+    raw_data = synthetic_studies(subjects)["raw_data"]
+    check_bids_folder(raw_data)
+    benchmark.pedantic(check_bids_folder, args=(raw_data,), rounds=rounds(subjects))
+    check_scaling(benchmark, per_subject_medians, "check_bids_folder_cached", subjects)
+
+
+@pytest.mark.parametrize("subjects", scales())
+def test_parse_output(
+    benchmark, synthetic_studies, per_subject_medians, tmp_path, subjects
+):
+    output = synthetic_studies(subjects)["import_bids_output"]
+    benchmark.pedantic(
+        parse_output, args=(output, str(tmp_path)), rounds=rounds(subjects)
+    )
+    assert (tmp_path / "hcp_mapping_file.txt").read_text().startswith("1 => T1w")
+    check_scaling(benchmark, per_subject_medians, "parse_output", subjects)
+
+
+@pytest.mark.parametrize("subjects", scales())
+def test_map_scans(benchmark, synthetic_studies, per_subject_medians, subjects):
+    pattern = Scan_Mapping().pattern
+    labels = [
+        match.group(2)
+        for match in pattern.finditer(synthetic_studies(subjects)["import_bids_output"])
+    ]
+    file_mapping = map_files()
+    mapped = benchmark.pedantic(
+        lambda: [map_scans(file_mapping, label) for label in labels],
+        rounds=rounds(subjects),
+    )
+    assert mapped[:3] == ["T1w", "T2w", "DWI:dir98-AP"]
+    check_scaling(benchmark, per_subject_medians, "map_scans", subjects)
+
+
+@pytest.mark.parametrize("subjects", scales())
+def test_check_logs_cold(benchmark, synthetic_studies, per_subject_medians, subjects):
+    study_folder = synthetic_studies(subjects)["study_folder"]
+    latest = benchmark.pedantic(
+        check_logs,
+        args=(study_folder, "freesurfer"),
+        setup=lambda: (
+            os.remove(comlog_index_path(study_folder))
+            if os.path.exists(comlog_index_path(study_folder))
+            else None
+        ),
+        rounds=rounds(subjects),
+    )
+    assert latest[0] == "done"
+    check_scaling(benchmark, per_subject_medians, "check_logs_cold", subjects)
+
+
+@pytest.mark.parametrize("subjects", scales())
+def test_check_logs_indexed(
+    benchmark, synthetic_studies, per_subject_medians, subjects
+):
+    study_folder = synthetic_studies(subjects)["study_folder"]
+    comlogs = os.path.join(study_folder, "processing", "logs", "comlogs")
+    # The index is only trusted once the comlogs haven't changed for a while
+    os.utime(comlogs, (0, 0))
+    check_logs(study_folder, "freesurfer")
+    latest = benchmark.pedantic(
+        check_logs, args=(study_folder, "freesurfer"), rounds=rounds(subjects)
+    )
+    assert latest[0] == "done"
+    check_scaling(benchmark, per_subject_medians, "check_logs_indexed", subjects)
+
+
+@pytest.mark.parametrize("subjects", scales())
+def test_run_cmd(
+    benchmark,
+    synthetic_studies,
+    per_subject_medians,
+    stub_qunex_container,
+    tmp_path,
+    monkeypatch,
+    subjects,
+):
+    output = tmp_path / "import_bids.out"
+    output.write_text(synthetic_studies(subjects)["import_bids_output"])
+    monkeypatch.setenv("QPIPELINE_BENCHMARK_OUTPUT", str(output))
+    mapping = Scan_Mapping()
+    ran = benchmark.pedantic(
+        run_cmd,
+        args=(f"qunex_container import_bids --sessionsfolder={tmp_path}",),
+        kwargs={"consumers": [mapping], "log_file": str(tmp_path / "import.log")},
+        rounds=rounds(subjects),
+    )
+    assert ran["returncode"] == 0 and mapping.mapped_files["1"] == "T1w"
+    check_scaling(benchmark, per_subject_medians, "run_cmd", subjects)
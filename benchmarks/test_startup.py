@@ -0,0 +1,107 @@
+"""
+Startup time of the qpipeline cli.
+
+Wrappers call qpipeline many times, so importing
+the cli and parsing arguments must stay cheap.
+Heavy modules are only imported by the subcommand
+that needs them.
+
+Run with: python -m pytest benchmarks/test_startup.py
+
+The import budget (ms) can be changed with
+QPIPELINE_STARTUP_BUDGET_MS.
+"""
+
+import os
+import re
+import sys
+import statistics
+import subprocess
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_MS = float(os.environ.get("QPIPELINE_STARTUP_BUDGET_MS", 60))
+RUNS = 7
+
+# Modules only the subcommands doing the work should import.
+HEAVY_MODULES = [
+    "tqdm",
+    "subprocess",
+    "threading",
+    "sqlite3",
+    "configparser",
+    "concurrent.futures",
+    "xml.etree.ElementTree",
+    "qpipeline.base.schedulers",
+    "qpipeline.base.cluster_support",
+]
+
+PARSE_ARGS = """
+import sys
+sys.argv = {argv}
+from qpipeline.base.args import qpipeline_args
+try:
+    qpipeline_args()
+except SystemExit:
+    pass
+print(",".join(sorted(sys.modules)), file=sys.stderr)
+"""
+
+
+def run_python(code: str, *flags) -> subprocess.CompletedProcess:
+    """
+    Function to run python code
+    in a fresh interpreter
+    """
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=REPO,
+        env={**os.environ, "PYTHONPATH": REPO},
+    )
+
+
+def import_time_ms(module: str) -> float:
+    """
+    Function to get the cumulative import
+    time of a module in ms using -X importtime
+    """
+    output = run_python(f"import {module}", "-X", "importtime").stderr
+    match = re.search(rf"\|\s*(\d+) \|\s*{re.escape(module)}$", output, re.MULTILINE)
+    assert match, output
+    return int(match.group(1)) / 1000
+
+
+def imported_modules(argv: list) -> set:
+    """
+    Function to get the modules imported
+    by parsing a qpipeline command line
+    """
+    output = run_python(PARSE_ARGS.format(argv=argv)).stderr
+    return set(output.strip().splitlines()[-1].split(","))
+
+
+def test_cli_import_time_within_budget():
+    timings = [import_time_ms("qpipeline.__main__") for _ in range(RUNS)]
+    median = statistics.median(timings)
+    print(f"qpipeline.__main__ import: median {median:.1f}ms of {RUNS} runs")
+    assert median < BUDGET_MS, (
+        f"Importing the cli took {median:.1f}ms, over the {BUDGET_MS}ms budget"
+    )
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["qpipeline"],
+        ["qpipeline", "setup", "--help"],
+        ["qpipeline", "structural", "--help"],
+        ["qpipeline", "diffusion", "--help"],
+        ["qpipeline", "status", "--help"],
+        ["qpipeline", "cleanup", "--help"],
+    ],
+)
+def test_parsing_args_imports_nothing_heavy(argv):
+    heavy = [module for module in HEAVY_MODULES if module in imported_modules(argv)]
+    assert not heavy, f"{' '.join(argv)} imported {', '.join(heavy)}"
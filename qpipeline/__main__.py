@@ -1,13 +1,12 @@
-from qpipeline.base.args import qpipeline_args
-from qpipeline.base.setup import set_environment
-from qpipeline.base.Qpipeline import Qpipeline
+from qpipeline.base.args import qpipeline_args, profile_option
 from qpipeline.base.signit import Signit_handler
-from qpipeline.base.check_inputs import check_input
 
 
 def main() -> None:
     """
-    Main function of qpipeline
+    Main function of qpipeline.
+    With --profile the subcommand
+    is ran under a profiler.
 
     Parameters
     ----------
@@ -18,13 +17,44 @@ def main() -> None:
     None
     """
     Signit_handler()
+    profile_file = profile_option()
+    if profile_file:
+        from qpipeline.base.profiling import Profile_Run
+
+        Profile_Run(profile_file).run(run_subcommand)
+    else:
+        run_subcommand()
+    exit()
+
+
+def run_subcommand() -> None:
+    """
+    Function to parse the command line
+    and run the subcommand
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    """
     args = qpipeline_args()
-    check_input(args)
+    from qpipeline.base.metrics import metrics, span
+    from qpipeline.base.check_inputs import check_input
+    from qpipeline.base.Qpipeline import Qpipeline
+
+    metrics.start(args["command"], args["study_folder"])
+    with span("qpipeline_check_input_seconds", command=args["command"]):
+        check_input(args)
     if args["load"]:
+        from qpipeline.base.setup import set_environment
+
         set_environment()
     pipeline = Qpipeline()
     pipeline.qpipeline_handler(args["command"], args)
-    exit()
+    metrics.write()
 
 
 if __name__ == "__main__":
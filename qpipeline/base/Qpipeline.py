@@ -38,6 +38,30 @@ class Qpipeline:
 
         hcp_diffusion(kwargs)
 
+    def attach(self, **kwargs):
+        """
+        Attach entry method
+        """
+        from qpipeline.monitoring.run_monitoring import attach_run
+
+        attach_run(kwargs)
+
+    def status(self, **kwargs):
+        """
+        Status entry method
+        """
+        from qpipeline.monitoring.run_monitoring import run_status
+
+        run_status(kwargs)
+
+    def cleanup(self, **kwargs):
+        """
+        Cleanup entry method
+        """
+        from qpipeline.base.tombstones import clean_up_tombstones
+
+        clean_up_tombstones(kwargs)
+
     def qpipeline_handler(self, command: str, args: str):
         """
         Method to determine what part of the pipeline
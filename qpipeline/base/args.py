@@ -1,6 +1,6 @@
 import argparse
 import sys
-from qpipeline.base.check_inputs import valid_data_types
+import os
 
 
 def splash() -> str:
@@ -41,7 +41,7 @@ def valid_options() -> list:
     list: list object
         list of valid option
     """
-    return ["setup", "structural", "diffusion"]
+    return ["setup", "structural", "diffusion", "attach", "status", "cleanup"]
 
 
 def usage_message() -> None:
@@ -67,8 +67,15 @@ It consists of the following subcommands:
     - setup (qunex folder HCP set up)
     - strucutral (pre-freesurfer, freesurfer, post-freesurfer)
     - diffusion (HCP diffusion pipeline)
+    - attach (pick up monitoring of the last run)
+    - status (status of the last run)
+    - cleanup (delete old study folders left by overwrite)
 
 run qpipeline sub_command --help for further info
+
+qpipeline --profile[=FILE] sub_command ... runs sub_command
+under a profiler, writing the profile to FILE and a summary
+of where the time went to FILE.txt
     """)
     exit(0)
 
@@ -97,6 +104,37 @@ def invalid_options(option: str, avaiable_options: list) -> None:
     exit(1)
 
 
+def profile_option() -> str:
+    """
+    Function to take --profile[=FILE]
+    off the command line. It is given
+    before the subcommand so it is
+    removed before the subcommand is
+    checked.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: string object
+        path to write profile to or
+        None if not profiling
+    """
+    if len(sys.argv) <= 1 or sys.argv[1].split("=")[0] != "--profile":
+        return None
+    option = sys.argv.pop(1)
+    if option.startswith("--profile="):
+        return os.path.abspath(option.split("=", 1)[1])
+    from datetime import datetime
+
+    command = sys.argv[1] if sys.argv[1:] and sys.argv[1] in valid_options() else "run"
+    return os.path.abspath(
+        f"qpipeline_{command}_{datetime.now().strftime('%Y-%m-%d_%H.%M.%S')}.prof"
+    )
+
+
 def check_subcommand() -> None:
     """
     Function to check the subcommand
@@ -118,14 +156,16 @@ def check_subcommand() -> None:
         invalid_options(sys.argv[1], avaiable_options)
 
 
-def qpipeline_modules() -> object:
+def qpipeline_modules(command: str) -> object:
     """
-    Function to set up
-    base parser and add subparsers
+    Function to set up base parser
+    and add the subparser of the
+    subcommand being ran.
 
     Parameters
     ----------
-    None
+    command: str
+        subcommand being ran
 
     Returns
     -------
@@ -139,9 +179,15 @@ def qpipeline_modules() -> object:
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     subparsers = base_parser.add_subparsers(dest="command")
-    hcp_setup_args(subparsers)
-    strucutral_commands(subparsers)
-    diffusion_commands(subparsers)
+    subcommand_args = {
+        "setup": hcp_setup_args,
+        "structural": strucutral_commands,
+        "diffusion": diffusion_commands,
+        "attach": run_monitoring_commands,
+        "status": run_monitoring_commands,
+        "cleanup": cleanup_commands,
+    }
+    subcommand_args[command](subparsers)
     return base_parser
 
 
@@ -188,6 +234,8 @@ def hcp_setup_args(args) -> dict:
     dict: dictionary
         dict of cmd args
     """
+    from qpipeline.base.check_inputs import valid_data_types
+
     study_setup_args = args.add_parser("setup", help="Set up study")
     default_args(study_setup_args)
     study_setup_args.add_argument(
@@ -197,6 +245,14 @@ def hcp_setup_args(args) -> dict:
         dest="overwrite",
         action="store_true",
     )
+    study_setup_args.add_argument(
+        "-i",
+        "--incremental",
+        help="""Add subjects in the raw data that aren't in the study yet,
+        leaving sessions already set up alone""",
+        dest="incremental",
+        action="store_true",
+    )
     study_setup_args.add_argument(
         "-r",
         "--raw_data",
@@ -222,6 +278,40 @@ def hcp_setup_args(args) -> dict:
         Must be called hcp_batch.txt""",
         dest="batch",
     )
+    study_setup_args.add_argument(
+        "-w",
+        "--workers",
+        help="""Max number of shards of subjects to set up at once.
+        Default is the number of cpus""",
+        dest="workers",
+        type=int,
+    )
+    study_setup_args.add_argument(
+        "-z",
+        "--shard_size",
+        help="""Number of subjects in each shard. Default is to share
+        the subjects between the workers, at most 50 a shard""",
+        dest="shard_size",
+        type=int,
+    )
+    study_setup_args.add_argument(
+        "-a",
+        "--import_action",
+        help="""How images are imported into the study. link hardlinks them
+        (falling back to copying), copy copies them. auto (default) links
+        if raw data can be hardlinked into the study folder""",
+        choices=["auto", "link", "copy"],
+        default="auto",
+        dest="import_action",
+    )
+    study_setup_args.add_argument(
+        "-I",
+        "--stage_image",
+        help="""Copy the qunex container image to node-local storage
+        (QPIPELINE_SCRATCH, TMPDIR or /tmp) once per node and run it from there""",
+        dest="stage_image",
+        action="store_true",
+    )
 
 
 def strucutral_commands(args) -> dict:
@@ -239,6 +329,8 @@ def strucutral_commands(args) -> dict:
     dict: dictionary
         dict of cmd args
     """
+    from qpipeline.base.check_inputs import valid_schedulers
+
     strucutral_args = args.add_parser(
         "structural", help="To run pre-freesurfer/freesurfer/post freesurfer of HCP"
     )
@@ -250,9 +342,103 @@ def strucutral_commands(args) -> dict:
         Leave this as none if not running on cluster""",
         dest="queue",
     )
+    strucutral_args.add_argument(
+        "-S",
+        "--scheduler",
+        help="""Which scheduler to submit to with --queue.
+        fake is a local stand in for a slurm cluster. Default is slurm""",
+        choices=valid_schedulers(),
+        default="slurm",
+        dest="scheduler",
+    )
     strucutral_args.add_argument(
         "-F", "--FLAIR", help="Is T2 a FLAIR image", dest="flair", action="store_true"
     )
+    strucutral_args.add_argument(
+        "-C",
+        "--chain",
+        help="""Submit pre-freesurfer, freesurfer, post-freesurfer and diffusion
+        as one chain of dependent jobs and exit. Needs --queue""",
+        dest="chain",
+        action="store_true",
+    )
+    strucutral_args.add_argument(
+        "-N",
+        "--no_gpu",
+        help="Don't use eddy GPU for the diffusion part of --chain",
+        dest="no_gpu",
+        action="store_true",
+    )
+    strucutral_args.add_argument(
+        "-A",
+        "--array",
+        help="""Submit each stage as a slurm array job
+        with one task per session in processing/batch.txt. Needs --queue""",
+        dest="array",
+        action="store_true",
+    )
+    strucutral_args.add_argument(
+        "-M",
+        "--max_running",
+        help="Max number of array tasks to run at once",
+        dest="max_running",
+        type=int,
+    )
+    strucutral_args.add_argument(
+        "-w",
+        "--workers",
+        help="""Max number of sessions to run at once when not using a queue.
+        Default is as many as the cpus and memory allow""",
+        dest="workers",
+        type=int,
+    )
+    strucutral_args.add_argument(
+        "-c",
+        "--resource_config",
+        help="""ini file of resources (cpus, memory, gpus, time, partition, qos)
+        with a section per stage, or [all]""",
+        dest="resource_config",
+    )
+    strucutral_args.add_argument(
+        "-R",
+        "--resource",
+        help="""Override a stage's resources, given as STAGE.KEY=VALUE
+        (e.g. freesurfer.memory=16000). STAGE can be all. Can be given more than once""",
+        dest="resource",
+        action="append",
+    )
+    strucutral_args.add_argument(
+        "-H",
+        "--no_history",
+        help="""Don't size time and memory from previous runs or
+        record this run in the job history""",
+        dest="no_history",
+        action="store_true",
+    )
+    strucutral_args.add_argument(
+        "-r",
+        "--resume",
+        help="""Only run sessions that haven't already finished each stage,
+        going by the qunex comlogs and output files""",
+        dest="resume",
+        action="store_true",
+    )
+    strucutral_args.add_argument(
+        "-I",
+        "--stage_image",
+        help="""Copy the qunex container image to node-local storage
+        (QPIPELINE_SCRATCH, TMPDIR or /tmp) once per node and run it from there""",
+        dest="stage_image",
+        action="store_true",
+    )
+    strucutral_args.add_argument(
+        "-T",
+        "--stage_sessions",
+        help="""Run each session in node-local scratch (QPIPELINE_SCRATCH, TMPDIR
+        or /tmp) and sync it back to the study when done. Needs --array with a queue""",
+        dest="stage_sessions",
+        action="store_true",
+    )
 
 
 def diffusion_commands(args) -> dict:
@@ -270,6 +456,8 @@ def diffusion_commands(args) -> dict:
     dict: dictionary
         dict of cmd args
     """
+    from qpipeline.base.check_inputs import valid_schedulers
+
     diffusion_args = args.add_parser("diffusion", help="To run HCP diffusion pipeline")
     default_args(diffusion_args)
     diffusion_args.add_argument(
@@ -279,6 +467,15 @@ def diffusion_commands(args) -> dict:
         Leave this as none if not running on cluster""",
         dest="queue",
     )
+    diffusion_args.add_argument(
+        "-S",
+        "--scheduler",
+        help="""Which scheduler to submit to with --queue.
+        fake is a local stand in for a slurm cluster. Default is slurm""",
+        choices=valid_schedulers(),
+        default="slurm",
+        dest="scheduler",
+    )
     diffusion_args.add_argument(
         "-N",
         "--no_gpu",
@@ -286,6 +483,149 @@ def diffusion_commands(args) -> dict:
         dest="no_gpu",
         action="store_true",
     )
+    diffusion_args.add_argument(
+        "-A",
+        "--array",
+        help="""Submit each stage as a slurm array job
+        with one task per session in processing/batch.txt. Needs --queue""",
+        dest="array",
+        action="store_true",
+    )
+    diffusion_args.add_argument(
+        "-M",
+        "--max_running",
+        help="Max number of array tasks to run at once",
+        dest="max_running",
+        type=int,
+    )
+    diffusion_args.add_argument(
+        "-w",
+        "--workers",
+        help="""Max number of sessions to run at once when not using a queue.
+        Default is as many as the cpus and memory allow""",
+        dest="workers",
+        type=int,
+    )
+    diffusion_args.add_argument(
+        "-c",
+        "--resource_config",
+        help="""ini file of resources (cpus, memory, gpus, time, partition, qos)
+        with a section per stage, or [all]""",
+        dest="resource_config",
+    )
+    diffusion_args.add_argument(
+        "-R",
+        "--resource",
+        help="""Override a stage's resources, given as STAGE.KEY=VALUE
+        (e.g. freesurfer.memory=16000). STAGE can be all. Can be given more than once""",
+        dest="resource",
+        action="append",
+    )
+    diffusion_args.add_argument(
+        "-H",
+        "--no_history",
+        help="""Don't size time and memory from previous runs or
+        record this run in the job history""",
+        dest="no_history",
+        action="store_true",
+    )
+    diffusion_args.add_argument(
+        "-r",
+        "--resume",
+        help="""Only run sessions that haven't already finished each stage,
+        going by the qunex comlogs and output files""",
+        dest="resume",
+        action="store_true",
+    )
+    diffusion_args.add_argument(
+        "-I",
+        "--stage_image",
+        help="""Copy the qunex container image to node-local storage
+        (QPIPELINE_SCRATCH, TMPDIR or /tmp) once per node and run it from there""",
+        dest="stage_image",
+        action="store_true",
+    )
+    diffusion_args.add_argument(
+        "-T",
+        "--stage_sessions",
+        help="""Run each session in node-local scratch (QPIPELINE_SCRATCH, TMPDIR
+        or /tmp) and sync it back to the study when done. Needs --array with a queue""",
+        dest="stage_sessions",
+        action="store_true",
+    )
+
+
+def run_monitoring_commands(args) -> None:
+    """
+    Function to take attach and
+    status arguments
+
+    Parameters
+    ----------
+    args: object
+        ArgParser object
+
+    Returns
+    -------
+    None
+    """
+    attach_args = args.add_parser(
+        "attach",
+        help="""Pick up monitoring of the last structural or diffusion run
+        of a study and submit any stages still to run""",
+    )
+    default_args(attach_args)
+    from qpipeline.base.comlogs import stage_order
+
+    status_args = args.add_parser(
+        "status",
+        help="Show the status of the last run of a study and of every session",
+    )
+    default_args(status_args)
+    status_args.add_argument(
+        "-t",
+        "--stage",
+        help="Only show this stage",
+        choices=stage_order(),
+        dest="stage",
+    )
+    status_args.add_argument(
+        "-f",
+        "--state",
+        help="""List the sessions in this state, one per line
+        (with the stage unless --stage is given)""",
+        choices=["done", "failed", "running", "not_run"],
+        dest="state",
+    )
+
+
+def cleanup_commands(args) -> None:
+    """
+    Function to take cleanup
+    arguments
+
+    Parameters
+    ----------
+    args: object
+        ArgParser object
+
+    Returns
+    -------
+    None
+    """
+    cleanup_args = args.add_parser(
+        "cleanup",
+        help="""Delete old copies of a study folder left behind when
+        deleting them after --overwrite was interrupted""",
+    )
+    default_args(cleanup_args)
+    cleanup_args.add_argument(
+        "-w",
+        "--workers",
+        help="Number of folders to delete at once. Default is 16",
+        dest="workers",
+        type=int,
+    )
 
 
 def qpipeline_args() -> dict:
@@ -303,7 +643,7 @@ def qpipeline_args() -> dict:
         dict of all args
     """
     check_subcommand()
-    parser = qpipeline_modules()
+    parser = qpipeline_modules(sys.argv[1])
     args = parser.parse_args()
 
     # If no arguments after subcommand, show help for that subparser
@@ -313,5 +653,7 @@ def qpipeline_args() -> dict:
         parser.parse_args(["structural", "--help"])
     if args.command == "diffusion" and len(sys.argv) <= 3:
         parser.parse_args(["diffusion", "--help"])
+    if args.command in ["attach", "status", "cleanup"] and len(sys.argv) <= 3:
+        parser.parse_args([args.command, "--help"])
 
     return vars(args)
@@ -0,0 +1,297 @@
+import os
+import json
+import hashlib
+
+
+def bids_cache_folder() -> str:
+    """
+    Function to return the folder
+    bids indexes are cached in. Can be
+    set with QPIPELINE_BIDS_CACHE.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: path
+        path to cache folder
+    """
+    return os.environ.get(
+        "QPIPELINE_BIDS_CACHE",
+        os.path.join(os.path.expanduser("~"), ".qpipeline", "bids_index"),
+    )
+
+
+def required_modalities() -> list:
+    """
+    Function to return the modality
+    folders every session needs
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list: list object
+        list of modalities
+    """
+    return ["anat", "dwi"]
+
+
+def is_image(name: str) -> bool:
+    """
+    Function to check if a
+    file is a nifti image
+
+    Parameters
+    ----------
+    name: str
+        file name
+
+    Returns
+    -------
+    bool: boolean
+        True if nifti image
+    """
+    return name.endswith(".nii.gz") or name.endswith(".nii")
+
+
+def scan_session(path: str, mtimes: dict, raw_data: str) -> dict:
+    """
+    Function to list the images in each
+    modality folder of a session (or a
+    subject without sessions).
+
+    Parameters
+    ----------
+    path: str
+        path to session folder
+    mtimes: dict
+        dict of relative path: mtime
+        updated with every folder read
+    raw_data: str
+        path to raw data
+
+    Returns
+    -------
+    dict: dictionary
+        dict of modality: list of images
+    """
+    modalities = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("ses-") or not entry.is_dir():
+                continue
+            with os.scandir(entry.path) as files:
+                modalities[entry.name] = sorted(
+                    image.name for image in files if is_image(image.name)
+                )
+            mtimes[os.path.relpath(entry.path, raw_data)] = entry.stat().st_mtime
+    return modalities
+
+
+def index_subject(raw_data: str, subject: str, cached: dict = None) -> dict:
+    """
+    Function to index one subject. The cached
+    index is reused if no folder it was built
+    from has changed.
+
+    Parameters
+    ----------
+    raw_data: str
+        path to raw data
+    subject: str
+        subject folder name
+    cached: dict
+        cached index of subject.
+        Default is None
+
+    Returns
+    -------
+    dict: dictionary
+        dict with mtimes (relative path: mtime)
+        and sessions (session: modality: images).
+        Subjects without sessions have one
+        session called ""
+    """
+    if cached:
+        try:
+            if all(
+                os.stat(os.path.join(raw_data, path)).st_mtime == mtime
+                for path, mtime in cached["mtimes"].items()
+            ):
+                return cached
+        except OSError:
+            pass
+    subject_path = os.path.join(raw_data, subject)
+    mtimes = {subject: os.stat(subject_path).st_mtime}
+    sessions = {}
+    with os.scandir(subject_path) as entries:
+        session_folders = [
+            entry
+            for entry in entries
+            if entry.name.startswith("ses-") and entry.is_dir()
+        ]
+    for session in session_folders:
+        mtimes[os.path.relpath(session.path, raw_data)] = session.stat().st_mtime
+        sessions[session.name] = scan_session(session.path, mtimes, raw_data)
+    subject_level = scan_session(subject_path, mtimes, raw_data)
+    if subject_level or not sessions:
+        sessions[""] = subject_level
+    return {"mtimes": mtimes, "sessions": sessions}
+
+
+class Bids_Index:
+    """
+    Class to index a bids folder in one pass,
+    reading subjects concurrently. The index is
+    cached and only subjects whose folders have
+    changed are read again.
+
+    Usage
+    -----
+    index = Bids_Index(raw_data)
+    index.build()
+    index.missing()
+    """
+
+    def __init__(self, raw_data: str) -> None:
+        self.raw_data = os.path.abspath(raw_data)
+        self.cache_path = os.path.join(
+            bids_cache_folder(),
+            f"{hashlib.sha1(self.raw_data.encode()).hexdigest()}.json",
+        )
+        self.subjects = {}
+
+    def load_cache(self) -> dict:
+        """
+        Method to load the cached index
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict: dictionary
+            dict of subject: index.
+            Empty if there isn't one.
+        """
+        try:
+            with open(self.cache_path) as cache:
+                cached = json.load(cache)
+        except (OSError, ValueError):
+            return {}
+        return (
+            cached.get("subjects", {})
+            if cached.get("raw_data") == self.raw_data
+            else {}
+        )
+
+    def save_cache(self) -> None:
+        """
+        Method to save the index. Failing
+        to save it is not an error.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(f"{self.cache_path}.tmp", "w") as cache:
+                json.dump({"raw_data": self.raw_data, "subjects": self.subjects}, cache)
+            os.replace(f"{self.cache_path}.tmp", self.cache_path)
+        except OSError as e:
+            print(f"Unable to cache bids index: {e}")
+
+    def build(self, workers: int = None) -> dict:
+        """
+        Method to build the index
+
+        Parameters
+        ----------
+        workers: int
+            number of folders read at
+            once. Default is None (32)
+
+        Returns
+        -------
+        dict: dictionary
+            dict of subject: index
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        cached = self.load_cache()
+        with os.scandir(self.raw_data) as entries:
+            subjects = sorted(
+                entry.name
+                for entry in entries
+                if entry.name.startswith("sub-") and entry.is_dir()
+            )
+        with ThreadPoolExecutor(max_workers=workers or 32) as pool:
+            indexes = pool.map(
+                lambda subject: index_subject(
+                    self.raw_data, subject, cached.get(subject)
+                ),
+                subjects,
+            )
+            self.subjects = dict(zip(subjects, indexes))
+        self.save_cache()
+        return self.subjects
+
+    def sessions(self) -> list:
+        """
+        Method to list every session
+        as (subject, session)
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list: list object
+            list of (subject, session)
+        """
+        return [
+            (subject, session)
+            for subject, index in self.subjects.items()
+            for session in index["sessions"]
+        ]
+
+    def missing(self, modalities: list = None) -> dict:
+        """
+        Method to find sessions without
+        images for a modality
+
+        Parameters
+        ----------
+        modalities: list
+            list of modalities. Default
+            is None (required_modalities)
+
+        Returns
+        -------
+        dict: dictionary
+            dict of (subject, session):
+            list of missing modalities
+        """
+        missing = {}
+        for subject, session in self.sessions():
+            found = self.subjects[subject]["sessions"][session]
+            absent = [
+                modality
+                for modality in modalities or required_modalities()
+                if not found.get(modality)
+            ]
+            if absent:
+                missing[(subject, session)] = absent
+        return missing
@@ -1,5 +1,4 @@
 import os
-from pathlib import Path
 from qpipeline.base.utils import error_and_exit
 
 
@@ -69,38 +68,13 @@ def check_complusory_arguments(args: dict) -> None:
         )
 
 
-def check_folder_recursively(base_path: str, folder: str) -> list:
-    """
-    Function to recusively search
-    for a given directory
-
-    Parameters
-    ----------
-    base_path: str
-        base path to search
-    folder: str
-        str of folder to search
-        for
-    Returns
-    -------
-    list: list object
-        list of path of given folder
-    """
-    return [path for path in Path(base_path).rglob(folder)]
-
-
-def check_folder_is_setup(path) -> bool:
-    try:
-        bidds_folder_path = path[0]
-    except IndexError:
-        return False
-    return True if os.listdir(bidds_folder_path) else False
-
-
 def check_bids_folder(bids_dir: str) -> None:
     """
-    Function to do the very basic
-    bids check that qunex needs.
+    Function to check every subject and
+    session in the bids directory has the
+    folders qunex needs. Sessions missing
+    any are reported, and it exits if
+    no session has them all.
 
     Parameters
     ----------
@@ -111,14 +85,28 @@ def check_bids_folder(bids_dir: str) -> None:
     -------
     None
     """
+    from qpipeline.base.bids_index import Bids_Index, required_modalities
+
     error_and_exit(os.path.isdir(bids_dir), "Bids Folder does not exists")
-    folders_to_look_for = ["anat", "dwi"]
-    for folder in folders_to_look_for:
-        folder_path = check_folder_recursively(bids_dir, folder)
-        everything_ok = check_folder_is_setup(folder_path)
-        error_and_exit(
-            everything_ok, f"{folder} not found. Please check bids directory"
-        )
+    index = Bids_Index(bids_dir)
+    index.build()
+    sessions = index.sessions()
+    error_and_exit(
+        sessions, f"No subjects found in {bids_dir}. Please check bids directory"
+    )
+    missing = index.missing()
+    for (subject, session), modalities in list(missing.items())[:20]:
+        name = os.path.join(subject, session) if session else subject
+        print(f"{name} is missing {', '.join(modalities)}")
+    if len(missing) > 20:
+        print(f"and {len(missing) - 20} more sessions")
+    error_and_exit(
+        len(missing) < len(sessions),
+        f"No session has {' and '.join(required_modalities())}. Please check bids directory",
+    )
+    print(
+        f"{len(sessions) - len(missing)} of {len(sessions)} sessions have everything needed"
+    )
 
 
 def check_input(args: dict) -> None:
@@ -147,6 +135,20 @@ def check_input(args: dict) -> None:
 
     if args["command"] == "setup":
         check_bids_folder(args["raw_data"])
+    if args.get("chain"):
+        error_and_exit(args.get("queue"), "--chain needs a queue given with --queue")
+    if args.get("array"):
+        error_and_exit(args.get("queue"), "--array needs a queue given with --queue")
+    if args.get("stage_sessions") and args.get("queue"):
+        error_and_exit(
+            args.get("array"),
+            "--stage_sessions needs --array so each job runs one session",
+        )
+    if args.get("resource_config"):
+        error_and_exit(
+            os.path.isfile(args["resource_config"]),
+            f"{args['resource_config']} does not exist",
+        )
 
 
 def valid_data_types() -> list:
@@ -164,3 +166,20 @@ def valid_data_types() -> list:
         list of accpetable datatypes
     """
     return ["hcp", "biobank"]
+
+
+def valid_schedulers() -> list:
+    """
+    Function to return the
+    available schedulers
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list: list object
+        list of scheduler names
+    """
+    return ["slurm", "sge", "local", "fake"]
@@ -1,9 +1,7 @@
 import re
 import time
-import threading
-from tqdm import tqdm
-import os
-from qpipeline.base.utils import error_and_exit, run_cmd
+from qpipeline.base.utils import error_and_exit
+from qpipeline.base.metrics import metrics
 
 
 def get_job_id(input_str) -> str:
@@ -29,6 +27,399 @@ def get_job_id(input_str) -> str:
     return job_number
 
 
+def job_dependency(job_ids: list) -> str:
+    """
+    Function to turn job IDs into the
+    colon separated form used by afterok.
+    Array tasks are collapsed into their
+    array job so the dependency waits on
+    every task.
+
+    Parameters
+    ----------
+    job_ids: list
+        list of job or array task ids
+
+    Returns
+    -------
+    str: string object
+        colon separated job ids
+    """
+    return ":".join(array_parents(job_ids))
+
+
+def array_parents(job_ids: list) -> list:
+    """
+    Function to replace array tasks
+    (123_4) with their array job (123)
+
+    Parameters
+    ----------
+    job_ids: list
+        list of job or array task ids
+
+    Returns
+    -------
+    list: list object
+        list of unique job ids
+    """
+    return list(dict.fromkeys(job.split("_")[0] for job in job_ids))
+
+
+def cluster_modules() -> list:
+    """
+    Function to return the modules
+    jobs need loaded on the cluster
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list: list object
+        list of modules
+    """
+    return ["qunex-img/0.100.0", "cuda-img/9.1"]
+
+
+def expand_array_id(job_id: str) -> list:
+    """
+    Function to expand a compressed
+    array id such as 123_[2-5%4] into
+    the ids of each task.
+
+    Parameters
+    ----------
+    job_id: str
+        job id from squeue/sacct
+
+    Returns
+    -------
+    list: list object
+        list of job ids
+    """
+    array_match = re.match(r"(\d+)_\[([\d,\-]+)(?:%\d+)?\]$", job_id)
+    if not array_match:
+        return [job_id]
+    tasks = []
+    for task_range in array_match.group(2).split(","):
+        first, _, last = task_range.partition("-")
+        tasks.extend(range(int(first), int(last or first) + 1))
+    return [f"{array_match.group(1)}_{task}" for task in tasks]
+
+
+def terminal_job_states() -> dict:
+    """
+    Function to return the scheduler states
+    a job can not leave, mapped to whether
+    the job should be treated as a failure.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict: dictionary
+        dict of state: failed
+    """
+    return {
+        "COMPLETED": False,
+        "FAILED": True,
+        "CANCELLED": True,
+        "TIMEOUT": True,
+        "OUT_OF_MEMORY": True,
+        "NODE_FAIL": True,
+        "PREEMPTED": True,
+        "BOOT_FAIL": True,
+        "DEADLINE": True,
+        "UNKNOWN": True,
+    }
+
+
+def query_scheduler(command: list) -> str:
+    """
+    Function to run a scheduler query.
+    Unlike run_cmd a failed query does not
+    exit qpipeline, as an unknown job ID
+    is an expected answer from the scheduler.
+
+    Parameters
+    ----------
+    command: list
+        command and arguments to run
+
+    Returns
+    -------
+    str: string object
+        stdout of the query or None
+        if the query failed
+    """
+    import subprocess
+
+    try:
+        output = subprocess.run(command, capture_output=True, text=True)
+    except OSError:
+        return None
+    if output.returncode != 0:
+        return None
+    return output.stdout
+
+
+def parse_job_states(output: str) -> dict:
+    """
+    Function to parse "<job id> <state>"
+    lines from squeue/sacct.
+
+    Parameters
+    ----------
+    output: str
+        stdout from squeue/sacct
+
+    Returns
+    -------
+    dict: dictionary
+        dict of job_id: state
+    """
+    states = {}
+    for line in output.splitlines():
+        fields = line.replace("|", " ").split()
+        if len(fields) < 2:
+            continue
+        for job in expand_array_id(fields[0]):
+            states[job] = fields[1].rstrip("+")
+    return states
+
+
+def poll_interval(
+    elapsed: float,
+    expected_runtime: float = None,
+    min_interval: float = 15,
+    max_interval: float = 600,
+) -> float:
+    """
+    Function to work out how long to wait
+    before the next queue check.
+
+    Backs off as the jobs run for longer,
+    polls faster as the expected runtime
+    approaches and then backs off again
+    if the jobs overrun.
+
+    Parameters
+    ----------
+    elapsed: float
+        seconds since the jobs were submitted
+    expected_runtime: float
+        expected seconds for the jobs to
+        finish. Default is None (unknown)
+    min_interval: float
+        shortest wait in seconds
+    max_interval: float
+        longest wait in seconds
+
+    Returns
+    -------
+    float: float object
+        seconds to wait
+    """
+    interval = elapsed * 0.25
+    if expected_runtime:
+        remaining = expected_runtime - elapsed
+        interval = min(interval, remaining / 2) if remaining > 0 else -remaining * 0.25
+    return max(min_interval, min(interval, max_interval))
+
+
+def headless() -> bool:
+    """
+    Function to check if qpipeline is
+    running without a terminal (e.g under
+    nohup or in a batch job), where progress
+    is printed as json lines instead.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    bool: boolean
+        True if stdout isn't a terminal
+    """
+    import sys
+
+    return not sys.stdout.isatty()
+
+
+class Job_Progress:
+    """
+    Class to report jobs changing state.
+    Shared by the queue monitor and
+    the local runner so both show
+    progress the same way.
+
+    In a terminal a tqdm progress bar is
+    shown. Headless, a timestamped json line
+    is printed only when a job changes state.
+
+    Usage
+    ----
+    progress = Job_Progress(number_of_jobs)
+    progress.changed(job_id, state)
+    progress.finished(job_id, state)
+    progress.close()
+    """
+
+    def __init__(self, total: int, is_headless: bool = None) -> None:
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.states = {}
+        self.headless = headless() if is_headless is None else is_headless
+        self.pbar = None
+        if self.headless:
+            self.event("started", total=total)
+            return None
+        from tqdm import tqdm
+
+        self.pbar = tqdm(total=total, desc="Jobs completed", unit="job")
+
+    def event(self, event: str, **fields) -> None:
+        """
+        Method to print a progress
+        event as a json line
+
+        Parameters
+        ----------
+        event: str
+            name of event
+        fields: dict
+            anything else to record
+
+        Returns
+        -------
+        None
+        """
+        import json
+        from datetime import datetime
+
+        print(
+            json.dumps(
+                {
+                    "time": datetime.now().isoformat(timespec="seconds"),
+                    "event": event,
+                    **fields,
+                }
+            ),
+            flush=True,
+        )
+
+    def changed(self, job_id: str, state: str) -> None:
+        """
+        Method to record a job's state
+        before it finishes (e.g PENDING
+        or RUNNING). Only changes are shown.
+
+        Parameters
+        ----------
+        job_id: str
+            job id
+        state: str
+            state of job
+
+        Returns
+        -------
+        None
+        """
+        if self.states.get(job_id) == state:
+            return None
+        self.states[job_id] = state
+        if self.headless:
+            self.event("job", job=job_id, state=state)
+            return None
+        self.show_states()
+
+    def show_states(self) -> None:
+        """
+        Method to show how many unfinished
+        jobs are in each state on the bar
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        counts = {}
+        for job_state in self.states.values():
+            counts[job_state.lower()] = counts.get(job_state.lower(), 0) + 1
+        self.pbar.set_postfix(counts, refresh=False)
+
+    def finished(self, job_id: str, state: str = "COMPLETED") -> None:
+        """
+        Method to record a job reaching
+        a terminal state.
+
+        Parameters
+        ----------
+        job_id: str
+            job id
+        state: str
+            terminal state of job
+
+        Returns
+        -------
+        None
+        """
+        failed = terminal_job_states().get(state, True)
+        self.done += 1
+        self.failed += failed
+        self.states.pop(job_id, None)
+        if self.headless:
+            self.event("job", job=job_id, state=state, done=self.done, total=self.total)
+            return None
+        if failed:
+            self.pbar.write(f"JOB {job_id} {state}. CHECK LOGS")
+        self.show_states()
+        self.pbar.update(1)
+
+    def wait(self, seconds: float) -> None:
+        """
+        Method to wait between queue checks.
+        In a terminal the bar is refreshed
+        every second so the elapsed time
+        keeps moving.
+
+        Parameters
+        ----------
+        seconds: float
+            seconds to wait
+
+        Returns
+        -------
+        None
+        """
+        if self.headless:
+            time.sleep(seconds)
+            return None
+        end = time.monotonic() + seconds
+        while (remaining := end - time.monotonic()) > 0:
+            time.sleep(min(remaining, 1))
+            self.pbar.refresh()
+
+    def close(self) -> None:
+        """
+        Method to close the progress bar
+        """
+        if self.headless:
+            self.event("finished", done=self.done, failed=self.failed, total=self.total)
+            return None
+        self.pbar.close()
+
+
 class Queue_Monitoring:
     """
     Class to Monitor cluster queue
@@ -36,110 +427,123 @@ class Queue_Monitoring:
 
     Usage
     ----
-    queue = Queue_Monitoring()
-    queue.monitor(list_of_job_ids)
+    queue = Queue_Monitoring(scheduler)
+    queue.monitor(list_of_job_ids, expected_runtime, stage)
     """
 
-    def __init__(self) -> None:
-        self.__spinner_running = True
+    def __init__(self, scheduler: object = None) -> None:
+        if scheduler is None:
+            from qpipeline.base.schedulers import get_scheduler
 
-    def monitor(self, job_id: list) -> None:
+            scheduler = get_scheduler()
+        self.scheduler = scheduler
+
+    def monitor(
+        self, job_id: list, expected_runtime: float = None, stage: str = None
+    ) -> dict:
         """
         Main method to monitor queue.
+        Returns as soon as every job
+        has reached a terminal state.
+        How long each job waited and ran
+        (to the nearest queue check) is
+        recorded in the run's metrics, for
+        jobs seen running.
 
         Parameters
         ----------
         job_id: list
             list of job_ids
+        expected_runtime: float
+            expected seconds for the jobs
+            to finish, used to poll faster
+            near completion. Default is None
+        stage: str
+            name of stage the jobs are,
+            used to label metrics.
+            Default is None
 
         Returns
         -------
-        None
+        dict: dictionary
+            dict of job_id: terminal state.
+            Jobs still running if monitoring
+            was interrupted are missing.
         """
-
-        self.__spinner_running = True
-        spinner_thread = threading.Thread(target=self.__spinner, daemon=True)
-        spinner_thread.start()
+        terminal_states = terminal_job_states()
+        progress = Job_Progress(len(job_id))
+        completed_jobs = {}
+        started_running = {}
+        stage = stage or "unknown"
         try:
-            with tqdm(
-                total=len(job_id),
-                desc="Jobs completed",
-                unit="job",
-            ) as pbar:
-                completed_jobs = []
-                time.sleep(100)
-                while True:
-                    for job in job_id:
-                        if job not in completed_jobs:
-                            running = self.__check_job(job)
-                            if not running:
-                                pbar.update(1)
-                                completed_jobs.append(job)
-
-                    if len(completed_jobs) == len(job_id):
-                        pbar.close()
+            start = time.monotonic()
+            progress.wait(poll_interval(0, expected_runtime))
+            while True:
+                outstanding = [job for job in job_id if job not in completed_jobs]
+                now = time.monotonic()
+                for job, state in self.__check_jobs(outstanding).items():
+                    if progress.states.get(job) != state:
+                        metrics.count(
+                            "qpipeline_job_state_changes_total",
+                            stage=stage,
+                            state=state,
+                        )
+                        metrics.event("job", job=job, state=state, stage=stage)
+                    if state not in terminal_states:
+                        if job not in started_running and state != "PENDING":
+                            started_running[job] = now
+                            metrics.observe(
+                                "qpipeline_job_queue_wait_seconds",
+                                now - start,
+                                stage=stage,
+                            )
+                        progress.changed(job, state)
+                        continue
+                    if job in started_running:
+                        metrics.observe(
+                            "qpipeline_job_run_seconds",
+                            now - started_running[job],
+                            stage=stage,
+                        )
+                    metrics.count(
+                        "qpipeline_jobs_finished_total", stage=stage, state=state
+                    )
+                    progress.finished(job, state)
+                    completed_jobs[job] = state
+
+                if len(completed_jobs) == len(job_id):
+                    progress.close()
+                    if not progress.headless:
                         print("All jobs have finihsed")
-                        break
-                    time.sleep(300)
+                    break
+                progress.wait(poll_interval(time.monotonic() - start, expected_runtime))
 
         except KeyboardInterrupt:
-            pbar.close()
-        finally:
-            self.__spinner_running = False
-            spinner_thread.join()
+            progress.close()
+        return completed_jobs
 
-    def __spinner(self) -> None:
-        """
-        Method to run spinner bar
-        while monitoring the queue.
+    def __check_jobs(self, job_ids: list) -> dict:
         """
-        hash_line = ""
-        max_hashes = 50
-        adding_hash = True
-
-        while self.__spinner_running:
-            if adding_hash:
-                hash_line += "#"
-                if len(hash_line) >= max_hashes:
-                    adding_hash = False
-            else:
-                hash_line = hash_line[:-1]
-                if len(hash_line) == 0:
-                    adding_hash = True
-
-            print(
-                f"\033[1B\r{hash_line.ljust(max_hashes)}\033[1A",
-                end="",
-            )
-            time.sleep(0.1)
-
-    def __check_job(self, job_id: str) -> bool:
-        """
-        Method to check job progress.
+        Method to check the progress of
+        all outstanding jobs with one
+        scheduler query.
 
         Parameters
         ----------
-        job_id: str
-            job ID of fsl sub job
+        job_ids: list
+            list of job IDs still running
 
         Returns
         -------
-        bool: boolean
-            True if job is still running
-            or False if completed.
+        dict: dictionary
+            dict of job_id: state for
+            jobs the scheduler knows about
         """
-        output = run_cmd(
-            [f"{os.path.join(os.environ['FSLDIR'], 'bin', 'fsl_sub_report')} {job_id}"]
-        )
-        if "Finished" in output["stdout"]:
-            return False
-        if "Failed" in output["stdout"]:
-            tqdm.write(f"JOB {job_id} FAILED. CHECK LOGS")
-            return False
-        return True
+        states = self.scheduler.status(job_ids)
+        return {job: states[job] for job in job_ids if job in states}
 
 
-def wait_for_me(command_output: str) -> None:
+def wait_for_me(command_output: str, expected_runtime: float = None) -> None:
     """
     Monitor the cluster for job status.
 
@@ -147,6 +551,9 @@ def wait_for_me(command_output: str) -> None:
     ----------
     command_output: str
         output of qunex cmd
+    expected_runtime: float
+        expected seconds for the jobs
+        to finish. Default is None
 
     Returns
     -------
@@ -155,4 +562,4 @@ def wait_for_me(command_output: str) -> None:
     """
     job_id = get_job_id(command_output)
     queue = Queue_Monitoring()
-    queue.monitor(job_id)
+    queue.monitor(job_id, expected_runtime)
@@ -0,0 +1,402 @@
+import os
+import re
+import json
+from qpipeline.base.utils import get_sessions
+
+
+def stage_order() -> list:
+    """
+    Function to return the HCP stages
+    in the order they depend on each other
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list: list object
+        list of stages
+    """
+    return ["pre_freesurfer", "freesurfer", "post_freesurfer", "diffusion"]
+
+
+def stage_outputs(study_folder: str, session: str, stage: str) -> list:
+    """
+    Function to return files a stage
+    leaves behind for a session once
+    it has finished.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    session: str
+        session id
+    stage: str
+        name of stage
+
+    Returns
+    -------
+    list: list object
+        list of file paths
+    """
+    hcp = os.path.join(study_folder, "sessions", session, "hcp", session)
+    return {
+        "pre_freesurfer": [
+            os.path.join(hcp, "T1w", "T1w_acpc_dc_restore_brain.nii.gz")
+        ],
+        "freesurfer": [os.path.join(hcp, "T1w", session, "mri", "aparc+aseg.mgz")],
+        "post_freesurfer": [os.path.join(hcp, "MNINonLinear", "ribbon.nii.gz")],
+        "diffusion": [os.path.join(hcp, "T1w", "Diffusion", "data.nii.gz")],
+    }[stage]
+
+
+def parse_comlog(file_name: str) -> tuple:
+    """
+    Function to parse a qunex comlog name of
+    the form status_command_time.log. hcp stage
+    logs are status_hcp_stage_session_time.log.
+
+    Parameters
+    ----------
+    file_name: str
+        name of comlog
+
+    Returns
+    -------
+    tuple: tuple object
+        (command, session, status, timestamp)
+        with session "" if the log isn't for one
+        session, or None if it's not a comlog
+    """
+    match = re.match(
+        r"^(done|error|tmp)_(.+)_(\d{4}-\d{2}-\d{2}_\d{2}\.\d{2}\.\d{2}\.\d+)\.log$",
+        file_name,
+    )
+    if not match:
+        return None
+    status, command, timestamp = match.groups()
+    for stage in stage_order():
+        if command.startswith(f"hcp_{stage}_"):
+            return f"hcp_{stage}", command[len(stage) + 5 :], status, timestamp
+    return command, "", status, timestamp
+
+
+def comlog_index_path(study_folder: str) -> str:
+    """
+    Function to return the path
+    of a study's comlog index
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    str: path
+        path to comlog index
+    """
+    return os.path.join(study_folder, "processing", "qpipeline", "comlog_index.json")
+
+
+class Comlog_Index:
+    """
+    Class to keep an index of the latest comlog
+    of every command and session, so the status
+    of a study doesn't need processing/logs/comlogs
+    listed every time. The folder is only listed
+    again when its mtime changes, and then only
+    new logs are parsed.
+
+    Usage
+    -----
+    index = Comlog_Index(study_folder)
+    index.update()
+    index.latest("hcp_freesurfer")
+    """
+
+    def __init__(self, study_folder: str) -> None:
+        self.study_folder = study_folder
+        self.comlogs = os.path.join(study_folder, "processing", "logs", "comlogs")
+        self.path = comlog_index_path(study_folder)
+        self.index = self.load()
+
+    def load(self) -> dict:
+        """
+        Method to load the index
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict: dictionary
+            comlog index, empty
+            if there isn't one
+        """
+        empty = {"mtime_ns": None, "files": [], "logs": {}}
+        try:
+            with open(self.path) as index:
+                return {**empty, **json.load(index)}
+        except (OSError, ValueError):
+            return empty
+
+    def save(self) -> None:
+        """
+        Method to save the index, creating
+        processing/qpipeline if needed. Failing
+        to save it is not an error.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(f"{self.path}.tmp", "w") as index:
+                json.dump(self.index, index)
+            os.replace(f"{self.path}.tmp", self.path)
+        except OSError as e:
+            print(f"Unable to save comlog index: {e}")
+
+    def add(self, file_name: str) -> None:
+        """
+        Method to add a comlog to the
+        index if it's the latest of its
+        command and session. A finished log
+        replaces a running one of the same
+        time as qunex renames tmp_ logs.
+
+        Parameters
+        ----------
+        file_name: str
+            name of comlog
+
+        Returns
+        -------
+        None
+        """
+        parsed = parse_comlog(file_name)
+        if not parsed:
+            return None
+        command, session, status, timestamp = parsed
+        sessions = self.index["logs"].setdefault(command, {})
+        latest = sessions.get(session)
+        if (
+            not latest
+            or timestamp > latest[1]
+            or (timestamp == latest[1] and latest[0] == "tmp")
+        ):
+            sessions[session] = [status, timestamp]
+
+    def update(self) -> "Comlog_Index":
+        """
+        Method to bring the index up to date.
+        Logs that disappear other than running
+        ones finishing mean it's rebuilt.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        Comlog_Index: object
+            self
+        """
+        import time
+
+        try:
+            mtime_ns = os.stat(self.comlogs).st_mtime_ns
+        except OSError:
+            return self
+        # A folder changed within the last couple of seconds could change
+        # again without its mtime moving on, so it's always listed again.
+        if mtime_ns == self.index["mtime_ns"] and time.time() - mtime_ns / 1e9 > 2:
+            return self
+        with os.scandir(self.comlogs) as entries:
+            files = [entry.name for entry in entries]
+        seen = set(self.index["files"])
+        current = set(files)
+        if any(not name.startswith("tmp_") for name in seen - current):
+            self.index["logs"] = {}
+            seen = set()
+        for name in files:
+            if name not in seen:
+                self.add(name)
+        self.index.update(mtime_ns=mtime_ns, files=files)
+        self.save()
+        return self
+
+    def latest(self, command: str) -> dict:
+        """
+        Method to get the latest comlog of
+        every session for a command
+
+        Parameters
+        ----------
+        command: str
+            qunex command (e.g
+            hcp_freesurfer or import_bids)
+
+        Returns
+        -------
+        dict: dictionary
+            dict of session: (status, timestamp)
+        """
+        return {
+            session: tuple(latest)
+            for session, latest in self.index["logs"].get(command, {}).items()
+        }
+
+
+def latest_comlogs(study_folder: str) -> dict:
+    """
+    Function to get the latest comlog of
+    every stage and session from the
+    comlog index.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    dict: dictionary
+        dict of (stage, session): (status, timestamp)
+    """
+    index = Comlog_Index(study_folder).update()
+    return {
+        (stage, session): latest
+        for stage in stage_order()
+        for session, latest in index.latest(f"hcp_{stage}").items()
+    }
+
+
+def missing_sessions(study_folder: str, stages: list) -> dict:
+    """
+    Function to work out which sessions still
+    need each stage. A stage is complete for a
+    session if its latest comlog is done and its
+    outputs exist. A session that needs a stage
+    also needs every stage after it.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    stages: list
+        list of stages to check, in
+        the order they are ran
+
+    Returns
+    -------
+    dict: dictionary
+        dict of stage: list of sessions
+    """
+    comlogs = latest_comlogs(study_folder)
+    sessions = get_sessions(study_folder)
+    rerun = set()
+    missing = {}
+    for stage in stages:
+        for session in sessions:
+            if session in rerun:
+                continue
+            done = comlogs.get((stage, session), ("",))[0] == "done"
+            if not done or not all(
+                os.path.exists(output)
+                for output in stage_outputs(study_folder, session, stage)
+            ):
+                rerun.add(session)
+        missing[stage] = [session for session in sessions if session in rerun]
+    return missing
+
+
+def sessions_to_run(args: dict, stages: list) -> dict:
+    """
+    Function to get the sessions each stage
+    is ran on. None (all sessions) unless
+    --resume is given, then only the
+    missing ones.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    stages: list
+        list of stages, in the
+        order they are ran
+
+    Returns
+    -------
+    dict: dictionary
+        dict of stage: list of sessions
+        or None
+    """
+    if not args.get("resume"):
+        return {stage: None for stage in stages}
+    missing = missing_sessions(args["study_folder"], stages)
+    for stage in stages:
+        print(f"Resuming {stage}: {len(missing[stage])} session(s) to run", flush=True)
+    return missing
+
+
+def comlog_states() -> dict:
+    """
+    Function to return the state of a
+    session for each comlog status
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict: dictionary
+        dict of comlog status: state
+    """
+    return {"done": "done", "error": "failed", "tmp": "running"}
+
+
+def session_states(study_folder: str, stages: list = None) -> dict:
+    """
+    Function to get the state of every
+    session for each stage from the
+    latest comlogs. Sessions are those in
+    the batch file, or every logged session
+    if there isn't one.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    stages: list
+        list of stages. Default
+        is None (every stage)
+
+    Returns
+    -------
+    dict: dictionary
+        dict of stage: dict of session: state
+        (done, failed, running or not_run)
+    """
+    comlogs = latest_comlogs(study_folder)
+    sessions = get_sessions(study_folder) or sorted({session for _, session in comlogs})
+    states = comlog_states()
+    return {
+        stage: {
+            session: states[comlogs[(stage, session)][0]]
+            if (stage, session) in comlogs
+            else "not_run"
+            for session in sessions
+        }
+        for stage in stages or stage_order()
+    }
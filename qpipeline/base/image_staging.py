@@ -0,0 +1,247 @@
+import os
+import json
+
+
+def staging_folder() -> str:
+    """
+    Function to return the node-local
+    folder container images are staged to.
+    QPIPELINE_SCRATCH if set, otherwise
+    TMPDIR or /tmp.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: path
+        path to staging folder
+    """
+    scratch = os.environ.get("QPIPELINE_SCRATCH") or os.environ.get("TMPDIR") or "/tmp"
+    return os.path.join(scratch, "qpipeline_images")
+
+
+def checksum_cache() -> str:
+    """
+    Function to return the file
+    image checksums are cached in
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: path
+        path to checksum cache
+    """
+    return os.path.join(os.path.expanduser("~"), ".qpipeline", "image_checksums.json")
+
+
+def file_checksum(path: str) -> str:
+    """
+    Function to get the sha256
+    checksum of a file
+
+    Parameters
+    ----------
+    path: str
+        path to file
+
+    Returns
+    -------
+    str: string object
+        hex digest of file
+    """
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as image:
+        for block in iter(lambda: image.read(16 * 1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def image_checksum(image: str) -> str:
+    """
+    Function to get the checksum of a
+    container image. Reading a multi-GB image
+    is slow so checksums are cached until
+    the image's size or mtime changes.
+
+    Parameters
+    ----------
+    image: str
+        path to container image
+
+    Returns
+    -------
+    str: string object
+        sha256 of image
+    """
+    image = os.path.realpath(image)
+    stat = os.stat(image)
+    key = f"{image}:{stat.st_size}:{stat.st_mtime_ns}"
+    try:
+        with open(checksum_cache()) as cache:
+            checksums = json.load(cache)
+    except (OSError, ValueError):
+        checksums = {}
+    if key in checksums:
+        return checksums[key]
+    print(f"Checksumming {image}", flush=True)
+    checksums = {
+        cached: checksum
+        for cached, checksum in checksums.items()
+        if not cached.startswith(f"{image}:")
+    }
+    checksums[key] = file_checksum(image)
+    try:
+        os.makedirs(os.path.dirname(checksum_cache()), exist_ok=True)
+        with open(f"{checksum_cache()}.tmp", "w") as cache:
+            json.dump(checksums, cache)
+        os.replace(f"{checksum_cache()}.tmp", checksum_cache())
+    except OSError as e:
+        print(f"Unable to cache image checksum: {e}")
+    return checksums[key]
+
+
+def staged_name(image: str, checksum: str) -> str:
+    """
+    Function to return the name of a
+    staged image. Named by checksum so a
+    copy is only ever reused for the
+    same image.
+
+    Parameters
+    ----------
+    image: str
+        path to container image
+    checksum: str
+        sha256 of image
+
+    Returns
+    -------
+    str: string object
+        file name of staged image
+    """
+    return f"{checksum}{os.path.splitext(image)[1]}"
+
+
+def stage_image(image: str) -> str:
+    """
+    Function to copy a container image to
+    node-local storage. The copy is made once
+    per node under a lock shared by every
+    qpipeline process on the node, checked
+    against the image's checksum then renamed
+    into place.
+
+    Parameters
+    ----------
+    image: str
+        path to container image
+
+    Returns
+    -------
+    str: path
+        path to staged image, or the
+        shared image if it couldn't
+        be staged
+    """
+    import fcntl
+    import shutil
+
+    try:
+        checksum = image_checksum(image)
+        folder = staging_folder()
+        os.makedirs(folder, exist_ok=True)
+        staged = os.path.join(folder, staged_name(image, checksum))
+        with open(f"{staged}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(staged):
+                print(f"Staging {image} to {folder}", flush=True)
+                tmp_copy = f"{staged}.tmp.{os.getpid()}"
+                try:
+                    shutil.copyfile(image, tmp_copy)
+                    if file_checksum(tmp_copy) != checksum:
+                        raise OSError("checksum of copy doesn't match")
+                    os.replace(tmp_copy, staged)
+                finally:
+                    if os.path.exists(tmp_copy):
+                        os.remove(tmp_copy)
+    except OSError as e:
+        print(f"Unable to stage {image}, using it from shared storage: {e}")
+        return image
+    return staged
+
+
+def staging_script(image: str) -> list:
+    """
+    Function to build the lines of a job
+    script that stage the container image
+    on the node the job runs on and export
+    QUNEXCONIMAGE as the staged copy. Falls
+    back to the shared image if staging fails.
+
+    Parameters
+    ----------
+    image: str
+        path to container image
+
+    Returns
+    -------
+    list: list object
+        list of script lines
+    """
+    checksum = image_checksum(image)
+    name = staged_name(image, checksum)
+    return [
+        f"export QUNEXCONIMAGE={image}\n",
+        'STAGE_DIR="${QPIPELINE_SCRATCH:-${TMPDIR:-/tmp}}/qpipeline_images"\n',
+        f'STAGED_IMAGE="$STAGE_DIR/{name}"\n',
+        'mkdir -p "$STAGE_DIR" && (\n',
+        "  flock 9\n",
+        '  if [ ! -f "$STAGED_IMAGE" ]; then\n',
+        f'    cp {image} "$STAGED_IMAGE.tmp.$$" &&\n',
+        f'    echo "{checksum}  $STAGED_IMAGE.tmp.$$" | sha256sum -c --status &&\n',
+        '    mv "$STAGED_IMAGE.tmp.$$" "$STAGED_IMAGE"\n',
+        '    rm -f "$STAGED_IMAGE.tmp.$$"\n',
+        "  fi\n",
+        ') 9>"$STAGED_IMAGE.lock"\n',
+        'if [ -f "$STAGED_IMAGE" ]; then\n',
+        '  export QUNEXCONIMAGE="$STAGED_IMAGE"\n',
+        "else\n",
+        '  echo "Unable to stage $QUNEXCONIMAGE, using it from shared storage" >&2\n',
+        "fi\n",
+    ]
+
+
+def job_container(stage: bool = False) -> tuple:
+    """
+    Function to get the container a
+    submitted job runs. A staged container
+    is only known once the job is running,
+    so the cmd uses $QUNEXCONIMAGE set by
+    the staging script.
+
+    Parameters
+    ----------
+    stage: bool
+        stage the container on the
+        node each job runs on.
+        Default is False
+
+    Returns
+    -------
+    tuple: tuple object
+        container for the cmd and
+        image to stage (None if
+        not staging)
+    """
+    from qpipeline.base.utils import container_path
+
+    if not stage:
+        return container_path(), None
+    return '"$QUNEXCONIMAGE"', container_path()
@@ -0,0 +1,330 @@
+import os
+import math
+import sqlite3
+from datetime import datetime
+
+
+def history_path() -> str:
+    """
+    Function to return the path of
+    the job history database. Can be
+    set with QPIPELINE_HISTORY.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: path
+        path to database
+    """
+    return os.environ.get(
+        "QPIPELINE_HISTORY",
+        os.path.join(os.path.expanduser("~"), ".qpipeline", "job_history.db"),
+    )
+
+
+def percentile(values: list, quantile: float) -> float:
+    """
+    Function to get a percentile of
+    values by linear interpolation
+
+    Parameters
+    ----------
+    values: list
+        list of numbers
+    quantile: float
+        percentile between 0 and 1
+
+    Returns
+    -------
+    float: float object
+        percentile of values
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * quantile
+    lower = math.floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def format_walltime(seconds: float) -> str:
+    """
+    Function to format seconds as HH:MM:SS
+
+    Parameters
+    ----------
+    seconds: float
+        seconds
+
+    Returns
+    -------
+    str: string object
+        walltime
+    """
+    minutes = math.ceil(seconds / 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+class Job_History:
+    """
+    Class to keep the runtime and memory of
+    finished jobs in a local sqlite database,
+    keyed by scheduler, stage, data type and
+    input size (number of sessions in the job).
+
+    Usage
+    -----
+    history = Job_History()
+    history.record(scheduler, stage, data_type, input_size, accounting)
+    history.right_size(profile, scheduler, stage, data_type, input_size)
+    """
+
+    def __init__(self, path: str = None) -> None:
+        self.path = path or history_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT,
+                scheduler TEXT,
+                stage TEXT,
+                data_type TEXT,
+                input_size INTEGER,
+                state TEXT,
+                elapsed REAL,
+                maxrss REAL,
+                cpu_efficiency REAL,
+                recorded TEXT,
+                PRIMARY KEY (scheduler, job_id)
+            )"""
+        )
+        self.connection.execute(
+            """CREATE INDEX IF NOT EXISTS scheduler_stage_jobs
+            ON jobs (scheduler, stage, data_type, state)"""
+        )
+        self.connection.commit()
+
+    def record(
+        self,
+        scheduler: str,
+        stage: str,
+        data_type: str,
+        input_size: int,
+        accounting: dict,
+    ) -> None:
+        """
+        Method to record finished jobs
+
+        Parameters
+        ----------
+        scheduler: str
+            name of scheduler
+        stage: str
+            name of stage
+        data_type: str
+            data type of study
+        input_size: int
+            number of sessions in each job
+        accounting: dict
+            dict of job_id: accounting data
+            from the scheduler
+
+        Returns
+        -------
+        None
+        """
+        rows = []
+        for job_id, usage in accounting.items():
+            efficiency = None
+            if usage.get("cpu_time") and usage.get("elapsed") and usage.get("cpus"):
+                efficiency = usage["cpu_time"] / (usage["elapsed"] * usage["cpus"])
+            rows.append(
+                (
+                    job_id,
+                    scheduler,
+                    stage,
+                    data_type,
+                    input_size,
+                    usage.get("state"),
+                    usage.get("elapsed"),
+                    usage.get("maxrss"),
+                    efficiency,
+                    datetime.now().isoformat(timespec="seconds"),
+                )
+            )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.connection.commit()
+
+    def completed(self, scheduler: str, stage: str, data_type: str) -> list:
+        """
+        Method to get the elapsed time per
+        session and peak memory of completed
+        jobs of a stage on a scheduler
+
+        Parameters
+        ----------
+        scheduler: str
+            name of scheduler
+        stage: str
+            name of stage
+        data_type: str
+            data type of study
+
+        Returns
+        -------
+        list: list object
+            list of (seconds per session, maxrss)
+        """
+        return self.connection.execute(
+            """SELECT elapsed / MAX(input_size, 1), maxrss FROM jobs
+            WHERE scheduler = ? AND stage = ? AND data_type IS ?
+            AND state = 'COMPLETED' AND elapsed IS NOT NULL AND maxrss IS NOT NULL
+            ORDER BY recorded DESC LIMIT 500""",
+            (scheduler, stage, data_type),
+        ).fetchall()
+
+    def out_of_limits(self, scheduler: str, stage: str, data_type: str) -> list:
+        """
+        Method to get jobs of a stage on a
+        scheduler that ran out of time or
+        memory, from the same recent jobs
+        sizing is taken from
+
+        Parameters
+        ----------
+        scheduler: str
+            name of scheduler
+        stage: str
+            name of stage
+        data_type: str
+            data type of study
+
+        Returns
+        -------
+        list: list object
+            list of (state, seconds
+            per session, maxrss)
+        """
+        return self.connection.execute(
+            """SELECT state, elapsed / MAX(input_size, 1), maxrss FROM (
+                SELECT * FROM jobs
+                WHERE scheduler = ? AND stage = ? AND data_type IS ?
+                AND state IN ('COMPLETED', 'TIMEOUT', 'OUT_OF_MEMORY')
+                ORDER BY recorded DESC LIMIT 500
+            ) WHERE state != 'COMPLETED'""",
+            (scheduler, stage, data_type),
+        ).fetchall()
+
+    def right_size(
+        self,
+        profile: dict,
+        scheduler: str,
+        stage: str,
+        data_type: str,
+        input_size: int,
+        min_samples: int = 5,
+    ) -> bool:
+        """
+        Method to set a profile's time and
+        memory from the 95th percentile of
+        previous jobs on the same scheduler,
+        with some headroom. Limits are raised
+        to 1.5 times what recent jobs that
+        timed out or ran out of memory used,
+        or left at the defaults if that
+        isn't known.
+
+        Parameters
+        ----------
+        profile: dict
+            resource profile to update
+        scheduler: str
+            name of scheduler
+        stage: str
+            name of stage
+        data_type: str
+            data type of study
+        input_size: int
+            number of sessions in the job
+        min_samples: int
+            completed jobs needed before
+            the history is trusted
+
+        Returns
+        -------
+        bool: boolean
+            True if the profile was updated
+        """
+        jobs = self.completed(scheduler, stage, data_type)
+        if len(jobs) < min_samples:
+            return False
+        per_session = percentile([elapsed for elapsed, _ in jobs], 0.95)
+        walltime = per_session * max(input_size, 1) * 1.25 + 600
+        memory = percentile([maxrss for _, maxrss in jobs], 0.95) * 1.25
+        for state, elapsed, maxrss in self.out_of_limits(scheduler, stage, data_type):
+            if state == "TIMEOUT":
+                if elapsed is None:
+                    return False
+                walltime = max(walltime, elapsed * max(input_size, 1) * 1.5)
+            else:
+                if maxrss is None:
+                    return False
+                memory = max(memory, maxrss * 1.5)
+        profile["time"] = format_walltime(walltime)
+        profile["memory"] = max(math.ceil(memory / 100) * 100, 1000)
+        return True
+
+
+def record_jobs(
+    args: dict, stage: str, scheduler, job_ids: list, sessions: list = None
+) -> None:
+    """
+    Function to record finished jobs of a
+    stage in the job history. Failing to
+    record never stops the pipeline.
+    Job ids of schedulers that don't outlive
+    qpipeline start again at 1 every run, so
+    they are prefixed with the process id and
+    time so runs don't replace each other.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    stage: str
+        name of stage
+    scheduler: Scheduler
+        scheduler the jobs ran on
+    job_ids: list
+        list of job ids
+    sessions: list
+        list of sessions the stage ran.
+        Default is None (every session)
+
+    Returns
+    -------
+    None
+    """
+    if args.get("no_history"):
+        return None
+    from qpipeline.base.resources import sessions_per_job
+    from qpipeline.base.utils import read_study_info
+
+    try:
+        accounting = scheduler.accounting(job_ids)
+        if not scheduler.outlives_qpipeline:
+            run = f"{os.getpid()}.{datetime.now():%Y%m%d%H%M%S%f}"
+            accounting = {f"{run}:{job}": usage for job, usage in accounting.items()}
+        Job_History().record(
+            scheduler.name,
+            stage,
+            read_study_info(args["study_folder"]).get("data_type"),
+            sessions_per_job(args, sessions),
+            accounting,
+        )
+    except Exception as e:
+        print(f"Unable to record job history: {e}", flush=True)
@@ -0,0 +1,204 @@
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from qpipeline.base.cluster_support import Job_Progress
+from qpipeline.base.utils import get_sessions, error_and_exit
+
+
+def available_memory() -> int:
+    """
+    Function to get the memory
+    available on this machine in MB
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    int: integer
+        available memory in MB
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 1024**2
+
+
+def available_cpus() -> int:
+    """
+    Function to get the number of
+    cpus this process can use
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    int: integer
+        number of cpus
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def local_workers(
+    cpus_per_session: int, memory_per_session: int, max_workers: int = None
+) -> int:
+    """
+    Function to work out how many sessions
+    can be ran at once on this machine.
+
+    Parameters
+    ----------
+    cpus_per_session: int
+        cpus each session uses
+    memory_per_session: int
+        MB of memory each session uses
+    max_workers: int
+        user set limit. Default is None
+
+    Returns
+    -------
+    int: integer
+        number of sessions to run at once
+    """
+    workers = min(
+        available_cpus() // max(cpus_per_session, 1),
+        available_memory() // max(memory_per_session, 1),
+    )
+    if max_workers:
+        workers = min(workers, max_workers)
+    return max(workers, 1)
+
+
+def run_session(cmd: str, log_file: str) -> int:
+    """
+    Function to run one session's
+    cmd, writing its output to a log file.
+    Ran inside a worker process.
+
+    Parameters
+    ----------
+    cmd: str
+        cmd to run
+    log_file: str
+        path to log file
+
+    Returns
+    -------
+    int: integer
+        return code of cmd
+    """
+    with open(log_file, "w") as log:
+        return subprocess.run(
+            cmd, shell=True, stdout=log, stderr=subprocess.STDOUT
+        ).returncode
+
+
+def run_sessions_locally(
+    session_cmds: dict, log_folder: str, name: str, workers: int, unit: str = "sessions"
+) -> list:
+    """
+    Function to run a cmd per session
+    on a local process pool.
+
+    Parameters
+    ----------
+    session_cmds: dict
+        dict of session: cmd
+    log_folder: str
+        path to write session logs to
+    name: str
+        name of stage, used in log names
+    workers: int
+        number of sessions to run at once
+    unit: str
+        what is being ran, used in
+        messages. Default is sessions
+
+    Returns
+    -------
+    list: list object
+        list of sessions that failed
+    """
+    os.makedirs(log_folder, exist_ok=True)
+    print(f"Running {len(session_cmds)} {unit}, {workers} at a time", flush=True)
+    failed = []
+    progress = Job_Progress(len(session_cmds))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {
+            pool.submit(
+                run_session, cmd, os.path.join(log_folder, f"{name}_{session}.log")
+            ): session
+            for session, cmd in session_cmds.items()
+        }
+        for job in as_completed(running):
+            session = running[job]
+            state = "COMPLETED" if job.result() == 0 else "FAILED"
+            if state == "FAILED":
+                failed.append(session)
+            progress.finished(session, state)
+    progress.close()
+    return failed
+
+
+def run_stage_locally(
+    study_folder: str,
+    stage: str,
+    session_cmd: object,
+    resources: dict,
+    max_workers: int = None,
+    sessions: list = None,
+) -> None:
+    """
+    Function to run a stage for every session
+    in processing/batch.txt on this machine.
+    Exits if any session fails.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    stage: str
+        name of stage
+    session_cmd: object
+        function taking a session
+        and returning its cmd
+    resources: dict
+        resource profile of one session
+    max_workers: int
+        max sessions to run at once.
+        Default is None (limited by
+        cpus and memory)
+    sessions: list
+        list of sessions to run. Default
+        is None (every session)
+
+    Returns
+    -------
+    None
+    """
+    if sessions is None:
+        sessions = get_sessions(study_folder)
+    error_and_exit(
+        sessions, f"No sessions found in {study_folder}/processing/batch.txt"
+    )
+    log_folder = os.path.join(study_folder, "processing", "logs", "qpipeline")
+    failed = run_sessions_locally(
+        {session: session_cmd(session) for session in sessions},
+        log_folder,
+        stage,
+        local_workers(resources["cpus"], resources["memory"], max_workers),
+    )
+    error_and_exit(
+        not failed,
+        f"{stage} failed for {', '.join(failed)}. Please check logs at {log_folder}",
+    )
@@ -0,0 +1,582 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+
+def metric_help() -> dict:
+    """
+    Function to return the metrics
+    qpipeline records and what they are
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict: dictionary
+        dict of metric: (type, help)
+    """
+    return {
+        "qpipeline_command_seconds": (
+            "summary",
+            "Time taken by a qpipeline subcommand",
+        ),
+        "qpipeline_check_input_seconds": (
+            "summary",
+            "Time spent checking inputs",
+        ),
+        "qpipeline_run_cmd_seconds": (
+            "summary",
+            "Time taken by commands ran with run_cmd, including container launch",
+        ),
+        "qpipeline_setup_step_seconds": (
+            "summary",
+            "Time taken by each step of setting up a study",
+        ),
+        "qpipeline_submit_seconds": (
+            "summary",
+            "Time taken to submit a stage to the scheduler",
+        ),
+        "qpipeline_job_queue_wait_seconds": (
+            "summary",
+            "Time jobs waited in the queue before running, as seen by the monitor",
+        ),
+        "qpipeline_job_run_seconds": (
+            "summary",
+            "Time jobs ran for, as seen by the monitor",
+        ),
+        "qpipeline_jobs_submitted_total": (
+            "counter",
+            "Jobs submitted to the scheduler",
+        ),
+        "qpipeline_jobs_finished_total": (
+            "counter",
+            "Jobs reaching a terminal state",
+        ),
+        "qpipeline_job_state_changes_total": (
+            "counter",
+            "Job state changes seen by the monitor",
+        ),
+        "qpipeline_last_run_timestamp_seconds": (
+            "gauge",
+            "When a qpipeline subcommand last finished",
+        ),
+    }
+
+
+def metrics_dir() -> str:
+    """
+    Function to return the folder the
+    prometheus textfile is written to,
+    set with QPIPELINE_METRICS_DIR (e.g.
+    the node_exporter textfile directory).
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: path
+        path to folder or None if
+        not set
+    """
+    return os.environ.get("QPIPELINE_METRICS_DIR")
+
+
+def recorded_commands() -> list:
+    """
+    Function to return the subcommands
+    metrics are recorded for. Queries
+    such as status aren't recorded so
+    polling them doesn't fill the study.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list: list object
+        list of subcommands
+    """
+    return ["setup", "structural", "diffusion", "attach"]
+
+
+def max_traces() -> int:
+    """
+    Function to return how many traces
+    are kept in a study, set with
+    QPIPELINE_MAX_TRACES. Default is 50
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    int: integer
+        number of traces
+    """
+    return int(os.environ.get("QPIPELINE_MAX_TRACES", 50))
+
+
+def metric_key(name: str, labels: dict) -> str:
+    """
+    Function to build a metric's
+    prometheus name with labels
+
+    Parameters
+    ----------
+    name: str
+        metric name
+    labels: dict
+        dict of label: value
+
+    Returns
+    -------
+    str: string object
+        name{label="value",...}
+    """
+    if not labels:
+        return name
+    escaped = {
+        label: str(value).replace("\\", "\\\\").replace('"', '\\"')
+        for label, value in sorted(labels.items())
+    }
+    labels = ",".join(f'{key}="{value}"' for key, value in escaped.items())
+    return f"{name}{{{labels}}}"
+
+
+def command_label(command: object) -> str:
+    """
+    Function to name a command for its
+    metrics. qunex_container calls are
+    named by the qunex command they run.
+
+    Parameters
+    ----------
+    command: object
+        command as a str or list
+
+    Returns
+    -------
+    str: string object
+        name of command
+    """
+    words = (" ".join(command) if isinstance(command, list) else command).split()
+    if not words:
+        return ""
+    if os.path.basename(words[0]) == "qunex_container" and len(words) > 1:
+        return words[1]
+    return os.path.basename(words[0])
+
+
+class Metrics:
+    """
+    Class to record how long qpipeline
+    spends on each part of a run and count
+    what it does. Durations are kept as a
+    count and sum so they are cheap to record
+    however many there are.
+
+    Written at the end of a run as a prometheus
+    textfile (totals kept across runs so rates
+    can be taken) and a json trace of every
+    span in chrome trace format (open in
+    https://ui.perfetto.dev).
+
+    Usage
+    -----
+    with span("qpipeline_setup_step_seconds", step="import_bids"):
+        ...
+    count("qpipeline_jobs_submitted_total", 10, stage="freesurfer")
+    write_metrics()
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.durations = {}
+        self.trace = []
+        self.command = None
+        self.study_folder = None
+        self.started = time.time()
+        self.pid = os.getpid()
+        self.written = False
+
+    def start(self, command: str, study_folder: str) -> None:
+        """
+        Method to set what run is
+        being recorded. The metrics are
+        also written if qpipeline exits
+        on an error. Only commands in
+        recorded_commands are recorded.
+
+        Parameters
+        ----------
+        command: str
+            qpipeline subcommand
+        study_folder: str
+            path to study folder
+
+        Returns
+        -------
+        None
+        """
+        from qpipeline.base.signit import on_kill
+
+        if command not in recorded_commands():
+            return None
+        self.command = command
+        self.study_folder = study_folder
+        self.started = time.time()
+        self.pid = os.getpid()
+        on_kill(self.write)
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Method to add to a counter
+
+        Parameters
+        ----------
+        name: str
+            metric name
+        value: float
+            amount to add. Default is 1
+        labels: dict
+            labels of metric
+
+        Returns
+        -------
+        None
+        """
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """
+        Method to record a duration
+
+        Parameters
+        ----------
+        name: str
+            metric name
+        seconds: float
+            duration in seconds
+        labels: dict
+            labels of metric
+
+        Returns
+        -------
+        None
+        """
+        key = metric_key(name, labels)
+        with self.lock:
+            total = self.durations.setdefault(key, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+
+    def event(self, name: str, **labels) -> None:
+        """
+        Method to mark something happening
+        at an instant in the trace
+
+        Parameters
+        ----------
+        name: str
+            name of event
+        labels: dict
+            anything else to record
+
+        Returns
+        -------
+        None
+        """
+        with self.lock:
+            self.trace.append(
+                {
+                    "name": name,
+                    "ph": "i",
+                    "s": "p",
+                    "ts": time.time() * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": labels,
+                }
+            )
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """
+        Method to time a block of code,
+        recording it as a duration and
+        a span in the trace
+
+        Parameters
+        ----------
+        name: str
+            metric name
+        labels: dict
+            labels of metric
+
+        Returns
+        -------
+        None
+        """
+        start = time.time()
+        clock = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - clock
+            self.observe(name, seconds, **labels)
+            with self.lock:
+                self.trace.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": start * 1e6,
+                        "dur": seconds * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": labels,
+                    }
+                )
+
+    def write(self) -> None:
+        """
+        Method to write the run's metrics.
+        Only written once, by the process
+        that started the run, and only if
+        the study folder has been set up.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        if self.written or not self.study_folder or os.getpid() != self.pid:
+            return None
+        folder = os.path.join(self.study_folder, "processing", "qpipeline")
+        if not os.path.isdir(os.path.dirname(folder)):
+            return None
+        self.written = True
+        self.observe(
+            "qpipeline_command_seconds",
+            time.time() - self.started,
+            command=self.command,
+        )
+        try:
+            os.makedirs(os.path.join(folder, "traces"), exist_ok=True)
+            self.write_trace(folder)
+            totals = self.merge_totals(folder)
+            prom_dir = metrics_dir()
+            prom_file = os.path.join(folder, "qpipeline.prom")
+            if prom_dir:
+                import hashlib
+
+                study_hash = hashlib.sha1(self.study_folder.encode()).hexdigest()[:12]
+                prom_file = os.path.join(prom_dir, f"qpipeline_{study_hash}.prom")
+            atomic_write(prom_file, prometheus_text(totals, self.study_folder))
+        except OSError as e:
+            print(f"Unable to write metrics: {e}")
+
+    def write_trace(self, folder: str) -> None:
+        """
+        Method to write the run's spans
+        as a chrome trace, keeping only
+        the newest max_traces traces
+
+        Parameters
+        ----------
+        folder: str
+            path to processing/qpipeline
+
+        Returns
+        -------
+        None
+        """
+        import json
+        from datetime import datetime
+
+        started = datetime.fromtimestamp(self.started).strftime("%Y-%m-%d_%H.%M.%S")
+        with self.lock:
+            trace = {
+                "traceEvents": self.trace,
+                "displayTimeUnit": "ms",
+                "otherData": {"command": self.command, "study": self.study_folder},
+            }
+            atomic_write(
+                os.path.join(
+                    folder, "traces", f"{self.command}_{started}_{self.pid}.json"
+                ),
+                json.dumps(trace),
+            )
+        traces = [
+            entry
+            for entry in os.scandir(os.path.join(folder, "traces"))
+            if entry.name.endswith(".json")
+        ]
+        traces.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in traces[max_traces() :]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def merge_totals(self, folder: str) -> dict:
+        """
+        Method to add the run's counters and
+        durations to the study's totals.
+        Locked so runs finishing at the same
+        time don't lose each other's totals.
+
+        Parameters
+        ----------
+        folder: str
+            path to processing/qpipeline
+
+        Returns
+        -------
+        dict: dictionary
+            dict of counters, durations
+            and gauges across every run
+        """
+        import json
+        import fcntl
+
+        totals_file = os.path.join(folder, "metrics.json")
+        with open(f"{totals_file}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(totals_file) as saved:
+                    totals = json.load(saved)
+            except (OSError, ValueError):
+                totals = {}
+            counters = totals.setdefault("counters", {})
+            durations = totals.setdefault("durations", {})
+            gauges = totals.setdefault("gauges", {})
+            with self.lock:
+                for key, value in self.counters.items():
+                    counters[key] = counters.get(key, 0) + value
+                for key, (number, seconds) in self.durations.items():
+                    total = durations.setdefault(key, [0, 0.0])
+                    total[0] += number
+                    total[1] += seconds
+            gauges[
+                metric_key(
+                    "qpipeline_last_run_timestamp_seconds", {"command": self.command}
+                )
+            ] = time.time()
+            atomic_write(totals_file, json.dumps(totals))
+        return totals
+
+
+def atomic_write(path: str, text: str) -> None:
+    """
+    Function to write a file so it is
+    never seen half written (as node_exporter
+    may read it at any time)
+
+    Parameters
+    ----------
+    path: str
+        path to file
+    text: str
+        text to write
+
+    Returns
+    -------
+    None
+    """
+    with open(f"{path}.tmp.{os.getpid()}", "w") as tmp_file:
+        tmp_file.write(text)
+    os.replace(f"{path}.tmp.{os.getpid()}", path)
+
+
+def prometheus_text(totals: dict, study_folder: str) -> str:
+    """
+    Function to render metric totals
+    in the prometheus text format, each
+    labelled with the study.
+
+    Parameters
+    ----------
+    totals: dict
+        dict of counters, durations
+        and gauges
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    str: string object
+        prometheus text
+    """
+    import re
+
+    study = study_folder.replace("\\", "\\\\").replace('"', '\\"')
+    samples = {}
+    for key, value in totals.get("counters", {}).items():
+        samples.setdefault(key.split("{")[0], []).append(("", key, value))
+    for key, value in totals.get("gauges", {}).items():
+        samples.setdefault(key.split("{")[0], []).append(("", key, value))
+    for key, (number, seconds) in totals.get("durations", {}).items():
+        samples.setdefault(key.split("{")[0], []).extend(
+            [("_count", key, number), ("_sum", key, seconds)]
+        )
+    lines = []
+    descriptions = metric_help()
+    for name in sorted(samples):
+        metric_type, description = descriptions.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for suffix, key, value in sorted(
+            samples[name], key=lambda sample: (sample[1], sample[0])
+        ):
+            labels = re.sub(r"^[^{]*\{?|\}$", "", key)
+            labels = f'study="{study}"' + (f",{labels}" if labels else "")
+            lines.append(f"{name}{suffix}{{{labels}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def span(name: str, **labels):
+    """
+    Function to time a block of code.
+    See Metrics.span
+    """
+    return metrics.span(name, **labels)
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    """
+    Function to add to a counter.
+    See Metrics.count
+    """
+    metrics.count(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """
+    Function to record a duration.
+    See Metrics.observe
+    """
+    metrics.observe(name, seconds, **labels)
+
+
+def write_metrics() -> None:
+    """
+    Function to write the run's metrics.
+    See Metrics.write
+    """
+    metrics.write()
@@ -0,0 +1,204 @@
+import os
+import time
+
+
+def waiting_calls() -> dict:
+    """
+    Function to return the calls where
+    qpipeline is waiting rather than using
+    the cpu, by what it is waiting on.
+
+    qpipeline only waits on locks and pipes
+    for child processes (qunex_container,
+    scheduler commands, local sessions), so
+    time in them is counted as subprocess time.
+    read_lines is included as reading a pipe
+    line by line isn't seen by the profiler.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict: dictionary
+        dict of function name: category
+    """
+    return {
+        "<built-in method time.sleep>": "sleeping",
+        "<built-in method posix.waitpid>": "subprocesses",
+        "<built-in method posix.read>": "subprocesses",
+        "<built-in method select.select>": "subprocesses",
+        "<method 'poll' of 'select.poll' objects>": "subprocesses",
+        "<method 'poll' of 'select.epoll' objects>": "subprocesses",
+        "<method 'acquire' of '_thread.lock' objects>": "subprocesses",
+        "<method 'read' of '_io.BufferedReader' objects>": "subprocesses",
+        "<method 'readline' of '_io.BufferedReader' objects>": "subprocesses",
+        "<method 'readline' of '_io.TextIOWrapper' objects>": "subprocesses",
+        "read_lines": "subprocesses",
+    }
+
+
+def function_name(function: tuple) -> str:
+    """
+    Function to format a profiled
+    function as file:line(name), with
+    qpipeline files relative to the package
+
+    Parameters
+    ----------
+    function: tuple
+        (file, line, name) from pstats
+
+    Returns
+    -------
+    str: string object
+        name of function
+    """
+    file_name, line, name = function
+    if file_name == "~":
+        return name
+    package = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    if file_name.startswith(package):
+        file_name = os.path.relpath(file_name, package)
+    return f"{file_name}:{line}({name})"
+
+
+def profile_summary(stats: dict, wall: float, top: int = 30) -> str:
+    """
+    Function to summarise a profile. Time
+    waiting on subprocesses and sleeping is
+    split out from time running python, and
+    the functions using the most python time
+    are ranked.
+
+    Parameters
+    ----------
+    stats: dict
+        pstats.Stats(...).stats
+    wall: float
+        seconds the run took
+    top: int
+        number of functions to rank.
+        Default is 30
+
+    Returns
+    -------
+    str: string object
+        summary
+    """
+    import resource
+
+    waiting = waiting_calls()
+    totals = {"subprocesses": 0.0, "sleeping": 0.0}
+    ranked = []
+    for function, (_, calls, own_time, cumulative, _) in stats.items():
+        category = waiting.get(function[2])
+        if function[2] == "read_lines" and not function[0].endswith("utils.py"):
+            category = None
+        if category:
+            totals[category] += own_time
+            continue
+        ranked.append((own_time, cumulative, calls, function_name(function)))
+    ranked.sort(reverse=True)
+    python_time = max(wall - totals["subprocesses"] - totals["sleeping"], 0)
+    own_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    lines = [
+        f"{'Wall time':<32}{wall:>10.2f}s",
+        f"  {'Python':<30}{python_time:>10.2f}s",
+        f"  {'Waiting on subprocesses':<30}{totals['subprocesses']:>10.2f}s",
+        f"  {'Sleeping':<30}{totals['sleeping']:>10.2f}s",
+        f"{'CPU of qpipeline':<32}{own_usage.ru_utime + own_usage.ru_stime:>10.2f}s",
+        f"{'CPU of finished subprocesses':<32}"
+        f"{child_usage.ru_utime + child_usage.ru_stime:>10.2f}s",
+        "",
+        f"Hottest functions by python time (top {top})",
+        f"{'own (s)':>10}{'total (s)':>11}{'calls':>10}  function",
+    ]
+    lines.extend(
+        f"{own_time:>10.3f}{cumulative:>11.3f}{calls:>10}  {name}"
+        for own_time, cumulative, calls, name in ranked[:top]
+    )
+    return "\n".join(lines) + "\n"
+
+
+class Profile_Run:
+    """
+    Class to run qpipeline under cProfile.
+    The profile is written (as a pstats
+    file, e.g for snakeviz) when the run
+    ends, including when it exits on an
+    error, with a summary next to it.
+
+    Only the main qpipeline thread is
+    profiled. Work in child processes is
+    seen as time waiting on subprocesses.
+
+    Usage
+    -----
+    Profile_Run(profile_file).run(function)
+    """
+
+    def __init__(self, profile_file: str) -> None:
+        import cProfile
+
+        self.profile_file = profile_file
+        self.profiler = cProfile.Profile()
+        self.started = None
+        self.written = False
+
+    def run(self, function: object) -> None:
+        """
+        Method to run a function
+        under the profiler
+
+        Parameters
+        ----------
+        function: object
+            function taking no arguments
+
+        Returns
+        -------
+        None
+        """
+        from qpipeline.base.signit import on_kill
+
+        on_kill(self.write)
+        self.started = time.perf_counter()
+        self.profiler.enable()
+        try:
+            function()
+        finally:
+            self.write()
+
+    def write(self) -> None:
+        """
+        Method to stop profiling and
+        write the profile and summary
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        import pstats
+
+        self.profiler.disable()
+        if self.written:
+            return None
+        self.written = True
+        wall = time.perf_counter() - self.started
+        try:
+            self.profiler.dump_stats(self.profile_file)
+            summary = profile_summary(pstats.Stats(self.profiler).stats, wall)
+            with open(f"{self.profile_file}.txt", "w") as summary_file:
+                summary_file.write(summary)
+        except OSError as e:
+            print(f"Unable to write profile: {e}")
+            return None
+        print(f"\nProfile written to {self.profile_file}")
+        print(summary, end="", flush=True)
@@ -0,0 +1,275 @@
+import configparser
+from qpipeline.base.utils import error_and_exit
+
+
+def default_profiles() -> dict:
+    """
+    Function to return the default
+    resources each stage is ran with.
+
+    memory is in MB, time is HH:MM:SS and
+    a partition of None uses --queue.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict: dictionary
+        dict of stage: resource profile
+    """
+    base = {"cpus": 1, "gpus": 0, "partition": None, "qos": "img"}
+    return {
+        "pre_freesurfer": {**base, "memory": 8000, "time": "04:00:00"},
+        "freesurfer": {**base, "memory": 12000, "time": "24:00:00"},
+        "post_freesurfer": {**base, "memory": 8000, "time": "04:00:00"},
+        "diffusion": {**base, "memory": 16000, "gpus": 1, "time": "12:00:00"},
+    }
+
+
+def profile_types() -> dict:
+    """
+    Function to return the type
+    of each resource
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict: dictionary
+        dict of resource: type
+    """
+    return {
+        "cpus": int,
+        "memory": int,
+        "gpus": int,
+        "time": str,
+        "partition": str,
+        "qos": str,
+    }
+
+
+def set_resource(profile: dict, key: str, value: str, source: str) -> None:
+    """
+    Function to set a resource in a
+    profile, exiting if it's not valid
+
+    Parameters
+    ----------
+    profile: dict
+        resource profile to update
+    key: str
+        resource name
+    value: str
+        resource value
+    source: str
+        where the value came from,
+        for the error message
+
+    Returns
+    -------
+    None
+    """
+    types = profile_types()
+    error_and_exit(
+        key in types,
+        f"Unknown resource {key} in {source}. Please use one of {', '.join(types)}",
+    )
+    try:
+        profile[key] = types[key](value)
+    except ValueError:
+        error_and_exit(False, f"{key}={value} in {source} is not a valid {key}")
+
+
+def read_resource_config(profiles: dict, config_file: str) -> None:
+    """
+    Function to update profiles from an ini
+    file with a section per stage, or
+    an [all] section for every stage.
+
+    Parameters
+    ----------
+    profiles: dict
+        dict of stage: resource profile
+    config_file: str
+        path to ini file
+
+    Returns
+    -------
+    None
+    """
+    config = configparser.ConfigParser()
+    error_and_exit(config.read(config_file), f"Unable to read {config_file}")
+    for section in ["all"] + [stage for stage in config.sections() if stage != "all"]:
+        if not config.has_section(section):
+            continue
+        stages = profiles.keys() if section == "all" else [section]
+        error_and_exit(
+            section in profiles or section == "all",
+            f"Unknown stage {section} in {config_file}",
+        )
+        for stage in stages:
+            for key, value in config.items(section):
+                set_resource(profiles[stage], key, value, config_file)
+
+
+def apply_resource_overrides(profiles: dict, overrides: list) -> None:
+    """
+    Function to update profiles from
+    STAGE.KEY=VALUE cmd line overrides.
+    STAGE can be all.
+
+    Parameters
+    ----------
+    profiles: dict
+        dict of stage: resource profile
+    overrides: list
+        list of overrides
+
+    Returns
+    -------
+    None
+    """
+    for override in overrides:
+        setting, _, value = override.partition("=")
+        stage, _, key = setting.partition(".")
+        error_and_exit(
+            value and key and (stage in profiles or stage == "all"),
+            f"Unable to use --resource {override}. Please give it as STAGE.KEY=VALUE",
+        )
+        for name in profiles if stage == "all" else [stage]:
+            set_resource(profiles[name], key, value, "--resource")
+
+
+def sessions_per_job(args: dict, sessions: list = None) -> int:
+    """
+    Function to get how many sessions
+    each job of a stage runs.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    sessions: list
+        list of sessions the stage runs.
+        Default is None (every session)
+
+    Returns
+    -------
+    int: integer
+        number of sessions per job
+    """
+    if not args.get("queue") or args.get("array"):
+        return 1
+    if sessions is not None:
+        return max(len(sessions), 1)
+    from qpipeline.base.utils import get_sessions
+
+    return max(len(get_sessions(args["study_folder"])), 1)
+
+
+def right_size_from_history(
+    args: dict, profiles: dict, stage: str, sessions: list = None
+) -> None:
+    """
+    Function to set a stage's time and memory
+    from previous runs on the same scheduler
+    in the job history. Does nothing with --no_history or if
+    there isn't enough history.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    profiles: dict
+        dict of stage: resource profile
+    stage: str
+        name of stage
+    sessions: list
+        list of sessions the stage runs.
+        Default is None (every session)
+
+    Returns
+    -------
+    None
+    """
+    if args.get("no_history"):
+        return None
+    from qpipeline.base.job_history import Job_History
+    from qpipeline.base.utils import read_study_info
+
+    scheduler = (args.get("scheduler") or "slurm") if args.get("queue") else "local"
+    try:
+        history = Job_History()
+        if history.right_size(
+            profiles[stage],
+            scheduler.lower(),
+            stage,
+            read_study_info(args["study_folder"]).get("data_type"),
+            sessions_per_job(args, sessions),
+        ):
+            print(
+                f"Using job history for {stage}: "
+                f"time={profiles[stage]['time']} memory={profiles[stage]['memory']}MB",
+                flush=True,
+            )
+    except Exception as e:
+        print(f"Unable to read job history: {e}", flush=True)
+
+
+def stage_resources(args: dict, stage: str, sessions: list = None) -> dict:
+    """
+    Function to get the resources a stage
+    is ran with. Defaults are updated from
+    the job history, --resource_config
+    then --resource.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    stage: str
+        name of stage
+    sessions: list
+        list of sessions the stage runs.
+        Default is None (every session)
+
+    Returns
+    -------
+    dict: dictionary
+        resource profile
+    """
+    profiles = default_profiles()
+    right_size_from_history(args, profiles, stage, sessions)
+    if args.get("resource_config"):
+        read_resource_config(profiles, args["resource_config"])
+    apply_resource_overrides(profiles, args.get("resource") or [])
+    profile = profiles[stage]
+    if stage == "diffusion" and args.get("no_gpu"):
+        profile["gpus"] = 0
+    if not profile["partition"]:
+        profile["partition"] = args.get("queue")
+    return profile
+
+
+def job_options(profile: dict, jobname: str) -> dict:
+    """
+    Function to turn a resource profile into
+    the options a job is submitted with.
+
+    Parameters
+    ----------
+    profile: dict
+        resource profile
+    jobname: str
+        name of job
+
+    Returns
+    -------
+    dict: dictionary
+        dict of job option: value
+    """
+    return {"jobname": jobname, **profile}
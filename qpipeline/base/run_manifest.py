@@ -0,0 +1,597 @@
+import os
+import json
+from datetime import datetime
+from qpipeline.base.utils import error_and_exit
+
+
+def manifest_path(study_folder: str) -> str:
+    """
+    Function to return the path
+    of a study's run manifest
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    str: path
+        path to run manifest
+    """
+    return os.path.join(study_folder, "processing", "qpipeline", "run_manifest.json")
+
+
+def now() -> str:
+    """
+    Function to return the time
+    as an iso format string
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: string object
+        current time
+    """
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class Run_Manifest:
+    """
+    Class to keep a record on disk of the
+    stages of a run and the jobs each was
+    submitted as, so monitoring can be picked
+    up again if qpipeline stops.
+
+    Stages are pending, submitted, completed,
+    failed, skipped (nothing to run) or
+    cancelled (an earlier stage failed, or
+    the scheduler killed its jobs as a job
+    they depend on failed).
+
+    Usage
+    -----
+    manifest = Run_Manifest(study_folder)
+    manifest.start("structural", args, stages, sessions)
+    manifest.submitted(stage, job_ids, scheduler)
+    manifest.finished(stage, job_states)
+    """
+
+    def __init__(self, study_folder: str) -> None:
+        self.path = manifest_path(study_folder)
+        self.run = self.load()
+
+    def load(self) -> dict:
+        """
+        Method to load the manifest
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict: dictionary
+            run manifest. Empty if
+            there isn't one.
+        """
+        try:
+            with open(self.path) as manifest:
+                return json.load(manifest)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        """
+        Method to write the manifest,
+        creating processing/qpipeline if
+        needed. Written to a temporary file then
+        renamed so it's never half written.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as manifest:
+            json.dump(self.run, manifest, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def start(self, command: str, args: dict, stages: list, sessions: dict) -> None:
+        """
+        Method to start a new run.
+
+        Parameters
+        ----------
+        command: str
+            qpipeline subcommand
+        args: dict
+            dictionary of cmd args
+        stages: list
+            list of stages in the order
+            they are ran
+        sessions: dict
+            dict of stage: list of sessions
+            or None for every session
+
+        Returns
+        -------
+        None
+        """
+        self.run = {
+            "command": command,
+            "args": args,
+            "started": now(),
+            "run_id": f"{datetime.now():%Y%m%d%H%M%S}_{os.getpid()}",
+            "stages": [
+                {
+                    "stage": stage,
+                    "state": "pending" if sessions[stage] != [] else "skipped",
+                    "sessions": sessions[stage],
+                    "scheduler": args.get("scheduler") or "slurm",
+                    "job_ids": [],
+                    "dependency": [],
+                    "submitted": None,
+                    "finished": None,
+                    "job_states": {},
+                }
+                for stage in stages
+            ],
+        }
+        self.save()
+
+    def stage(self, stage: str) -> dict:
+        """
+        Method to get a stage of the run
+
+        Parameters
+        ----------
+        stage: str
+            name of stage
+
+        Returns
+        -------
+        dict: dictionary
+            stage record
+        """
+        for record in self.run["stages"]:
+            if record["stage"] == stage:
+                return record
+        error_and_exit(False, f"{stage} is not part of this run")
+
+    def unfinished(self) -> list:
+        """
+        Method to get stages that are
+        still pending or submitted
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list: list object
+            list of stage records
+        """
+        return [
+            record
+            for record in self.run.get("stages", [])
+            if record["state"] in ["pending", "submitted"]
+        ]
+
+    def submitted(
+        self,
+        stage: str,
+        job_ids: list,
+        scheduler: str,
+        dependency: list = None,
+        files: list = None,
+        corresponding: bool = False,
+    ) -> None:
+        """
+        Method to record a stage
+        being submitted
+
+        Parameters
+        ----------
+        stage: str
+            name of stage
+        job_ids: list
+            list of job ids
+        scheduler: str
+            name of scheduler
+        dependency: list
+            job ids the stage waits on.
+            Default is None
+        files: list
+            job script and sessions file
+            of the submission. Default is None
+        corresponding: bool
+            each array task only waits on the
+            task of the same session of the
+            dependency. Default is False
+
+        Returns
+        -------
+        None
+        """
+        record = self.stage(stage)
+        record.update(
+            state="submitted",
+            job_ids=job_ids,
+            scheduler=scheduler,
+            dependency=dependency or [],
+            files=files or [],
+            corresponding=corresponding,
+            submitted=now(),
+        )
+        self.save()
+
+    def finished(self, stage: str, job_states: dict) -> None:
+        """
+        Method to record a stage's jobs
+        finishing. A stage whose jobs were
+        all cancelled is recorded as cancelled.
+
+        Parameters
+        ----------
+        stage: str
+            name of stage
+        job_states: dict
+            dict of job_id: terminal state
+
+        Returns
+        -------
+        None
+        """
+        from qpipeline.base.cluster_support import terminal_job_states
+
+        failed_states = terminal_job_states()
+        record = self.stage(stage)
+        failed = any(
+            failed_states.get(job_states.get(job), True) for job in record["job_ids"]
+        )
+        state = "failed" if failed else "completed"
+        if all(job_states.get(job) == "CANCELLED" for job in record["job_ids"]):
+            state = "cancelled"
+        record.update(
+            state=state,
+            finished=now(),
+            job_states=job_states,
+        )
+        self.save()
+
+    def cancelled(self, stage: str) -> None:
+        """
+        Method to record a stage being
+        cancelled as it can never start
+
+        Parameters
+        ----------
+        stage: str
+            name of stage
+
+        Returns
+        -------
+        None
+        """
+        self.stage(stage).update(state="cancelled", finished=now())
+        self.save()
+
+    def update_finished(self) -> None:
+        """
+        Method to record submitted stages whose
+        jobs have all finished, such as stages
+        the scheduler killed after a stage they
+        depend on failed, without waiting on them.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        from qpipeline.base.schedulers import get_scheduler
+        from qpipeline.base.cluster_support import terminal_job_states
+
+        terminal_states = terminal_job_states()
+        for record in self.unfinished():
+            if record["state"] != "submitted":
+                continue
+            states = get_scheduler(record["scheduler"]).status(record["job_ids"])
+            if all(states.get(job) in terminal_states for job in record["job_ids"]):
+                self.finished(record["stage"], states)
+
+    def active_jobs(self) -> list:
+        """
+        Method to get jobs of submitted
+        stages the scheduler still has
+        queued or running.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list: list object
+            list of job ids
+        """
+        from qpipeline.base.schedulers import get_scheduler
+        from qpipeline.base.cluster_support import terminal_job_states
+
+        terminal_states = terminal_job_states()
+        active = []
+        for record in self.unfinished():
+            if record["state"] != "submitted":
+                continue
+            states = get_scheduler(record["scheduler"]).status(record["job_ids"])
+            active += [
+                job
+                for job in record["job_ids"]
+                if job in states and states[job] not in terminal_states
+            ]
+        return active
+
+
+def submit_run_stage(
+    manifest: Run_Manifest, args: dict, stage: str, dependency: list = None
+) -> list:
+    """
+    Function to submit a pending stage
+    of a run and record it in the manifest.
+    The job script and sessions file are
+    named by run and stage so they are never
+    rewritten under jobs of another submission.
+    Array stages running the same sessions
+    as the stage they depend on only wait on
+    the task of the same session, so one
+    failed session doesn't stop the others.
+
+    Parameters
+    ----------
+    manifest: Run_Manifest
+        run manifest
+    args: dict
+        dictionary of cmd args
+    stage: str
+        name of stage
+    dependency: list
+        job ids that must finish
+        successfully first. Default is None
+
+    Returns
+    -------
+    list: list object
+        list of job ids
+    """
+    from qpipeline.structural.qunex_structural_runner import submit_structural
+    from qpipeline.diffusion.diffusion_pipeline import submit_diffusion
+    from qpipeline.base.submission import submission_files
+
+    sessions = manifest.stage(stage)["sessions"]
+    submission = manifest.run.get("run_id") or manifest.run["started"].replace(":", "")
+    corresponding = bool(args.get("array")) and any(
+        record["job_ids"] == dependency and record["sessions"] == sessions
+        for record in manifest.run["stages"]
+        if dependency
+    )
+    if stage == "diffusion":
+        job_ids = submit_diffusion(
+            args, dependency, sessions, submission, corresponding
+        )
+    else:
+        job_ids = submit_structural(
+            args, stage, dependency, sessions, submission, corresponding
+        )
+    script, sessions_file = submission_files(args["study_folder"], stage, submission)
+    manifest.submitted(
+        stage,
+        job_ids,
+        args.get("scheduler") or "slurm",
+        dependency,
+        [script, sessions_file] if args.get("array") else [script],
+        corresponding,
+    )
+    return job_ids
+
+
+def expected_stage_runtime(args: dict, record: dict) -> float:
+    """
+    Function to return roughly how long a
+    submitted stage takes, in seconds.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    record: dict
+        stage record from the manifest
+
+    Returns
+    -------
+    float: float object
+        expected seconds or None
+        if not known
+    """
+    from qpipeline.structural.run_structural import expected_session_runtime
+    from qpipeline.base.utils import get_sessions
+
+    expected_runtime = expected_session_runtime(record["stage"])
+    if not expected_runtime or args.get("array"):
+        return expected_runtime
+    sessions = record["sessions"]
+    if sessions is None:
+        sessions = get_sessions(args["study_folder"])
+    return expected_runtime * max(len(sessions), 1)
+
+
+def monitor_run_stage(manifest: Run_Manifest, args: dict, stage: str) -> None:
+    """
+    Function to wait on a submitted stage,
+    then record it in the manifest and the
+    job history.
+
+    Parameters
+    ----------
+    manifest: Run_Manifest
+        run manifest
+    args: dict
+        dictionary of cmd args
+    stage: str
+        name of stage
+
+    Returns
+    -------
+    None
+    """
+    from qpipeline.base.schedulers import get_scheduler
+    from qpipeline.base.cluster_support import Queue_Monitoring
+    from qpipeline.base.job_history import record_jobs
+
+    record = manifest.stage(stage)
+    scheduler = get_scheduler(record["scheduler"])
+    print(f"Waiting on {stage}", flush=True)
+    job_states = Queue_Monitoring(scheduler).monitor(
+        record["job_ids"], expected_stage_runtime(args, record), stage
+    )
+    if len(job_states) < len(record["job_ids"]):
+        return None
+    record_jobs(args, stage, scheduler, record["job_ids"], record["sessions"])
+    manifest.finished(stage, job_states)
+    print(f"{stage} {manifest.stage(stage)['state']}", flush=True)
+
+
+def follow_run(manifest: Run_Manifest) -> None:
+    """
+    Function to take a run to the end.
+    Submitted stages are waited on, pending
+    stages are submitted once the stage
+    before has finished, and stages after
+    a failed stage are cancelled, apart from
+    array stages waiting on the same sessions
+    where the scheduler only cancels the tasks
+    of failed sessions. Nothing already
+    submitted is submitted again.
+    Exits with an error if any stage failed
+    or was cancelled.
+
+    Parameters
+    ----------
+    manifest: Run_Manifest
+        run manifest
+
+    Returns
+    -------
+    None
+    """
+    from qpipeline.base.schedulers import get_scheduler
+
+    args = manifest.run["args"]
+    for record in manifest.unfinished():
+        stage = record["stage"]
+        failed_stages = [
+            failed
+            for failed in manifest.run["stages"]
+            if failed["state"] in ["failed", "cancelled"]
+        ]
+        failed_jobs = [job for failed in failed_stages for job in failed["job_ids"]]
+        if record["state"] == "pending" and failed_stages:
+            print(
+                f"Not submitting {stage} as {failed_stages[0]['stage']} "
+                f"{failed_stages[0]['state']}",
+                flush=True,
+            )
+            manifest.cancelled(stage)
+            continue
+        if (
+            record["state"] == "submitted"
+            and not record.get("corresponding")
+            and set(record["dependency"]) & set(failed_jobs)
+        ):
+            print(f"Cancelling {stage} as a stage it depends on failed", flush=True)
+            get_scheduler(record["scheduler"]).cancel(record["job_ids"])
+            manifest.cancelled(stage)
+            continue
+        if record["state"] == "pending":
+            submit_run_stage(manifest, args, stage)
+        monitor_run_stage(manifest, args, stage)
+        if manifest.stage(stage)["state"] == "submitted":
+            return None
+    unsuccessful = [
+        f"{record['stage']} {record['state']}"
+        for record in manifest.run["stages"]
+        if record["state"] in ["failed", "cancelled"]
+    ]
+    error_and_exit(
+        not unsuccessful,
+        f"Run did not finish: {', '.join(unsuccessful)}. "
+        "Use qpipeline status to see which sessions failed",
+    )
+
+
+def queue_stages(command: str, args: dict, stages: list) -> None:
+    """
+    Function to run stages on a scheduler,
+    recording every submission in the run
+    manifest. With --chain every stage is
+    submitted at once with afterok
+    dependencies (aftercorr between array
+    stages of the same sessions), otherwise
+    each stage is submitted once the
+    last has finished.
+
+    Parameters
+    ----------
+    command: str
+        qpipeline subcommand
+    args: dict
+        dictionary of cmd args
+    stages: list
+        list of stages in the order
+        they are ran
+
+    Returns
+    -------
+    None
+    """
+    from qpipeline.base.comlogs import sessions_to_run
+    from qpipeline.base.schedulers import get_scheduler
+    from qpipeline.base.cluster_support import job_dependency
+
+    manifest = Run_Manifest(args["study_folder"])
+    active = manifest.active_jobs()
+    error_and_exit(
+        not active,
+        f"Jobs {', '.join(active)} from the last run are still queued or running. "
+        "Use qpipeline attach or qpipeline status",
+    )
+    manifest.start(command, args, stages, sessions_to_run(args, stages))
+    for record in manifest.run["stages"]:
+        if record["state"] == "skipped":
+            print(f"{record['stage']} already done for every session")
+    if not args.get("chain"):
+        follow_run(manifest)
+        return None
+
+    dependency = None
+    for record in manifest.unfinished():
+        dependency = submit_run_stage(manifest, args, record["stage"], dependency)
+        print(f"{record['stage']} submitted as job {job_dependency(dependency)}")
+    if not get_scheduler(args.get("scheduler")).outlives_qpipeline:
+        follow_run(manifest)
+        return None
+    print(
+        f"Whole chain submitted to {args['queue']}. Safe to log out. "
+        f"Use qpipeline attach -s {args['study_folder']} to pick up monitoring."
+    )
@@ -0,0 +1,1040 @@
+import os
+import re
+import random
+import shutil
+import subprocess
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from functools import lru_cache
+from xml.etree import ElementTree
+from qpipeline.base.utils import run_cmd, error_and_exit
+from qpipeline.base.cluster_support import (
+    get_job_id,
+    job_dependency,
+    array_parents,
+    parse_job_states,
+    query_scheduler,
+)
+
+
+@lru_cache(maxsize=None)
+def get_scheduler(name: str = None) -> object:
+    """
+    Function to get a scheduler by name.
+    The same instance is returned for a
+    name so in process schedulers keep
+    track of their jobs between stages.
+
+    Parameters
+    ----------
+    name: str
+        name of scheduler.
+        Default is None (slurm)
+
+    Returns
+    -------
+    object: Scheduler
+        scheduler instance
+    """
+    schedulers = {
+        "slurm": Slurm_Scheduler,
+        "sge": Sge_Scheduler,
+        "local": Local_Scheduler,
+        "fake": Fake_Scheduler,
+    }
+    return schedulers[(name or "slurm").lower()]()
+
+
+def array_range(n_tasks: int, max_running: int = None, first: int = 0) -> str:
+    """
+    Function to return the range
+    of tasks in an array job
+
+    Parameters
+    ----------
+    n_tasks: int
+        number of tasks
+    max_running: int
+        max tasks to run at once.
+        Default is None (no limit)
+    first: int
+        index of first task
+
+    Returns
+    -------
+    str: string object
+        str of array range
+    """
+    task_range = f"{first}-{first + n_tasks - 1}"
+    if max_running:
+        task_range += f"%{max_running}"
+    return task_range
+
+
+def to_seconds(duration: str) -> float:
+    """
+    Function to convert a scheduler
+    duration ([D-][HH:]MM:SS[.mmm])
+    to seconds
+
+    Parameters
+    ----------
+    duration: str
+        str of duration
+
+    Returns
+    -------
+    float: float object
+        seconds, None if the
+        duration can't be read
+    """
+    if not duration:
+        return None
+    days, _, clock = duration.rpartition("-")
+    try:
+        seconds = 0.0
+        for part in clock.split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds + int(days or 0) * 86400
+    except ValueError:
+        return None
+
+
+def to_megabytes(memory: str) -> float:
+    """
+    Function to convert a scheduler
+    memory value (1234K, 1.5G) to MB
+
+    Parameters
+    ----------
+    memory: str
+        str of memory
+
+    Returns
+    -------
+    float: float object
+        MB, None if the memory
+        can't be read
+    """
+    memory_match = re.match(r"([\d.]+)([KMGT]?)", memory or "")
+    if not memory_match:
+        return None
+    scale = {"": 1 / 1024**2, "K": 1 / 1024, "M": 1, "G": 1024, "T": 1024**2}
+    return float(memory_match.group(1)) * scale[memory_match.group(2)]
+
+
+class Scheduler:
+    """
+    Base class of a scheduler backend.
+    Schedulers submit job scripts, report
+    job states, cancel jobs and return
+    accounting data for finished jobs.
+
+    Job ids are returned as str. Tasks of an
+    array job are returned as <job>_<index>
+    with index starting at 0.
+
+    Usage
+    -----
+    scheduler = get_scheduler("slurm")
+    job_ids = scheduler.submit(script, tasks=10)
+    scheduler.status(job_ids)
+    """
+
+    name = None
+    # Whether submitted jobs carry on if qpipeline exits.
+    outlives_qpipeline = True
+    # Shell expression for the 0 based index of an array task.
+    task_index = "$SLURM_ARRAY_TASK_ID"
+    # Whether job scripts load the cluster modules.
+    loads_modules = True
+    # Exit status of a failed job script, if
+    # the scheduler needs one to hold dependent jobs.
+    failed_exit = None
+
+    def directives(self, options: dict, log_file: str, array: bool) -> list:
+        """
+        Method to turn job options into
+        lines for the head of a job script.
+
+        Parameters
+        ----------
+        options: dict
+            dict of jobname, partition, qos,
+            time, cpus, memory (MB) and gpus
+        log_file: str
+            path to log file without extension
+        array: bool
+            is the script for an array job
+
+        Returns
+        -------
+        list: list object
+            list of lines
+        """
+        return []
+
+    def submit(
+        self,
+        script: str,
+        dependency: list = None,
+        tasks: int = None,
+        max_running: int = None,
+        corresponding: bool = False,
+    ) -> list:
+        """
+        Method to submit a job script.
+
+        Parameters
+        ----------
+        script: str
+            path to job script
+        dependency: list
+            list of job ids that must finish
+            successfully first. Default is None
+        tasks: int
+            number of array tasks. Default
+            is None (not an array job)
+        max_running: int
+            max array tasks to run at once.
+            Default is None (no limit)
+        corresponding: bool
+            each array task only waits on the
+            task of the same index of the
+            dependency. Default is False
+
+        Returns
+        -------
+        list: list object
+            list of job ids
+        """
+        raise NotImplementedError
+
+    def status(self, job_ids: list) -> dict:
+        """
+        Method to get the state of jobs.
+
+        Parameters
+        ----------
+        job_ids: list
+            list of job ids
+
+        Returns
+        -------
+        dict: dictionary
+            dict of job_id: state using slurm
+            state names. Jobs the scheduler has
+            no record of are missing.
+        """
+        raise NotImplementedError
+
+    def cancel(self, job_ids: list) -> None:
+        """
+        Method to cancel jobs.
+
+        Parameters
+        ----------
+        job_ids: list
+            list of job ids
+
+        Returns
+        -------
+        None
+        """
+        raise NotImplementedError
+
+    def accounting(self, job_ids: list) -> dict:
+        """
+        Method to get accounting data
+        for finished jobs.
+
+        Parameters
+        ----------
+        job_ids: list
+            list of job ids
+
+        Returns
+        -------
+        dict: dictionary
+            dict of job_id: dict with state,
+            elapsed (s), cpu_time (s), cpus,
+            maxrss (MB), submit, start and end
+            (datetime or None)
+        """
+        raise NotImplementedError
+
+
+class Slurm_Scheduler(Scheduler):
+    """
+    SLURM backend. Uses sbatch, squeue,
+    sacct and scancel, falling back to
+    fsl_sub_report for job states.
+    """
+
+    name = "slurm"
+
+    def directives(self, options: dict, log_file: str, array: bool) -> list:
+        settings = {
+            "job-name": options.get("jobname"),
+            "partition": options.get("partition"),
+            "qos": options.get("qos"),
+            "time": options.get("time"),
+            "ntasks": 1,
+            "cpus-per-task": options.get("cpus"),
+            "mem": options.get("memory"),
+            "gres": f"gpu:{options['gpus']}" if options.get("gpus") else None,
+            "output": f"{log_file}_{'%A_%a' if array else '%j'}.out",
+        }
+        return [
+            f"#SBATCH --{key}={value}\n" for key, value in settings.items() if value
+        ]
+
+    def submit(
+        self,
+        script: str,
+        dependency: list = None,
+        tasks: int = None,
+        max_running: int = None,
+        corresponding: bool = False,
+    ) -> list:
+        sbatch = "sbatch"
+        if tasks:
+            sbatch += f" --array={array_range(tasks, max_running)}"
+        if dependency:
+            sbatch += (
+                f" --dependency={'aftercorr' if corresponding else 'afterok'}:"
+                f"{job_dependency(dependency)} --kill-on-invalid-dep=yes"
+            )
+        job_id = get_job_id(run_cmd([f"{sbatch} {script}"])["stdout"])[0]
+        if tasks:
+            return [f"{job_id}_{task}" for task in range(tasks)]
+        return [job_id]
+
+    # Polls a job can be missing from squeue,
+    # sacct and fsl_sub before it is UNKNOWN.
+    max_missing_polls = 10
+
+    def __init__(self) -> None:
+        self.missing_polls = Counter()
+
+    def status(self, job_ids: list) -> dict:
+        if not job_ids:
+            return {}
+        states = None
+        if shutil.which("squeue"):
+            states = self.__slurm_states(job_ids)
+        if states is None:
+            states = self.__fsl_sub_states(job_ids)
+        for job in job_ids:
+            if job in states:
+                self.missing_polls.pop(job, None)
+                continue
+            self.missing_polls[job] += 1
+            if self.missing_polls[job] >= self.max_missing_polls:
+                states[job] = "UNKNOWN"
+        return states
+
+    def cancel(self, job_ids: list) -> None:
+        query_scheduler(["scancel", *job_ids])
+
+    def accounting(self, job_ids: list) -> dict:
+        output = query_scheduler(
+            [
+                "sacct",
+                "-n",
+                "-P",
+                "-j",
+                ",".join(array_parents(job_ids)),
+                "-o",
+                "JobID,State,Elapsed,TotalCPU,AllocCPUS,MaxRSS,Submit,Start,End",
+            ]
+        )
+        usage = {}
+        for line in (output or "").splitlines():
+            fields = line.split("|")
+            if len(fields) < 9:
+                continue
+            job, _, step = fields[0].partition(".")
+            record = usage.setdefault(job, {"maxrss": None})
+            maxrss = to_megabytes(fields[5])
+            if maxrss is not None:
+                record["maxrss"] = max(record["maxrss"] or 0, maxrss)
+            if step:
+                continue
+            record.update(
+                {
+                    "state": fields[1].split()[0].rstrip("+"),
+                    "elapsed": to_seconds(fields[2]),
+                    "cpu_time": to_seconds(fields[3]),
+                    "cpus": int(fields[4]) if fields[4].isdigit() else None,
+                    "submit": self.__to_datetime(fields[6]),
+                    "start": self.__to_datetime(fields[7]),
+                    "end": self.__to_datetime(fields[8]),
+                }
+            )
+        return {job: usage[job] for job in job_ids if "state" in usage.get(job, {})}
+
+    def __to_datetime(self, date: str) -> datetime:
+        """
+        Method to read a sacct date
+
+        Parameters
+        ----------
+        date: str
+            sacct date
+
+        Returns
+        -------
+        datetime: datetime object
+            datetime or None if the job
+            hasn't got there yet
+        """
+        try:
+            return datetime.fromisoformat(date)
+        except ValueError:
+            return None
+
+    def __slurm_states(self, job_ids: list) -> dict:
+        """
+        Method to get the state of every job
+        in a single squeue call. Jobs that have
+        left the queue are resolved with a single
+        sacct call. Array tasks (123_4) are
+        queried through their array job.
+
+        Parameters
+        ----------
+        job_ids: list
+            list of job ids
+
+        Returns
+        -------
+        dict: dictionary
+            dict of job_id: state. None if squeue
+            failed and sacct has no record of them.
+        """
+        queued = query_scheduler(
+            [
+                "squeue",
+                "-h",
+                "-r",
+                "-j",
+                ",".join(array_parents(job_ids)),
+                "-o",
+                "%i %T",
+            ]
+        )
+        states = parse_job_states(queued) if queued else {}
+        left_queue = [job for job in job_ids if job not in states]
+        if not left_queue:
+            return states
+        accounting = query_scheduler(
+            [
+                "sacct",
+                "-n",
+                "-P",
+                "-X",
+                "-j",
+                ",".join(array_parents(left_queue)),
+                "-o",
+                "JobID,State",
+            ]
+        )
+        accounted = parse_job_states(accounting) if accounting else {}
+        if queued is None and not any(job in accounted for job in left_queue):
+            # Neither squeue nor sacct know of the jobs,
+            # e.g. accounting is lagging or purged
+            return None
+        for job in left_queue:
+            # squeue has answered so a job it doesn't list has
+            # left the queue, even if accounting has no record of it.
+            states[job] = accounted.get(job, "UNKNOWN" if queued is not None else None)
+        return {job: state for job, state in states.items() if state}
+
+    def __fsl_sub_states(self, job_ids: list) -> dict:
+        """
+        Method to get the state of jobs
+        with fsl_sub_report. Runs one
+        process per job so is only used
+        when slurm can't be queried directly.
+
+        Parameters
+        ----------
+        job_ids: list
+            list of job ids
+
+        Returns
+        -------
+        dict: dictionary
+            dict of job_id: state
+        """
+        states = {}
+        if not os.environ.get("FSLDIR"):
+            return states
+        fsl_sub_report = os.path.join(os.environ["FSLDIR"], "bin", "fsl_sub_report")
+        for job in job_ids:
+            output = query_scheduler([fsl_sub_report, job])
+            if output is None:
+                continue
+            if "Finished" in output:
+                states[job] = "COMPLETED"
+            elif "Failed" in output:
+                states[job] = "FAILED"
+            else:
+                states[job] = "RUNNING"
+        return states
+
+
+class Sge_Scheduler(Scheduler):
+    """
+    (Son of) Grid Engine backend. Uses
+    qsub, qstat, qacct and qdel. SGE array
+    tasks start at 1 so are shifted to
+    match the 0 based task ids qpipeline uses.
+
+    -hold_jid starts jobs once the jobs they
+    hold on have finished, however they went.
+    Failed job scripts exit 100 so the job is
+    left in error state and jobs held on it
+    never start, until qpipeline cancels them.
+    """
+
+    name = "sge"
+    task_index = "$((SGE_TASK_ID - 1))"
+    failed_exit = 100
+
+    def directives(self, options: dict, log_file: str, array: bool) -> list:
+        lines = ["#$ -S /bin/bash\n", "#$ -j y\n"]
+        if options.get("jobname"):
+            lines.append(f"#$ -N {options['jobname']}\n")
+        if options.get("partition"):
+            lines.append(f"#$ -q {options['partition']}\n")
+        if options.get("time"):
+            lines.append(f"#$ -l h_rt={options['time']}\n")
+        cpus = options.get("cpus") or 1
+        if options.get("memory"):
+            # h_vmem is per slot
+            lines.append(f"#$ -l h_vmem={-(-options['memory'] // cpus)}M\n")
+        if cpus > 1:
+            lines.append(f"#$ -pe smp {cpus}\n")
+        if options.get("gpus"):
+            lines.append(f"#$ -l gpu={options['gpus']}\n")
+        suffix = "$JOB_ID.$TASK_ID" if array else "$JOB_ID"
+        return lines + [f"#$ -o {log_file}_{suffix}.out\n"]
+
+    def submit(
+        self,
+        script: str,
+        dependency: list = None,
+        tasks: int = None,
+        max_running: int = None,
+        corresponding: bool = False,
+    ) -> list:
+        qsub = "qsub -terse"
+        if tasks:
+            qsub += f" -t {array_range(tasks, first=1)}"
+            if max_running:
+                qsub += f" -tc {max_running}"
+        if dependency:
+            hold = "-hold_jid_ad" if corresponding else "-hold_jid"
+            qsub += f" {hold} {','.join(array_parents(dependency))}"
+        output = run_cmd([f"{qsub} {script}"])["stdout"]
+        job_id = output.strip().split(".")[0]
+        error_and_exit(job_id.isdigit(), f"Unable to find job ID in: {output}")
+        if tasks:
+            return [f"{job_id}_{task}" for task in range(tasks)]
+        return [job_id]
+
+    def status(self, job_ids: list) -> dict:
+        states = {}
+        qstat = query_scheduler(["qstat", "-xml"])
+        for job in ElementTree.fromstring(qstat).iter("job_list") if qstat else []:
+            job_id = job.findtext("JB_job_number")
+            state = self.__qstat_state(job.findtext("state", ""))
+            if not job.findtext("tasks"):
+                states[job_id] = state
+                continue
+            for task in self.__expand_tasks(job.findtext("tasks")):
+                states[f"{job_id}_{task - 1}"] = state
+        left_queue = [job for job in job_ids if job not in states]
+        if left_queue:
+            accounting = self.accounting(left_queue)
+            for job in left_queue:
+                states[job] = accounting.get(job, {}).get("state", "UNKNOWN")
+        return {job: states[job] for job in job_ids if job in states}
+
+    def cancel(self, job_ids: list) -> None:
+        for job in job_ids:
+            job_id, _, task = job.partition("_")
+            query_scheduler(
+                ["qdel", job_id] + (["-t", str(int(task) + 1)] if task else [])
+            )
+
+    def accounting(self, job_ids: list) -> dict:
+        usage = {}
+        for job_id in array_parents(job_ids):
+            output = query_scheduler(["qacct", "-j", job_id]) or ""
+            for block in output.split("=" * 62):
+                fields = dict(
+                    line.split(None, 1) for line in block.splitlines() if " " in line
+                )
+                if "jobnumber" not in fields:
+                    continue
+                task = fields.get("taskid", "undefined").strip()
+                job = job_id if not task.isdigit() else f"{job_id}_{int(task) - 1}"
+                failed = fields.get("failed", "0").split()[0] != "0"
+                usage[job] = {
+                    "state": "FAILED"
+                    if failed or fields.get("exit_status", "0").strip() != "0"
+                    else "COMPLETED",
+                    "elapsed": to_seconds(fields.get("ru_wallclock", "").rstrip("s")),
+                    "cpu_time": to_seconds(fields.get("cpu", "").rstrip("s")),
+                    "cpus": int(fields.get("slots", "1").strip()),
+                    "maxrss": to_megabytes(fields.get("maxvmem", "").strip()),
+                    "submit": self.__to_datetime(fields.get("qsub_time")),
+                    "start": self.__to_datetime(fields.get("start_time")),
+                    "end": self.__to_datetime(fields.get("end_time")),
+                }
+        return {job: usage[job] for job in job_ids if job in usage}
+
+    def __to_datetime(self, date: str) -> datetime:
+        """
+        Method to read a qacct date
+
+        Parameters
+        ----------
+        date: str
+            qacct date
+
+        Returns
+        -------
+        datetime: datetime object
+            datetime or None
+        """
+        try:
+            return datetime.strptime((date or "").strip(), "%a %b %d %H:%M:%S %Y")
+        except ValueError:
+            return None
+
+    def __qstat_state(self, state: str) -> str:
+        """
+        Method to map qstat states to
+        slurm state names
+
+        Parameters
+        ----------
+        state: str
+            qstat state
+
+        Returns
+        -------
+        str: string object
+            slurm state
+        """
+        if "E" in state:
+            return "FAILED"
+        if "d" in state:
+            return "CANCELLED"
+        if "r" in state or "t" in state:
+            return "RUNNING"
+        return "PENDING"
+
+    def __expand_tasks(self, task_range: str) -> list:
+        """
+        Method to expand qstat ja-task-ID
+        values such as 1-10:1 or 4,6
+
+        Parameters
+        ----------
+        task_range: str
+            qstat task range
+
+        Returns
+        -------
+        list: list object
+            list of task numbers
+        """
+        tasks = []
+        for part in task_range.split(","):
+            span, _, step = part.partition(":")
+            first, _, last = span.partition("-")
+            tasks.extend(range(int(first), int(last or first) + 1, int(step or 1)))
+        return tasks
+
+
+class Local_Scheduler(Scheduler):
+    """
+    Runs job scripts as processes on this
+    machine, with slurm like queueing:
+    a fixed number of slots, afterok and
+    aftercorr dependencies and capped
+    array jobs.
+    Jobs only live as long as qpipeline.
+
+    Usage
+    -----
+    scheduler = Local_Scheduler(slots=4)
+    job_ids = scheduler.submit(script, tasks=10, max_running=2)
+    """
+
+    name = "local"
+    outlives_qpipeline = False
+    loads_modules = False
+
+    def __init__(
+        self,
+        slots: int = None,
+        queue_delay: float = 0,
+        runtime: float = None,
+        failure_rate: float = 0,
+    ) -> None:
+        from qpipeline.base.local_runner import available_cpus
+
+        self.slots = slots or available_cpus()
+        self.queue_delay = queue_delay
+        self.runtime = runtime
+        self.failure_rate = failure_rate
+        self.jobs = {}
+        # Tasks, count of tasks in each state and
+        # queue of pending tasks by array parent,
+        # so dispatching doesn't scan every job.
+        self.tasks = {}
+        self.state_counts = {}
+        self.pending = {}
+        # Tasks waiting on each task with
+        # corresponding dependencies
+        self.dependents = {}
+        self.running = 0
+        self.max_running = {}
+        self.next_id = 1
+        self.lock = threading.RLock()
+
+    def submit(
+        self,
+        script: str,
+        dependency: list = None,
+        tasks: int = None,
+        max_running: int = None,
+        corresponding: bool = False,
+    ) -> list:
+        # Read now, like sbatch, so the script can
+        # change before queued jobs start
+        with open(script) as script_file:
+            script_text = script_file.read()
+        with self.lock:
+            job_id = str(self.next_id)
+            self.next_id += 1
+            self.max_running[job_id] = max_running
+            job_ids = (
+                [f"{job_id}_{task}" for task in range(tasks)] if tasks else [job_id]
+            )
+            corresponding = bool(corresponding and tasks)
+            for job in job_ids:
+                self.jobs[job] = {
+                    "script": script,
+                    "script_text": script_text,
+                    "parent": job_id,
+                    "state": "PENDING",
+                    "dependency": []
+                    if corresponding
+                    else array_parents(dependency or []),
+                    "waiting": 0,
+                    "returncode": None,
+                    "maxrss": None,
+                    "submit": datetime.now(),
+                    "start": None,
+                    "end": None,
+                    "process": None,
+                }
+            self.tasks[job_id] = job_ids
+            self.state_counts[job_id] = Counter(PENDING=len(job_ids))
+            self.pending[job_id] = deque()
+            for job in job_ids:
+                if corresponding:
+                    self.__wait_on_tasks(job, dependency or [])
+                if (
+                    self.jobs[job]["state"] == "PENDING"
+                    and not self.jobs[job]["waiting"]
+                ):
+                    self.pending[job_id].append(job)
+            if not self.pending[job_id]:
+                del self.pending[job_id]
+        if self.queue_delay:
+            threading.Timer(self.queue_delay, self.__dispatch).start()
+        self.__dispatch()
+        return job_ids
+
+    def status(self, job_ids: list) -> dict:
+        with self.lock:
+            return {job: self.jobs[job]["state"] for job in job_ids if job in self.jobs}
+
+    def cancel(self, job_ids: list) -> None:
+        with self.lock:
+            for job in job_ids:
+                record = self.jobs.get(job)
+                if not record or record["state"] not in ("PENDING", "RUNNING"):
+                    continue
+                if record["process"]:
+                    record["process"].terminate()
+                self.__set_state(job, "CANCELLED")
+                record["end"] = datetime.now()
+        self.__dispatch()
+
+    def accounting(self, job_ids: list) -> dict:
+        usage = {}
+        with self.lock:
+            for job in job_ids:
+                record = self.jobs.get(job)
+                if not record:
+                    continue
+                elapsed = None
+                if record["start"] and record["end"]:
+                    elapsed = (record["end"] - record["start"]).total_seconds()
+                usage[job] = {
+                    "state": record["state"],
+                    "elapsed": elapsed,
+                    "cpu_time": None,
+                    "cpus": 1,
+                    "maxrss": record["maxrss"],
+                    "submit": record["submit"],
+                    "start": record["start"],
+                    "end": record["end"],
+                }
+        return usage
+
+    def __set_state(self, job: str, state: str) -> None:
+        """
+        Method to change the state of a job,
+        keeping the counts of states in step.
+
+        Parameters
+        ----------
+        job: str
+            job id
+        state: str
+            new state
+
+        Returns
+        -------
+        None
+        """
+        record = self.jobs[job]
+        counts = self.state_counts[record["parent"]]
+        counts[record["state"]] -= 1
+        counts[state] += 1
+        self.running += (state == "RUNNING") - (record["state"] == "RUNNING")
+        record["state"] = state
+        if state not in ("PENDING", "RUNNING"):
+            for dependent in self.dependents.pop(job, []):
+                self.__release(dependent, state == "COMPLETED")
+
+    def __wait_on_tasks(self, job: str, dependency: list) -> None:
+        """
+        Method to make an array task wait on
+        the task of the same index of each
+        job it depends on. Tasks the jobs
+        don't have are not waited on.
+
+        Parameters
+        ----------
+        job: str
+            array task id
+        dependency: list
+            list of job ids
+
+        Returns
+        -------
+        None
+        """
+        task = job.partition("_")[2]
+        for job_id in array_parents(dependency):
+            state = self.jobs.get(f"{job_id}_{task}", {}).get("state")
+            if state in ("PENDING", "RUNNING"):
+                self.jobs[job]["waiting"] += 1
+                self.dependents.setdefault(f"{job_id}_{task}", []).append(job)
+            elif state and state != "COMPLETED":
+                self.__set_state(job, "CANCELLED")
+                self.jobs[job]["end"] = datetime.now()
+                return None
+
+    def __release(self, job: str, completed: bool) -> None:
+        """
+        Method to queue a task once every task
+        it waits on has completed, or cancel
+        it if one of them didn't complete.
+
+        Parameters
+        ----------
+        job: str
+            array task id
+        completed: bool
+            did the task waited on complete
+
+        Returns
+        -------
+        None
+        """
+        record = self.jobs[job]
+        if record["state"] != "PENDING":
+            return None
+        if not completed:
+            self.__set_state(job, "CANCELLED")
+            record["end"] = datetime.now()
+            return None
+        record["waiting"] -= 1
+        if not record["waiting"]:
+            self.pending.setdefault(record["parent"], deque()).append(job)
+
+    def __dependency_state(self, dependency: list) -> str:
+        """
+        Method to get whether the jobs
+        a job depends on have completed
+
+        Parameters
+        ----------
+        dependency: list
+            list of array parent job ids
+
+        Returns
+        -------
+        str: string object
+            COMPLETED if every task has completed,
+            CANCELLED if any can't complete
+            otherwise PENDING
+        """
+        state = "COMPLETED"
+        for job_id in dependency:
+            counts = self.state_counts.get(job_id, Counter())
+            unfinished = counts["PENDING"] + counts["RUNNING"]
+            if unfinished + counts["COMPLETED"] < len(self.tasks.get(job_id, [])):
+                return "CANCELLED"
+            if unfinished:
+                state = "PENDING"
+        return state
+
+    def __dispatch(self) -> None:
+        """
+        Method to start pending jobs
+        that have a free slot and whose
+        dependencies have completed. Jobs
+        whose dependencies failed are cancelled.
+        Tasks with corresponding dependencies
+        are only queued once theirs complete.
+        """
+        with self.lock:
+            for job_id in list(self.pending):
+                queue = self.pending[job_id]
+                first = self.jobs[queue[0]]
+                dependency_state = self.__dependency_state(first["dependency"])
+                if dependency_state == "CANCELLED":
+                    for job in queue:
+                        if self.jobs[job]["state"] == "PENDING":
+                            self.__set_state(job, "CANCELLED")
+                            self.jobs[job]["end"] = datetime.now()
+                    del self.pending[job_id]
+                    continue
+                since_submit = (datetime.now() - first["submit"]).total_seconds()
+                if dependency_state == "PENDING" or since_submit < self.queue_delay:
+                    continue
+                cap = self.max_running.get(job_id)
+                while queue and self.running < self.slots:
+                    if cap and self.state_counts[job_id]["RUNNING"] >= cap:
+                        break
+                    job = queue.popleft()
+                    if self.jobs[job]["state"] == "PENDING":
+                        self.__start(job, job.partition("_")[2])
+                if not queue:
+                    del self.pending[job_id]
+
+    def __start(self, job: str, task: str) -> None:
+        """
+        Method to start a job process and
+        a thread waiting for it to finish.
+
+        Parameters
+        ----------
+        job: str
+            job id
+        task: str
+            array task index or empty
+            str if not an array job
+
+        Returns
+        -------
+        None
+        """
+        record = self.jobs[job]
+        env = os.environ.copy()
+        env.update({"SLURM_JOB_ID": record["parent"], "SLURM_ARRAY_TASK_ID": task})
+        command = ["bash", "-c", record["script_text"], record["script"]]
+        if self.runtime is not None:
+            exit_code = int(random.random() < self.failure_rate)
+            command = ["bash", "-c", f"sleep {self.runtime}; exit {exit_code}"]
+        with open(f"{os.path.splitext(record['script'])[0]}_{job}.out", "w") as log:
+            record["process"] = subprocess.Popen(
+                command, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+        self.__set_state(job, "RUNNING")
+        record["start"] = datetime.now()
+        threading.Thread(target=self.__wait, args=(job,), daemon=True).start()
+
+    def __wait(self, job: str) -> None:
+        """
+        Method to wait for a job process
+        to finish and record how it went.
+
+        Parameters
+        ----------
+        job: str
+            job id
+
+        Returns
+        -------
+        None
+        """
+        process = self.jobs[job]["process"]
+        maxrss = None
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in KB on linux
+            maxrss = usage.ru_maxrss / 1024
+        except ChildProcessError:
+            # Popen reaps the process itself if
+            # it finishes as it is cancelled
+            process.wait()
+        with self.lock:
+            record = self.jobs[job]
+            record["returncode"] = process.returncode
+            record["maxrss"] = maxrss
+            record["end"] = datetime.now()
+            if record["state"] == "RUNNING":
+                self.__set_state(
+                    job, "COMPLETED" if process.returncode == 0 else "FAILED"
+                )
+        self.__dispatch()
+
+
+class Fake_Scheduler(Local_Scheduler):
+    """
+    Local stand in for a slurm cluster
+    for testing how qpipeline's orchestration
+    behaves at scale on a laptop. Jobs queue
+    for QPIPELINE_FAKE_QUEUE_DELAY seconds,
+    QPIPELINE_FAKE_SLOTS run at once and, if
+    QPIPELINE_FAKE_RUNTIME is set, jobs sleep
+    for that long rather than running their
+    script and fail at QPIPELINE_FAKE_FAILURE_RATE.
+    """
+
+    name = "fake"
+
+    def __init__(self) -> None:
+        runtime = os.environ.get("QPIPELINE_FAKE_RUNTIME")
+        super().__init__(
+            slots=int(os.environ.get("QPIPELINE_FAKE_SLOTS", 4)),
+            queue_delay=float(os.environ.get("QPIPELINE_FAKE_QUEUE_DELAY", 5)),
+            runtime=float(runtime) if runtime else None,
+            failure_rate=float(os.environ.get("QPIPELINE_FAKE_FAILURE_RATE", 0)),
+        )
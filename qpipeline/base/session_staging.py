@@ -0,0 +1,109 @@
+def staged_study() -> str:
+    """
+    Function to return the folder a staged
+    session's cmd uses as its study folder.
+    Only known once the job is running.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: string object
+        shell variable of staged
+        study folder
+    """
+    return '"$STAGE_STUDY"'
+
+
+def session_staging_script(study_folder: str, session: str, cmd: str) -> str:
+    """
+    Function to wrap a session's cmd so it runs
+    in node-local scratch (QPIPELINE_SCRATCH,
+    TMPDIR or /tmp) rather than the shared study.
+
+    The session and batch file are copied to
+    scratch, with study paths in them rewritten,
+    and cmd is ran there. qunex logs are always
+    copied back. On success the session is
+    synced back to a copy of the shared session
+    (hardlinks of anything unchanged) which is
+    then renamed into place. Scratch is removed
+    however the cmd ends.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    session: str
+        session id or "$SESSION"
+    cmd: str
+        cmd using staged_study()
+        as the study folder
+
+    Returns
+    -------
+    str: string object
+        wrapped cmd
+    """
+    shared = f"{study_folder}/sessions/$STAGE_SESSION"
+    return f"""STAGE_SESSION={session}
+STAGE_STUDY=$(mktemp -d "${{QPIPELINE_SCRATCH:-${{TMPDIR:-/tmp}}}}/qpipeline_session.XXXXXX") || exit 1
+trap 'rm -rf "$STAGE_STUDY"' EXIT
+trap 'exit 130' INT TERM
+mkdir -p "$STAGE_STUDY/sessions" "$STAGE_STUDY/processing/logs"
+cp -a "{shared}" "$STAGE_STUDY/sessions/" || exit 1
+[ -d "{study_folder}/sessions/specs" ] && cp -a "{study_folder}/sessions/specs" "$STAGE_STUDY/sessions/"
+sed "s#{study_folder}/#$STAGE_STUDY/#g" "{study_folder}/processing/batch.txt" > "$STAGE_STUDY/processing/batch.txt"
+find "$STAGE_STUDY/sessions/$STAGE_SESSION" -maxdepth 1 -name "*.txt" -exec sed -i "s#{study_folder}/#$STAGE_STUDY/#g" {{}} +
+{cmd}
+STATUS=$?
+cp -a "$STAGE_STUDY/processing/logs/." "{study_folder}/processing/logs/"
+if [ $STATUS -eq 0 ]; then
+  find "$STAGE_STUDY/sessions/$STAGE_SESSION" -maxdepth 1 -name "*.txt" -exec sed -i "s#$STAGE_STUDY/#{study_folder}/#g" {{}} +
+  SYNCED="{study_folder}/sessions/.$STAGE_SESSION.qpipeline_staged.$$"
+  OLD="{study_folder}/sessions/.$STAGE_SESSION.qpipeline_tombstone.$$"
+  if cp -al "{shared}" "$SYNCED" &&
+    rsync -a --delete "$STAGE_STUDY/sessions/$STAGE_SESSION/" "$SYNCED/" &&
+    mv "{shared}" "$OLD"; then
+    if mv "$SYNCED" "{shared}"; then
+      rm -rf "$OLD"
+    else
+      mv "$OLD" "{shared}"
+      STATUS=1
+    fi
+  else
+    STATUS=1
+  fi
+  rm -rf "$SYNCED"
+fi
+exit $STATUS"""
+
+
+def session_cmd(args: dict, session: str, build_cmd) -> str:
+    """
+    Function to build a session's cmd,
+    staged in node-local scratch if
+    --stage_sessions is given.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    session: str
+        session id or "$SESSION"
+    build_cmd: Callable
+        function taking the study
+        folder returning the cmd
+
+    Returns
+    -------
+    str: string object
+        session's cmd
+    """
+    if not args.get("stage_sessions"):
+        return build_cmd(args["study_folder"])
+    return session_staging_script(
+        args["study_folder"], session, build_cmd(staged_study())
+    )
@@ -1,72 +1,285 @@
 import os
+import json
+import glob
+import hashlib
 import subprocess
 
 
-def load_module(module_name: str) -> None:
+def environment_modules() -> list:
     """
-    Function to load module
-    and update the python path
+    Function to return the modules
+    that make up the qunex environment
 
     Parameters
     ----------
-    module_name: str
-        module name
+    None
+
+    Returns
+    -------
+    list: list object
+        list of modules in load order
+    """
+    return ["extension/imaging", "fsl-img", "qunex-img/0.100.0"]
+
+
+def env_cache_folder() -> str:
+    """
+    Function to return the folder
+    loaded environments are cached in.
+    Can be set with QPIPELINE_ENV_CACHE.
+
+    Parameters
+    ----------
+    None
 
     Returns
     -------
+    str: path
+        path to cache folder
+    """
+    return os.environ.get(
+        "QPIPELINE_ENV_CACHE",
+        os.path.join(os.path.expanduser("~"), ".qpipeline", "env_cache"),
+    )
+
+
+def volatile_variables() -> list:
+    """
+    Function to return enviormental
+    variables that change with every
+    shell so are never cached
+
+    Parameters
+    ----------
     None
+
+    Returns
+    -------
+    list: list object
+        list of variable names
+    """
+    return ["_", "SHLVL", "PWD", "OLDPWD"]
+
+
+def modulefile_mtimes(modules: list) -> dict:
+    """
+    Function to get the mtime of the
+    modulefiles for each module found
+    on MODULEPATH. A module given without
+    a version also has its folder checked
+    so a new default version is noticed.
+
+    Parameters
+    ----------
+    modules: list
+        list of modules
+
+    Returns
+    -------
+    dict: dictionary
+        dict of path: mtime
+    """
+    mtimes = {}
+    for module_path in os.environ.get("MODULEPATH", "").split(":"):
+        if not module_path:
+            continue
+        for module in modules:
+            paths = glob.glob(os.path.join(module_path, f"{module}*"))
+            for path in paths + [
+                entry
+                for folder in paths
+                if os.path.isdir(folder)
+                for entry in glob.glob(os.path.join(folder, "*"))
+            ]:
+                try:
+                    mtimes[path] = os.stat(path).st_mtime
+                except OSError:
+                    continue
+    return mtimes
+
+
+def cache_file(modules: list) -> str:
     """
-    module = get_module_paths(module_name)
-    update_env(module.stdout.splitlines())
+    Function to return the cache file
+    for a set of modules
 
+    Parameters
+    ----------
+    modules: list
+        list of modules
+
+    Returns
+    -------
+    str: path
+        path to cache file
+    """
+    key = hashlib.sha1(
+        "\n".join(modules + [os.environ.get("MODULEPATH", "")]).encode()
+    ).hexdigest()
+    return os.path.join(env_cache_folder(), f"{key}.json")
+
+
+def read_env_cache(modules: list) -> dict:
+    """
+    Function to read a cached environment,
+    checking it is still valid. It goes stale
+    if a modulefile has changed or any variable
+    the modules changed had a different value
+    before they were loaded.
 
-def get_module_paths(module_name) -> str:
+    Parameters
+    ----------
+    modules: list
+        list of modules
+
+    Returns
+    -------
+    dict: dictionary
+        cached environment or
+        None if there isn't a valid one
     """
-    Function to run the module
-    and get the enviormental variables
+    try:
+        with open(cache_file(modules)) as cache:
+            cached = json.load(cache)
+    except (OSError, ValueError):
+        return None
+    if cached.get("modules") != modules:
+        return None
+    if cached.get("modulefiles") != modulefile_mtimes(modules):
+        return None
+    if any(
+        os.environ.get(key) != value for key, value in cached.get("before", {}).items()
+    ):
+        return None
+    return cached
+
+
+def write_env_cache(modules: list, environment: dict) -> None:
+    """
+    Function to cache an environment.
+    Failing to write the cache is not
+    an error.
 
     Parameters
     ----------
-    module_name: str
-        module name
+    modules: list
+        list of modules
+    environment: dict
+        dict with changed, removed
+        and before variables
 
     Returns
     -------
     None
+    """
+    path = cache_file(modules)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "w") as cache:
+            json.dump(
+                {
+                    "modules": modules,
+                    "modulefiles": modulefile_mtimes(modules),
+                    **environment,
+                },
+                cache,
+            )
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"Unable to cache environment: {e}")
 
+
+def get_module_paths(modules: list) -> subprocess.CompletedProcess:
     """
+    Function to load every module
+    in one shell and get the
+    enviormental variables
+
+    Parameters
+    ----------
+    modules: list
+        list of modules
+
+    Returns
+    -------
+    subprocess.CompletedProcess: object
+        process with env -0 as stdout
+    """
+    module_loads = " && ".join(f"module load {module}" for module in modules)
     return subprocess.run(
-        ["bash", "-c", f"module load {module_name} && env"],
+        ["bash", "-c", f"{module_loads} && env -0"],
         capture_output=True,
         text=True,
     )
 
 
-def update_env(output: str) -> None:
+def resolve_environment(modules: list) -> dict:
+    """
+    Function to work out what loading
+    modules changes in the environment
+
+    Parameters
+    ----------
+    modules: list
+        list of modules
+
+    Returns
+    -------
+    dict: dictionary
+        dict with changed (name: value),
+        removed (list of names) and before
+        (name: value before loading) or None
+        if the modules could not be loaded
+    """
+    module = get_module_paths(modules)
+    if module.returncode != 0:
+        print(f"Unable to load {', '.join(modules)}: {module.stderr.strip()}")
+        return None
+    loaded = {}
+    for variable in module.stdout.split("\0"):
+        key, _, value = variable.partition("=")
+        if key and key not in volatile_variables():
+            loaded[key] = value
+    changed = {
+        key: value for key, value in loaded.items() if os.environ.get(key) != value
+    }
+    removed = [
+        key
+        for key in os.environ
+        if key not in loaded and key not in volatile_variables()
+    ]
+    before = {key: os.environ.get(key) for key in [*changed, *removed]}
+    return {"changed": changed, "removed": removed, "before": before}
+
+
+def update_env(environment: dict) -> None:
     """
     Function to update
     python enviormental variables
-    for a given module.
+    with what loading modules changed
 
     Parameters
     ----------
-    output: str
-        stdout of subprocess call
-        with module
+    environment: dict
+        dict with changed and
+        removed variables
 
     Returns
     -------
     None
     """
-    for line in output:
-        key, _, value = line.partition("=")
+    for key, value in environment["changed"].items():
         os.environ[key] = value
+    for key in environment["removed"]:
+        os.environ.pop(key, None)
 
 
 def set_environment():
     """
     Wrapper function to load
-    qunex environment
+    qunex environment. The loaded
+    environment is cached and reused
+    until the modulefiles change.
 
     Parameters
     ----------
@@ -76,6 +289,11 @@ def set_environment():
     -------
     None
     """
-    load_module("extension/imaging")
-    load_module("fsl-img")
-    load_module("qunex-img/0.100.0")
+    modules = environment_modules()
+    environment = read_env_cache(modules)
+    if environment is None:
+        environment = resolve_environment(modules)
+        if environment is None:
+            return None
+        write_env_cache(modules, environment)
+    update_env(environment)
@@ -41,10 +41,32 @@ class Signit_handler:
         self.suppress_messages = value
 
 
+kill_hooks = []
+
+
+def on_kill(hook: object) -> None:
+    """
+    Function to register a function to
+    run before the process group is killed,
+    as nothing (not even atexit) runs after.
+
+    Parameters
+    ----------
+    hook: object
+        function taking no arguments
+
+    Returns
+    -------
+    None
+    """
+    kill_hooks.append(hook)
+
+
 def kill_group() -> None:
     """
     Function to send a kill signal to all
-    child processes
+    child processes. Anything registered
+    with on_kill is ran first.
 
     Parameters
     ----------
@@ -54,6 +76,11 @@ def kill_group() -> None:
     -------
     None
     """
+    for hook in kill_hooks:
+        try:
+            hook()
+        except Exception as e:
+            print(f"Error before killing process group: {e}", file=sys.stderr)
     try:
         pgid = os.getpgrp()
         os.killpg(pgid, signal.SIGKILL)
@@ -0,0 +1,243 @@
+import os
+from datetime import datetime
+from qpipeline.base.utils import (
+    error_and_exit,
+    write_to_file,
+    get_sessions,
+)
+from qpipeline.base.cluster_support import cluster_modules
+from qpipeline.base.metrics import span, count
+
+
+def job_script(
+    cmd: str,
+    options: dict,
+    scheduler: object,
+    log_file: str,
+    sessions_file: str = None,
+    stage_image: str = None,
+) -> list:
+    """
+    Function to build a job script for a
+    scheduler. If given a sessions_file it
+    is an array job where each task runs
+    cmd for one session from sessions_file.
+    For schedulers with a failed_exit the
+    script exits with it if cmd fails.
+
+    Parameters
+    ----------
+    cmd: str
+        qunex cmd. Uses $SESSION if
+        sessions_file is given
+    options: dict
+        dict of job option: value
+    scheduler: object
+        Scheduler the script is for
+    log_file: str
+        path to log file without extension
+    sessions_file: str
+        path to file with one session
+        per line. Default is None
+    stage_image: str
+        container image to stage on the
+        node before running cmd.
+        Default is None
+
+    Returns
+    -------
+    list: list object
+        list of script lines
+    """
+    lines = ["#!/bin/bash\n"]
+    lines += scheduler.directives(options, log_file, bool(sessions_file))
+    lines.append("\n")
+    if sessions_file:
+        lines.append(
+            f'SESSION=$(sed -n "$(({scheduler.task_index} + 1))p" {sessions_file})\n'
+        )
+    if scheduler.loads_modules:
+        lines += [f"module load {module}\n" for module in cluster_modules()]
+    steps = []
+    if stage_image:
+        from qpipeline.base.image_staging import staging_script
+
+        steps += staging_script(stage_image)
+    steps.append(f"{cmd}\n")
+    if scheduler.failed_exit:
+        return lines + ["(\n", *steps, f") || exit {scheduler.failed_exit}\n"]
+    return lines + steps
+
+
+def session_flag(args: dict, sessions: list = None) -> str:
+    """
+    Function to get what to give qunex
+    --sessions for a submitted stage.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    sessions: list
+        list of sessions to run. Default
+        is None (every session)
+
+    Returns
+    -------
+    str: string object
+        $SESSION for array jobs, a comma
+        separated list of sessions or None
+    """
+    if args.get("array"):
+        return '"$SESSION"'
+    return ",".join(sessions) if sessions is not None else None
+
+
+def array_sessions(args: dict, sessions: list = None) -> list:
+    """
+    Function to get the sessions a
+    stage's array tasks are ran on.
+
+    Parameters
+    ----------
+    args: dict
+        dictionary of cmd args
+    sessions: list
+        list of sessions to run. Default
+        is None (every session)
+
+    Returns
+    -------
+    list: list object
+        list of sessions or None
+        if not an array job
+    """
+    if not args.get("array"):
+        return None
+    return sessions if sessions is not None else get_sessions(args["study_folder"])
+
+
+def submission_files(study_folder: str, jobname: str, submission: str) -> tuple:
+    """
+    Function to get the job script and array
+    sessions file of a submission. Each
+    submission has its own files as queued
+    jobs read them when they start.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    jobname: str
+        name of job
+    submission: str
+        id of submission
+
+    Returns
+    -------
+    tuple: tuple object
+        path to job script and
+        path to sessions file
+    """
+    folder = os.path.join(study_folder, "processing", "qpipeline", "jobs")
+    name = f"{jobname}_{submission}"
+    return (
+        os.path.join(folder, f"{name}.sh"),
+        os.path.join(folder, f"{name}_sessions.txt"),
+    )
+
+
+def submit_stage(
+    study_folder: str,
+    cmd: str,
+    options: dict,
+    scheduler: object,
+    sessions: list = None,
+    max_running: int = None,
+    dependency: list = None,
+    stage_image: str = None,
+    submission: str = None,
+    corresponding: bool = False,
+) -> list:
+    """
+    Function to submit a stage to a scheduler.
+    With sessions it is submitted as an array
+    job with one task per session. The job
+    script and sessions file are named by
+    submission (see submission_files).
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    cmd: str
+        qunex cmd. Uses $SESSION if
+        sessions are given
+    options: dict
+        dict of job option: value
+    scheduler: object
+        Scheduler to submit to
+    sessions: list
+        list of sessions. Default
+        is None (not an array job)
+    max_running: int
+        max tasks to run at once.
+        Default is None (no limit)
+    dependency: list
+        list of job ids that must finish
+        successfully first. Default is None
+    stage_image: str
+        container image each job stages
+        on its node. Default is None
+    submission: str
+        id of submission. Default is None
+        (the time it is submitted)
+    corresponding: bool
+        each array task only waits on the
+        task of the same index of the
+        dependency. Default is False
+
+    Returns
+    -------
+    list: list object
+        list of job ids
+    """
+    name = options.get("jobname", "qpipeline")
+    log_folder = os.path.join(study_folder, "processing", "logs", "qpipeline")
+    os.makedirs(log_folder, exist_ok=True)
+    script_file, sessions_file = submission_files(
+        study_folder, name, submission or f"{datetime.now():%Y%m%d%H%M%S%f}"
+    )
+    folder = os.path.dirname(script_file)
+    os.makedirs(folder, exist_ok=True)
+    if sessions is not None:
+        error_and_exit(
+            sessions, f"No sessions found in {study_folder}/processing/batch.txt"
+        )
+        write_to_file(
+            folder,
+            os.path.basename(sessions_file),
+            [f"{ses}\n" for ses in sessions],
+            True,
+        )
+    else:
+        sessions_file = None
+    script = job_script(
+        cmd,
+        options,
+        scheduler,
+        os.path.join(log_folder, name),
+        sessions_file,
+        stage_image,
+    )
+    write_to_file(folder, os.path.basename(script_file), script, text_is_list=True)
+    with span("qpipeline_submit_seconds", stage=name):
+        job_ids = scheduler.submit(
+            script_file,
+            dependency=dependency,
+            tasks=len(sessions) if sessions is not None else None,
+            max_running=max_running,
+            corresponding=corresponding,
+        )
+    count("qpipeline_jobs_submitted_total", len(job_ids), stage=name)
+    return job_ids
@@ -0,0 +1,225 @@
+import os
+import sys
+import shutil
+
+
+def tombstone_marker() -> str:
+    """
+    Function to return the marker
+    in the name of folders waiting
+    to be deleted
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    str: string object
+        tombstone marker
+    """
+    return ".qpipeline_tombstone."
+
+
+def tombstone_folder(folder_path: str) -> str:
+    """
+    Function to move a folder out of
+    the way to be deleted later. The folder
+    is renamed, which is atomic and instant
+    however large the folder, to a hidden
+    tombstone next to it.
+
+    Parameters
+    ----------
+    folder_path: str
+        path to folder
+
+    Returns
+    -------
+    str: path
+        path to tombstone
+    """
+    from datetime import datetime
+
+    folder_path = os.path.abspath(folder_path).rstrip(os.sep)
+    tombstone = os.path.join(
+        os.path.dirname(folder_path),
+        f".{os.path.basename(folder_path)}{tombstone_marker()}"
+        f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}",
+    )
+    os.rename(folder_path, tombstone)
+    return tombstone
+
+
+def find_tombstones(folder_path: str) -> list:
+    """
+    Function to find tombstones left
+    next to a folder
+
+    Parameters
+    ----------
+    folder_path: str
+        path to folder
+
+    Returns
+    -------
+    list: list object
+        list of tombstone paths
+    """
+    folder_path = os.path.abspath(folder_path).rstrip(os.sep)
+    prefix = f".{os.path.basename(folder_path)}{tombstone_marker()}"
+    try:
+        with os.scandir(os.path.dirname(folder_path)) as entries:
+            return sorted(
+                entry.path
+                for entry in entries
+                if entry.name.startswith(prefix) and entry.is_dir(follow_symlinks=False)
+            )
+    except OSError:
+        return []
+
+
+def subtrees(path: str, depth: int = 2) -> list:
+    """
+    Function to split a folder into
+    subtrees that can be deleted at once.
+    Folders are split down to depth levels
+    (sessions/<session> in a study).
+
+    Parameters
+    ----------
+    path: str
+        path to folder
+    depth: int
+        how many levels to split.
+        Default is 2
+
+    Returns
+    -------
+    list: list object
+        list of subtree paths
+    """
+    trees = []
+    try:
+        with os.scandir(path) as entries:
+            folders = [
+                entry.path for entry in entries if entry.is_dir(follow_symlinks=False)
+            ]
+    except OSError:
+        return []
+    for folder in folders:
+        nested = subtrees(folder, depth - 1) if depth > 1 else []
+        trees += nested or [folder]
+    return trees
+
+
+def delete_tree(path: str, workers: int = 16) -> None:
+    """
+    Function to delete a folder,
+    deleting its subtrees in parallel.
+    Anything already deleted (e.g by
+    another deleter) is ignored.
+
+    Parameters
+    ----------
+    path: str
+        path to folder
+    workers: int
+        number of subtrees deleted
+        at once. Default is 16
+
+    Returns
+    -------
+    None
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(
+            pool.map(
+                lambda tree: shutil.rmtree(tree, ignore_errors=True), subtrees(path)
+            )
+        )
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def delete_in_background(tombstone: str) -> None:
+    """
+    Function to delete a tombstone in a
+    detached process, so it carries on
+    after qpipeline exits and isn't killed
+    with qpipeline's process group.
+
+    Parameters
+    ----------
+    tombstone: str
+        path to tombstone
+
+    Returns
+    -------
+    None
+    """
+    import subprocess
+
+    package_root = os.path.dirname(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    python_path = [package_root, os.environ.get("PYTHONPATH")]
+    subprocess.Popen(
+        [sys.executable, "-m", "qpipeline.base.tombstones", tombstone],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, python_path))},
+        start_new_session=True,
+    )
+
+
+def remove_folder(folder_path: str) -> None:
+    """
+    Function to remove a folder without
+    waiting for it to be deleted. The folder
+    is tombstoned then deleted in the
+    background.
+
+    Parameters
+    ----------
+    folder_path: str
+        path to folder
+
+    Returns
+    -------
+    None
+    """
+    tombstone = tombstone_folder(folder_path)
+    print(f"Deleting old {folder_path} in the background")
+    delete_in_background(tombstone)
+
+
+def clean_up_tombstones(args: dict) -> None:
+    """
+    Main function to delete tombstones
+    left next to a study folder by
+    interrupted runs.
+
+    Parameters
+    ----------
+    args: dict
+        cmd line args
+
+    Returns
+    -------
+    None
+    """
+    tombstones = find_tombstones(args["study_folder"])
+    if not tombstones:
+        print(f"Nothing to clean up for {args['study_folder']}")
+        return None
+    for tombstone in tombstones:
+        print(f"Deleting {tombstone}", flush=True)
+        delete_tree(tombstone, args.get("workers") or 16)
+    print(f"Deleted {len(tombstones)} tombstone(s)")
+
+
+if __name__ == "__main__":
+    delete_tree(sys.argv[1])
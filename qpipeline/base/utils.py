@@ -1,8 +1,5 @@
-import subprocess
 import re
 import os
-import shutil
-import glob
 from qpipeline.base.signit import kill_group
 
 
@@ -63,35 +60,130 @@ def error_and_exit(
         exit(1)
 
 
-def run_cmd(command: list, no_return: bool = False) -> dict:
+def read_lines(stream: object, tail: object, handlers: list) -> None:
+    """
+    Function to read a stream line by line,
+    keeping the last lines in tail and passing
+    every line to each handler.
+
+    Parameters
+    ----------
+    stream: object
+        text stream to read
+    tail: collections.deque
+        bounded deque of last lines
+    handlers: list
+        list of functions taking a line
+
+    Returns
+    -------
+    None
+    """
+    for line in stream:
+        tail.append(line)
+        for handler in handlers:
+            handler(line)
+    stream.close()
+
+
+def run_cmd(
+    command: list,
+    no_return: bool = False,
+    consumers: list = None,
+    log_file: str = None,
+    echo: bool = False,
+    tail_lines: int = 200,
+) -> dict:
     """
     Function to run cmd command.
+    stdout and stderr are read line by line
+    as the command runs so output is never
+    held in memory in full.
 
     Parameters
     ----------
     command: list
         command to run
+    no_return: bool
+        return None rather than output
+    consumers: list
+        list of functions that are given
+        each line of stdout as it is printed.
+        Default is None
+    log_file: str
+        file to write all of stdout and
+        stderr to. Default is None
+    echo: bool
+        print output as it comes.
+        Default is False
+    tail_lines: int
+        number of lines of stdout and
+        stderr to keep
 
     Returns
     -------
     output: dict
-        dict of output from subprocess
-        command
+        dict of args, returncode and the
+        last tail_lines of stdout and stderr
     """
-    try:
-        qpipe_env = os.environ.copy()
-        run = subprocess.run(command, capture_output=True, shell=True, env=qpipe_env)
-    except subprocess.CalledProcessError as error:
-        error_and_exit(False, f"Error in calling commnd due to: {error}")
-    except KeyboardInterrupt:
-        run.kill()
+    import subprocess
+    import threading
+    from collections import deque
+    from qpipeline.base.metrics import span, command_label
+
+    stdout_tail = deque(maxlen=tail_lines)
+    stderr_tail = deque(maxlen=tail_lines)
+    log = open(log_file, "a") if log_file else None
+    log_lock = threading.Lock()
+
+    def spill(line: str) -> None:
+        with log_lock:
+            log.write(line)
+
+    def show(line: str) -> None:
+        print(line, end="", flush=True)
+
+    handlers = ([spill] if log else []) + ([show] if echo else [])
+    with span("qpipeline_run_cmd_seconds", cmd=command_label(command)):
+        try:
+            run = subprocess.Popen(
+                command,
+                shell=True,
+                env=os.environ.copy(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+            )
+        except OSError as error:
+            error_and_exit(False, f"Error in calling commnd due to: {error}")
+        stderr_reader = threading.Thread(
+            target=read_lines, args=(run.stderr, stderr_tail, handlers), daemon=True
+        )
+        stderr_reader.start()
+        try:
+            read_lines(run.stdout, stdout_tail, handlers + (consumers or []))
+            stderr_reader.join()
+            returncode = run.wait()
+        except KeyboardInterrupt:
+            run.kill()
+            raise
+        finally:
+            if log:
+                log.close()
 
     output = {
-        key: value.decode("utf-8").strip() if isinstance(value, bytes) else value
-        for key, value in vars(run).items()
+        "args": command,
+        "returncode": returncode,
+        "stdout": "".join(stdout_tail).strip(),
+        "stderr": "".join(stderr_tail).strip(),
     }
     if output["returncode"] != 0:
-        error_and_exit(False, f"Error in calling commnd due to: {output['stderr']}")
+        error_message = f"Error in calling commnd due to: {output['stderr']}"
+        if log_file:
+            error_message += f"\nFull output is in {log_file}"
+        error_and_exit(False, error_message)
     if no_return:
         return None
     return output
@@ -134,20 +226,129 @@ def write_to_file(
     return True
 
 
-def container_path() -> str:
+def container_path(stage: bool = False) -> str:
     """
     Function to get container path
 
     Parameters
     ----------
-    None
+    stage: bool
+        copy the container to node-local
+        storage and return the copy.
+        Default is False
 
     Returns
     -------
     str: path
        path to qunex container
     """
-    return os.environ["QUNEXCONIMAGE"].rstrip()
+    image = os.environ["QUNEXCONIMAGE"].rstrip()
+    if stage:
+        from qpipeline.base.image_staging import stage_image
+
+        return stage_image(image)
+    return image
+
+
+def qpipeline_folder(study_folder: str) -> str:
+    """
+    Function to return (and create) the
+    folder qpipeline keeps its own files in
+    inside a study.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    str: path
+        path to processing/qpipeline
+    """
+    path = os.path.join(study_folder, "processing", "qpipeline")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def read_study_info(study_folder: str) -> dict:
+    """
+    Function to read what qpipeline recorded
+    about a study when it was set up
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    dict: dictionary
+        dict of study info. Empty if
+        nothing has been recorded.
+    """
+    import json
+
+    try:
+        with open(
+            os.path.join(study_folder, "processing", "qpipeline", "study.json")
+        ) as info:
+            return json.load(info)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_study_info(study_folder: str, **info) -> None:
+    """
+    Function to record info about
+    a study, keeping anything already
+    recorded.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    info: keyword arguments
+        info to record
+
+    Returns
+    -------
+    None
+    """
+    import json
+
+    study_info = {**read_study_info(study_folder), **info}
+    write_to_file(
+        qpipeline_folder(study_folder), "study.json", json.dumps(study_info, indent=2)
+    )
+
+
+def get_sessions(study_folder: str) -> list:
+    """
+    Function to get the sessions in
+    a study's processing/batch.txt
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    list: list object
+        list of session ids. Empty
+        if there is no batch file.
+    """
+    sessions = []
+    try:
+        with open(os.path.join(study_folder, "processing", "batch.txt")) as batch:
+            for line in batch:
+                key, _, value = line.partition(":")
+                if key.strip() == "session" and value.strip():
+                    sessions.append(value.strip())
+    except OSError:
+        return []
+    return sessions
 
 
 def make_directory(
@@ -168,10 +369,11 @@ def make_directory(
     -------
     None
     """
+    from qpipeline.base.tombstones import remove_folder
 
     try:
         if os.path.exists(path) and overwrite:
-            shutil.rmtree(path, ignore_errors=True)
+            remove_folder(path)
         os.mkdir(path)
     except Exception as e:
         if ignore_errors:
@@ -195,6 +397,8 @@ def copy_files(srcfile: str, dest: str) -> None:
     -------
     None
     """
+    import shutil
+
     try:
         shutil.copy2(srcfile, dest)
     except Exception as e:
@@ -222,17 +426,15 @@ def delete_files_in_dir(path: str) -> None:
         error_and_exit(f"Unable to delete files in {path} due to {e}")
 
 
-def check_logs(
-    logs_directory: str, command_ran: str, setup_check: bool = False
-) -> list:
+def check_logs(qunex_dir: str, command_ran: str, setup_check: bool = False) -> tuple:
     """
-    Function to check log files fpr
-    completed files.
+    Function to get the latest comlog
+    of a command from the comlog index.
 
     Parameters
     ----------
-    logs_directory: str
-        directory of the log files
+    qunex_dir: str
+        path to study folder
     command_ran: str
         str of command run
     setup_check: bool
@@ -241,12 +443,21 @@ def check_logs(
 
     Returns
     -------
-    list: list object
-        list of log files
-        that have been completed
+    tuple: tuple object
+        (status, timestamp) of the latest
+        log or None if there isn't one
     """
-    log_name = f"done_hcp_{command_ran}" if not setup_check else f"done_{command_ran}"
-    return glob.glob(os.path.join(logs_directory, f"{log_name}*"))
+    from qpipeline.base.comlogs import Comlog_Index
+
+    command = command_ran if setup_check else f"hcp_{command_ran}"
+    index = Comlog_Index(qunex_dir).update()
+    latest = [
+        log
+        for logged in index.index["logs"]
+        if logged == command or logged.startswith(f"{command}_")
+        for log in index.latest(logged).values()
+    ]
+    return max(latest, key=lambda log: log[1]) if latest else None
 
 
 def has_qunex_run_sucessfully(
@@ -254,22 +465,26 @@ def has_qunex_run_sucessfully(
 ) -> None:
     """
     Function to check qunex log files
-    to check that a given command has run sucesfully
+    to check that a given command has run
+    sucesfully, going by its latest comlog
 
     Parameters
     ----------
-    sub_dir: str
-        path to qunex sub directory
+    qunex_dir: str
+        path to study folder
     command_ran: str
         what command to check for
+    setup_check: bool
+        is the cmd that was run
+        a setup cmd.
 
     Returns
     -------
     None
     """
     logs_directory = os.path.join(qunex_dir, "processing", "logs", "comlogs")
-    log_file = check_logs(logs_directory, command_ran, setup_check)
-    if not log_file:
+    latest = check_logs(qunex_dir, command_ran, setup_check)
+    if not latest or latest[0] != "done":
         error_and_exit(
             False,
             f"Qunex {command_ran} not run sucessfully. Please check log files at {logs_directory}",
@@ -278,18 +493,26 @@ def has_qunex_run_sucessfully(
 
 def folder_creation(folder_path: str, overwrite=False) -> None:
     """
-    Function to remove folder
+    Function to create a folder.
+    An existing folder is overwritten
+    by moving it out of the way and
+    deleting it in the background.
 
     Parameters
     ----------
     folder_path: str
         path to folder
+    overwrite: bool
+        overwrite existing folder.
+        Default is False
 
     Returns
     -------
     None
     """
+    from qpipeline.base.tombstones import remove_folder
+
     if os.path.exists(folder_path) and overwrite:
-        shutil.rmtree(folder_path)
+        remove_folder(folder_path)
     if not os.path.exists(folder_path):
         os.mkdir(folder_path)
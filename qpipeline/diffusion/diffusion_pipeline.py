@@ -1,8 +1,14 @@
-from qpipeline.base.utils import container_path, run_cmd
+from qpipeline.base.utils import container_path
+from qpipeline.base.submission import session_flag, array_sessions
+from qpipeline.base.resources import stage_resources, job_options
+from qpipeline.base.session_staging import session_cmd
 
 
 def diffusion_cmd(
-    study_folder: str, qunex_con_image: str, queue: str, no_gpu: bool
+    study_folder: str,
+    qunex_con_image: str,
+    no_gpu: bool,
+    sessions: str = None,
 ) -> str:
     """
     Diffusion qunex cmd
@@ -11,14 +17,13 @@ def diffusion_cmd(
     ----------
     study_folder: str
         Path to study folder.
-    sub_id: str
-        Subject ID.
     qunex_con_image: str
         Container path.
-    queue: str
-        Cluster queue
     no_gpu: bool
         Don't use gpu
+    sessions: str
+        Only run these sessions from
+        the batch file. Default is None
 
     Returns
     -------
@@ -34,14 +39,120 @@ def diffusion_cmd(
       --overwrite=yes"""
     if no_gpu:
         cmd += " \\\n      --hcp_dwi_nogpu"
-    if queue:
-        cmd += f""" \\
-      --bash_pre="module load qunex-img/0.100.0;module load cuda-img/9.1" \\
-      --scheduler="SLURM,time=24:00:00,ntasks=1,cpus-per-task=1,mem-per-cpu=50000,partition={queue},qos=img,gres=gpu:1,jobname=diffusion" """
+    if sessions:
+        cmd += f" \\\n      --sessions={sessions}"
 
     return cmd
 
 
+def run_diffusion_locally(args: dict, sessions: list = None) -> None:
+    """
+    Run QuNex HCP diffusion pipeline on this
+    machine, running sessions in parallel.
+
+    Parameters
+    ----------
+    args: dict
+        Dictionary of command arguments
+        (study_folder, no_gpu, workers).
+    sessions: list
+        list of sessions to run. Default
+        is None (every session)
+
+    Returns
+    -------
+    None
+    """
+    from qpipeline.base.local_runner import run_stage_locally
+
+    qunex_con_image = container_path(args.get("stage_image"))
+    run_stage_locally(
+        args["study_folder"],
+        "diffusion",
+        lambda session: session_cmd(
+            args,
+            session,
+            lambda study_folder: diffusion_cmd(
+                study_folder=study_folder,
+                qunex_con_image=qunex_con_image,
+                no_gpu=args.get("no_gpu", False),
+                sessions=session,
+            ),
+        ),
+        stage_resources(args, "diffusion", sessions),
+        args.get("workers"),
+        sessions,
+    )
+
+
+def submit_diffusion(
+    args: dict,
+    dependency: list = None,
+    sessions: list = None,
+    submission: str = None,
+    corresponding: bool = False,
+) -> list:
+    """
+    Submit QuNex HCP diffusion pipeline
+    to the scheduler. With --array each
+    session is its own array task.
+
+    Parameters
+    ----------
+    args: dict
+        Dictionary of command arguments
+        (study_folder, queue, scheduler,
+        no_gpu, array, max_running).
+    dependency: list
+        Job IDs that must finish
+        successfully before diffusion
+        starts. Default is None.
+    sessions: list
+        list of sessions to run. Default
+        is None (every session)
+
+    submission: str
+        id of submission. Default is
+        None (the time it is submitted)
+    corresponding: bool
+        each array task only waits on the
+        session of the same index of the
+        dependency. Default is False
+
+    Returns
+    -------
+    list: list object
+        list of job ids
+    """
+    from qpipeline.base.submission import submit_stage
+    from qpipeline.base.schedulers import get_scheduler
+    from qpipeline.base.image_staging import job_container
+
+    qunex_con_image, stage_image = job_container(args.get("stage_image"))
+    cmd = session_cmd(
+        args,
+        session_flag(args, sessions),
+        lambda study_folder: diffusion_cmd(
+            study_folder=study_folder,
+            qunex_con_image=qunex_con_image,
+            no_gpu=args.get("no_gpu", False),
+            sessions=session_flag(args, sessions),
+        ),
+    )
+    return submit_stage(
+        args["study_folder"],
+        cmd,
+        job_options(stage_resources(args, "diffusion", sessions), "diffusion"),
+        get_scheduler(args.get("scheduler")),
+        array_sessions(args, sessions),
+        args.get("max_running"),
+        dependency,
+        stage_image,
+        submission,
+        corresponding,
+    )
+
+
 def hcp_diffusion(args: dict) -> None:
     """
     Main function to run diffusion pipeline
@@ -55,14 +166,16 @@ def hcp_diffusion(args: dict) -> None:
     -------
     None
     """
-    print(f"Running Diffusion pipeline on: {args['id']}")
-    qunex_con_image = container_path()
-    diff_cmd = diffusion_cmd(
-        study_folder=args["study_folder"],
-        qunex_con_image=qunex_con_image,
-        queue=args.get("queue", ""),
-        no_gpu=args["no_gpu"],
-    )
-    run_cmd(diff_cmd, no_return=True)
-    if args["queue"]:
-        print(f"Submitted to {args['queue']}")
+    print(f"Running Diffusion pipeline on: {args['study_folder']}")
+    if args.get("queue"):
+        from qpipeline.base.run_manifest import queue_stages
+
+        queue_stages("diffusion", args, ["diffusion"])
+        return None
+    from qpipeline.base.comlogs import sessions_to_run
+
+    sessions = sessions_to_run(args, ["diffusion"])["diffusion"]
+    if sessions == []:
+        print("diffusion already done for every session")
+        return None
+    run_diffusion_locally(args, sessions)
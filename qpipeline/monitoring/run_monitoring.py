@@ -0,0 +1,161 @@
+import os
+from collections import Counter
+from qpipeline.base.utils import error_and_exit
+from qpipeline.base.run_manifest import Run_Manifest, follow_run
+
+
+def load_manifest(study_folder: str) -> Run_Manifest:
+    """
+    Function to load a study's run
+    manifest, exiting if there isn't one
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    Run_Manifest: object
+        run manifest
+    """
+    manifest = Run_Manifest(study_folder)
+    error_and_exit(
+        manifest.run,
+        f"No run found in {study_folder}. Runs are only recorded with --queue",
+    )
+    return manifest
+
+
+def attach_run(args: dict) -> None:
+    """
+    Main function to pick up monitoring of
+    the last run of a study and submit any
+    stages still to run. Nothing already
+    submitted is submitted again.
+
+    Parameters
+    ----------
+    args: dict
+        cmd line args
+
+    Returns
+    -------
+    None
+    """
+    from qpipeline.base.schedulers import get_scheduler
+
+    manifest = load_manifest(args["study_folder"])
+    unfinished = manifest.unfinished()
+    if not unfinished:
+        print("Nothing left to run. Use qpipeline status to see how the run went")
+        return None
+    scheduler = get_scheduler(manifest.run["args"].get("scheduler"))
+    error_and_exit(
+        scheduler.outlives_qpipeline,
+        f"Jobs on the {scheduler.name} scheduler stop with qpipeline so can't be "
+        f"attached to. Rerun {manifest.run['command']} with --resume",
+    )
+    print(
+        f"Attaching to {manifest.run['command']} started {manifest.run['started']}",
+        flush=True,
+    )
+    follow_run(manifest)
+
+
+def stage_summary(record: dict) -> str:
+    """
+    Function to summarise a stage
+    of a run in one line
+
+    Parameters
+    ----------
+    record: dict
+        stage record from the manifest
+
+    Returns
+    -------
+    str: string object
+        summary of stage
+    """
+    from qpipeline.base.schedulers import get_scheduler
+
+    summary = f"{record['stage']:<16} {record['state']:<10}"
+    if record["job_ids"]:
+        summary += f" {len(record['job_ids'])} job(s) submitted {record['submitted']}"
+    states = record["job_states"]
+    if record["state"] == "submitted":
+        states = get_scheduler(record["scheduler"]).status(record["job_ids"])
+    if states:
+        counts = Counter(states.get(job, "UNKNOWN") for job in record["job_ids"])
+        summary += " (" + ", ".join(f"{n} {state}" for state, n in counts.items()) + ")"
+    return summary
+
+
+def session_summary(states: dict) -> None:
+    """
+    Function to print how many sessions
+    are in each state for every stage
+
+    Parameters
+    ----------
+    states: dict
+        dict of stage: dict of session: state
+
+    Returns
+    -------
+    None
+    """
+    columns = ["done", "failed", "running", "not_run"]
+    print(f"{'stage':<16}" + "".join(f"{column:>10}" for column in columns))
+    for stage, sessions in states.items():
+        counts = Counter(sessions.values())
+        print(f"{stage:<16}" + "".join(f"{counts[column]:>10}" for column in columns))
+
+
+def run_status(args: dict) -> None:
+    """
+    Main function to print the status of
+    the last run of a study and the state
+    of every session for each stage. With
+    --state the sessions in that state are
+    listed instead.
+
+    Parameters
+    ----------
+    args: dict
+        cmd line args
+
+    Returns
+    -------
+    None
+    """
+    from qpipeline.base.comlogs import session_states
+
+    error_and_exit(
+        os.path.isdir(args["study_folder"]),
+        f"{args['study_folder']} does not exist",
+    )
+    error_and_exit(
+        os.path.isfile(os.path.join(args["study_folder"], "processing", "batch.txt")),
+        f"No processing/batch.txt in {args['study_folder']}. Is it a set up study?",
+    )
+    stages = [args["stage"]] if args.get("stage") else None
+    states = session_states(args["study_folder"], stages)
+    if args.get("state"):
+        for stage, sessions in states.items():
+            for session, state in sessions.items():
+                if state == args["state"]:
+                    print(session if stages else f"{stage} {session}")
+        return None
+    manifest = Run_Manifest(args["study_folder"])
+    if manifest.run:
+        manifest.update_finished()
+        print(f"{manifest.run['command']} started {manifest.run['started']}")
+        print("-" * 75)
+        for record in manifest.run["stages"]:
+            print(stage_summary(record))
+        print("-" * 75)
+    sessions = len(next(iter(states.values()), {}))
+    print(f"{sessions} session(s), going by the qunex comlogs")
+    session_summary(states)
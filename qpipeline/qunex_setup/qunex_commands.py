@@ -29,6 +29,8 @@ def import_data(
     study_folder: str,
     qunex_con_image: str,
     raw_data: str,
+    subjects: list = None,
+    action: str = "copy",
 ) -> list:
     """
     Function for the qunex import bids command
@@ -43,21 +45,27 @@ def import_data(
         subject id
     raw_data: str
         path to raw data
+    subjects: list
+        only import these subject
+        folders. Default is None
+    action: str
+        link (hardlink) or copy
+        images. Default is copy
 
     Returns
     -------
     list: list object
         list of command
     """
-
+    subject_flag = f"--sessions={','.join(subjects)} \\\n    " if subjects else ""
     return [
         f"""qunex_container import_bids \\
     --sessionsfolder={study_folder}/sessions \\
     --inbox={raw_data} \\
-    --action=copy \\
+    --action={action} \\
     --archive=leave \\
     --overwrite=no \\
-    --bind={study_folder}:{study_folder},{raw_data}:{raw_data} \\
+    {subject_flag}--bind={study_folder}:{study_folder},{raw_data}:{raw_data} \\
     --container={qunex_con_image}
     """
     ]
@@ -66,6 +74,7 @@ def import_data(
 def create_session_info(
     study_folder: str,
     qunex_con_image: str,
+    sessions: list = None,
 ) -> list:
     """
     Function for the qunex import bids command
@@ -78,21 +87,22 @@ def create_session_info(
         qunex container path
     sub_id: str
         subject id
-    session_id: str
-        session id
+    sessions: list
+        only run on these sessions.
+        Default is None
 
     Returns
     -------
     list: list object
         list of command
     """
-
+    session_flag = f"--sessions={','.join(sessions)} \\\n    " if sessions else ""
     return [
         f"""qunex_container create_session_info \\
     --sessionsfolder={study_folder}/sessions \\
     --bind={study_folder}:{study_folder} \\
     --mapping={study_folder}/hcp_mapping_file.txt \\
-    --container={qunex_con_image}
+    {session_flag}--container={qunex_con_image}
     """
     ]
 
@@ -101,6 +111,7 @@ def create_batch(
     study_folder: str,
     qunex_con_image: str,
     path_to_batch: str,
+    sessions: list = None,
 ) -> list:
     """
     Function for the qunex import bids command
@@ -113,21 +124,26 @@ def create_batch(
         qunex container path
     path_to_batch: str
         path to batch file
+    sessions: list
+        only add these sessions, appending
+        them to the batch file. Default
+        is None (every session, overwriting)
 
     Returns
     -------
     list: list object
         list of command
     """
-
+    session_flag = f"--sessions={','.join(sessions)} \\\n    " if sessions else ""
+    overwrite = "append" if sessions else "yes"
     return [
         f"""qunex_container create_batch \\
     --bind={study_folder}:{study_folder} \\
     --sessionsfolder={study_folder}/sessions \\
     --targetfile={study_folder}/processing/batch.txt \\
     --paramfile={path_to_batch} \\
-    --overwrite=yes \\
-    --container={qunex_con_image}
+    --overwrite={overwrite} \\
+    {session_flag}--container={qunex_con_image}
     """
     ]
 
@@ -136,6 +152,7 @@ def set_up_hcp(
     study_folder: str,
     qunex_con_image: str,
     raw_data: str,
+    sessions: list = None,
 ) -> list:
     """
     Function for the qunex import bids command
@@ -152,18 +169,21 @@ def set_up_hcp(
         session id
     raw_data: str
         path to raw data
+    sessions: list
+        only run on these sessions.
+        Default is None
 
     Returns
     -------
     list: list object
         list of command
     """
-
+    session_flag = f"--sessions={','.join(sessions)} \\\n    " if sessions else ""
     return [
         f"""qunex_container setup_hcp \\
     --bind={study_folder}:{study_folder},{raw_data}:{raw_data} \\
     --sessionsfolder={study_folder}/sessions \\
     --batchfile={study_folder}/processing/batch.txt \\
-    --container={qunex_con_image}
+    {session_flag}--container={qunex_con_image}
     """
     ]
@@ -5,7 +5,14 @@ from qpipeline.base.utils import (
     has_qunex_run_sucessfully,
     error_and_exit,
     folder_creation,
+    write_study_info,
+    qpipeline_folder,
+    read_study_info,
+    get_sessions,
 )
+from qpipeline.base.bids_index import Bids_Index
+from qpipeline.base.metrics import span
+from qpipeline.base.local_runner import available_cpus
 from qpipeline.qunex_setup.qunex_commands import (
     create_study,
     import_data,
@@ -58,6 +65,61 @@ def map_scans(file_mapping: dict, label: str) -> str:
     return file_mapping.get(label, label)
 
 
+class Scan_Mapping:
+    """
+    Class to build the hcp mapping file
+    from the output of qunex import_bids,
+    one line at a time as it is printed.
+
+    Usage
+    -----
+    mapping = Scan_Mapping()
+    run_cmd(cmd, consumers=[mapping])
+    mapping.write(study_path)
+    """
+
+    def __init__(self) -> None:
+        self.pattern = re.compile(
+            r"---> linked (\d+\.nii\.gz) <-- sub-[^_]+_(?:ses-[^_]+_)?(.*)\.nii\.gz"
+        )
+        self.file_mapping = map_files()
+        self.mapped_files = {}
+
+    def __call__(self, line: str) -> None:
+        """
+        Method to map any scans
+        linked in a line of output
+
+        Parameters
+        ----------
+        line: str
+            line of qunex output
+
+        Returns
+        -------
+        None
+        """
+        for match in self.pattern.finditer(line):
+            number = match.group(1).split(".")[0]
+            self.mapped_files[number] = map_scans(self.file_mapping, match.group(2))
+
+    def write(self, study_path: str) -> None:
+        """
+        Method to write the mapping file
+
+        Parameters
+        ----------
+        study_path: str
+            path to study folder
+
+        Returns
+        -------
+        None
+        """
+        result = [f"{num} => {label}\n" for num, label in self.mapped_files.items()]
+        write_to_file(study_path, "hcp_mapping_file.txt", result, text_is_list=True)
+
+
 def parse_output(output: str, study_path: str) -> None:
     """
     Function to parse through output
@@ -72,17 +134,33 @@ def parse_output(output: str, study_path: str) -> None:
     -------
     None
     """
-    pattern = re.compile(
-        r"---> linked (\d+\.nii\.gz) <-- sub-[^_]+_(?:ses-[^_]+_)?(.*)\.nii\.gz"
-    )
-    mapped_files = {}
-    file_mapping = map_files()
-    for match in pattern.finditer(output):
-        number = match.group(1).split(".")[0]
-        label = match.group(2)
-        mapped_files[number] = map_scans(file_mapping, label)
-    result = [f"{num} => {label}\n" for num, label in mapped_files.items()]
-    write_to_file(study_path, "hcp_mapping_file.txt", result, text_is_list=True)
+    mapping = Scan_Mapping()
+    for line in output.splitlines():
+        mapping(line)
+    mapping.write(study_path)
+
+
+def setup_log(study_folder: str, step: str) -> str:
+    """
+    Function to return the log file
+    the output of a setup step is
+    written to.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    step: str
+        name of setup step
+
+    Returns
+    -------
+    str: path
+        path to log file
+    """
+    log_folder = os.path.join(study_folder, "processing", "logs", "qpipeline")
+    os.makedirs(log_folder, exist_ok=True)
+    return os.path.join(log_folder, f"{step}.log")
 
 
 def batch_file(data_type: str, study_path: str, customse_batch: str = None) -> None:
@@ -191,13 +269,309 @@ def study_create(
     has_qunex_run_sucessfully(study_folder, "create_study", setup_check=True)
 
 
+def qunex_session_id(subject: str, session: str) -> str:
+    """
+    Function to return the name qunex
+    import_bids gives a bids session:
+    the subject id, then the session id
+    if there is one, without the
+    sub- and ses- prefixes.
+
+    Parameters
+    ----------
+    subject: str
+        subject folder name
+    session: str
+        session folder name or
+        "" if there isn't one
+
+    Returns
+    -------
+    str: string object
+        qunex session id
+    """
+    session_id = subject.removeprefix("sub-")
+    if session:
+        session_id += f"_{session.removeprefix('ses-')}"
+    return session_id
+
+
+def raw_images(index, subjects: list = None) -> list:
+    """
+    Function to list the path of
+    every image in a bids index
+
+    Parameters
+    ----------
+    index: Bids_Index
+        built bids index
+    subjects: list
+        only list images of these
+        subjects. Default is None
+
+    Returns
+    -------
+    list: list object
+        list of image paths
+    """
+    return [
+        os.path.join(index.raw_data, subject, session, modality, image)
+        for subject, session in index.sessions()
+        if subjects is None or subject in subjects
+        for modality, images in index.subjects[subject]["sessions"][session].items()
+        for image in images
+    ]
+
+
+def can_hardlink(source: str, folder: str) -> bool:
+    """
+    Function to check a file can be
+    hardlinked into a folder. Fails across
+    filesystems and when the filesystem or
+    kernel (protected_hardlinks) won't allow it.
+
+    Parameters
+    ----------
+    source: str
+        path to file
+    folder: str
+        path to folder
+
+    Returns
+    -------
+    bool: boolean
+        True if a hardlink could be made
+    """
+    test_link = os.path.join(folder, f".link_test_{os.getpid()}")
+    try:
+        os.link(source, test_link)
+    except OSError:
+        return False
+    os.remove(test_link)
+    return True
+
+
+def import_action(action: str, study_folder: str, images: list) -> str:
+    """
+    Function to decide how images are
+    imported. With auto, images are hardlinked
+    if they can be, otherwise copied.
+
+    Parameters
+    ----------
+    action: str
+        auto, link or copy
+    study_folder: str
+        path to study folder
+    images: list
+        list of raw image paths
+
+    Returns
+    -------
+    str: string object
+        link or copy
+    """
+    if action and action != "auto":
+        return action
+    if images and can_hardlink(
+        os.path.realpath(images[0]), qpipeline_folder(study_folder)
+    ):
+        return "link"
+    return "copy"
+
+
+def check_bind_mounts(images: list, binds: list) -> None:
+    """
+    Function to check every image can be
+    read from inside the container. Images
+    that are symlinks must point inside
+    one of the bound folders.
+
+    Parameters
+    ----------
+    images: list
+        list of raw image paths
+    binds: list
+        list of folders bound
+        into the container
+
+    Returns
+    -------
+    None
+    """
+    bound = [os.path.realpath(folder) for folder in binds]
+    unreadable = [
+        image
+        for image in images
+        if os.path.islink(image)
+        and not any(
+            os.path.commonpath([os.path.realpath(image), folder]) == folder
+            for folder in bound
+        )
+    ]
+    error_and_exit(
+        not unreadable,
+        f"{len(unreadable)} images link outside of {', '.join(binds)} so can't be "
+        f"read in the container, e.g {', '.join(unreadable[:5])}",
+    )
+
+
+def new_subjects(index, study_folder: str) -> list:
+    """
+    Function to find subjects in the raw
+    data with sessions that aren't in the
+    study's batch file yet.
+
+    Parameters
+    ----------
+    index: Bids_Index
+        built bids index of raw data
+    study_folder: str
+        path to study folder
+
+    Returns
+    -------
+    list: list object
+        list of subject folder names
+    """
+    existing = set(get_sessions(study_folder))
+    return sorted(
+        {
+            subject
+            for subject, session in index.sessions()
+            if qunex_session_id(subject, session) not in existing
+        }
+    )
+
+
+def import_shards(
+    index,
+    workers: int,
+    shard_size: int = None,
+    subjects: list = None,
+    set_up: list = None,
+) -> list:
+    """
+    Function to split the subjects in
+    the raw data into shards that are
+    set up at the same time. A single shard
+    of every subject has subjects and sessions
+    of None so nothing is filtered. Sessions
+    already set up are left out of a shard's
+    sessions so they aren't set up again.
+
+    Parameters
+    ----------
+    index: Bids_Index
+        built bids index of raw data
+    workers: int
+        number of shards ran at once
+    shard_size: int
+        subjects per shard. Default is None
+        (shared between the workers, at most 50)
+    subjects: list
+        only set up these subjects.
+        Default is None (every subject)
+    set_up: list
+        qunex sessions already set up.
+        Default is None
+
+    Returns
+    -------
+    list: list object
+        list of shards, each a dict with
+        subjects and (qunex) sessions
+    """
+    set_up = set(set_up or [])
+    everything = subjects is None
+    subjects = list(index.subjects) if everything else subjects
+    error_and_exit(subjects, f"No subjects found in {index.raw_data}")
+    if not shard_size:
+        shard_size = min(50, -(-len(subjects) // workers))
+    if everything and len(subjects) <= shard_size:
+        return [{"subjects": None, "sessions": None}]
+    return [
+        {
+            "subjects": subjects[start : start + shard_size],
+            "sessions": [
+                qunex_session_id(subject, session)
+                for subject in subjects[start : start + shard_size]
+                for session in index.subjects[subject]["sessions"]
+                if qunex_session_id(subject, session) not in set_up
+            ],
+        }
+        for start in range(0, len(subjects), shard_size)
+    ]
+
+
+def run_shards(study_folder: str, step: str, shard_cmds: dict, workers: int) -> None:
+    """
+    Function to run a setup step
+    for every shard at once, exiting
+    if any shard fails.
+
+    Parameters
+    ----------
+    study_folder: str
+        path to study folder
+    step: str
+        name of setup step
+    shard_cmds: dict
+        dict of shard name: cmd
+    workers: int
+        number of shards ran at once
+
+    Returns
+    -------
+    None
+    """
+    from qpipeline.base.local_runner import run_sessions_locally
+
+    log_folder = os.path.dirname(setup_log(study_folder, step))
+    print(f"Running {step}", flush=True)
+    failed = run_sessions_locally(shard_cmds, log_folder, step, workers, "shards")
+    error_and_exit(
+        not failed,
+        f"{step} failed for {', '.join(sorted(failed))}. "
+        f"Please check log files at {log_folder}/{step}_<shard>.log",
+    )
+    has_qunex_run_sucessfully(study_folder, step, setup_check=True)
+
+
+def shard_commands(shards: list, command) -> dict:
+    """
+    Function to build a cmd for
+    every shard.
+
+    Parameters
+    ----------
+    shards: list
+        list of shards
+    command: Callable
+        function taking a shard
+        returning a cmd
+
+    Returns
+    -------
+    dict: dictionary
+        dict of shard name: cmd
+    """
+    return {f"shard_{idx}": command(shard)[0] for idx, shard in enumerate(shards)}
+
+
 def data_importing(
     study_folder: str,
     qunex_con_image: str,
     raw_data: str,
+    shards: list,
+    workers: int,
+    action: str = "copy",
 ) -> None:
     """
-    Warpper function around
+    Warpper function around import_data
+    function. Each shard is imported
+    at the same time and the scan mappings
+    from each merged into one file.
 
     Parameters
     -----------
@@ -207,24 +581,39 @@ def data_importing(
         qunex conatiner image path
     raw_data: str
         path to raw data
+    shards: list
+        list of shards
+    workers: int
+        number of shards ran at once
+    action: str
+        link or copy. Default is copy
 
     Returns
     -------
     None
     """
-
-    data_importing = import_data(
-        study_folder,
-        qunex_con_image,
-        raw_data,
+    shard_cmds = shard_commands(
+        shards,
+        lambda shard: import_data(
+            study_folder,
+            qunex_con_image,
+            raw_data,
+            shard["subjects"],
+            action,
+        ),
     )
+    run_shards(study_folder, "import_bids", shard_cmds, workers)
+    mapping = Scan_Mapping()
+    for shard in shard_cmds:
+        with open(setup_log(study_folder, f"import_bids_{shard}")) as log:
+            for line in log:
+                mapping(line)
+    mapping.write(study_folder)
 
-    import_data_output = run_cmd(data_importing)
-    has_qunex_run_sucessfully(study_folder, "import_bids", setup_check=True)
-    parse_output(import_data_output["stdout"], study_folder)
 
-
-def create_session(study_folder: str, qunex_con_image: str) -> str:
+def create_session(
+    study_folder: str, qunex_con_image: str, shards: list, workers: int
+) -> None:
     """
     Warpper function around create_session
     function
@@ -235,18 +624,22 @@ def create_session(study_folder: str, qunex_con_image: str) -> str:
         string to study folder
     qunex_con_image: str
         qunex conatiner image path
-    id: str
-        sub id
+    shards: list
+        list of shards
+    workers: int
+        number of shards ran at once
 
     Returns
     -------
-    session_id: str
-        session id for
-        created session
+    None
     """
-    ses_info = create_session_info(study_folder, qunex_con_image)
-    run_cmd(ses_info, no_return=True)
-    has_qunex_run_sucessfully(study_folder, "create_session_info", setup_check=True)
+    shard_cmds = shard_commands(
+        shards,
+        lambda shard: create_session_info(
+            study_folder, qunex_con_image, shard["sessions"]
+        ),
+    )
+    run_shards(study_folder, "create_session_info", shard_cmds, workers)
 
 
 def process_batch(
@@ -254,10 +647,12 @@ def process_batch(
     study_folder: str,
     batch_input: str,
     qunex_con_image: str,
+    sessions: list = None,
 ) -> None:
     """
     Warpper function around create_batch
-    function
+    function. Given sessions are appended
+    to the existing batch file.
 
     Parameters
     -----------
@@ -269,6 +664,9 @@ def process_batch(
         str of custom batch, can be None.
     qunex_con_image: str
         qunex conatiner image path
+    sessions: list
+        only add these sessions.
+        Default is None
 
     Returns
     -------
@@ -281,14 +679,21 @@ def process_batch(
         study_folder,
         qunex_con_image,
         os.path.join(study_folder, "hcp_batch.txt"),
+        sessions,
     )
-    run_cmd(batch, no_return=True)
+    run_cmd(batch, no_return=True, log_file=setup_log(study_folder, "create_batch"))
     has_qunex_run_sucessfully(study_folder, "create_batch", setup_check=True)
 
 
-def hcp_data_setup(study_folder: str, qunex_con_image: str, raw_data: str) -> None:
+def hcp_data_setup(
+    study_folder: str,
+    qunex_con_image: str,
+    raw_data: str,
+    shards: list,
+    workers: int,
+) -> None:
     """
-    Warpper function around create_batch
+    Warpper function around set_up_hcp
     function
 
     Parameters
@@ -299,14 +704,25 @@ def hcp_data_setup(study_folder: str, qunex_con_image: str, raw_data: str) -> No
         qunex conatiner image path
     raw_data: str
         path to raw data
+    shards: list
+        list of shards
+    workers: int
+        number of shards ran at once
 
     Returns
     -------
     None
     """
-    hcp_setup = set_up_hcp(study_folder, qunex_con_image, raw_data)
-    run_cmd(hcp_setup, no_return=True)
-    has_qunex_run_sucessfully(study_folder, "setup_hcp", setup_check=True)
+    shard_cmds = shard_commands(
+        shards,
+        lambda shard: set_up_hcp(
+            study_folder,
+            qunex_con_image,
+            raw_data,
+            shard["sessions"],
+        ),
+    )
+    run_shards(study_folder, "setup_hcp", shard_cmds, workers)
 
 
 def set_up_qunex_study(args: dict) -> None:
@@ -323,25 +739,77 @@ def set_up_qunex_study(args: dict) -> None:
     -------
     None
     """
+    if args.get("incremental"):
+        error_and_exit(
+            not args["overwrite"], "Can't use --incremental and --overwrite together"
+        )
+        study_info = read_study_info(args["study_folder"])
+        error_and_exit(
+            study_info,
+            f"{args['study_folder']} hasn't been set up yet. Run setup without --incremental",
+        )
+        args["data_type"] = args["data_type"] or study_info.get("data_type")
     datatype = data_check(args["data_type"], args["batch"])
     print("Setting up Subjects")
     print(f"Data type: {datatype}")
     print(f"Overwriting {args['study_folder']}") if args["overwrite"] else None
-    qunex_con_image = container_path()
-    folder_creation(args["study_folder"], args["overwrite"])
-    study_create(args["study_folder"], qunex_con_image)
-    data_importing(args["study_folder"], qunex_con_image, args["raw_data"])
-
-    create_session(args["study_folder"], qunex_con_image)
+    qunex_con_image = container_path(args.get("stage_image"))
+    index = Bids_Index(args["raw_data"])
+    with span("qpipeline_setup_step_seconds", step="bids_index"):
+        index.build()
+    subjects = None
+    set_up = None
+    if args.get("incremental"):
+        set_up = get_sessions(args["study_folder"])
+        subjects = new_subjects(index, args["study_folder"])
+        if not subjects:
+            print(f"No new subjects in {args['raw_data']}")
+            return None
+        print(f"Adding {len(subjects)} new subject(s)")
+    else:
+        with span("qpipeline_setup_step_seconds", step="create_study"):
+            folder_creation(args["study_folder"], args["overwrite"])
+            study_create(args["study_folder"], qunex_con_image)
+        write_study_info(
+            args["study_folder"],
+            data_type=datatype_checker(args["data_type"], args["batch"]).lower(),
+            raw_data=args["raw_data"],
+        )
+    images = raw_images(index, subjects)
+    check_bind_mounts(images, [args["raw_data"], args["study_folder"]])
+    action = import_action(args.get("import_action"), args["study_folder"], images)
+    print(f"Importing images with {action}")
+    workers = args.get("workers") or available_cpus()
+    shards = import_shards(index, workers, args.get("shard_size"), subjects, set_up)
+    workers = min(workers, len(shards))
+    with span("qpipeline_setup_step_seconds", step="import_bids"):
+        data_importing(
+            args["study_folder"],
+            qunex_con_image,
+            args["raw_data"],
+            shards,
+            workers,
+            action,
+        )
 
-    process_batch(
-        datatype,
-        args["study_folder"],
-        args["batch"],
-        qunex_con_image,
-    )
+    with span("qpipeline_setup_step_seconds", step="create_session_info"):
+        create_session(args["study_folder"], qunex_con_image, shards, workers)
+
+    with span("qpipeline_setup_step_seconds", step="create_batch"):
+        process_batch(
+            datatype,
+            args["study_folder"],
+            args["batch"],
+            qunex_con_image,
+            None
+            if subjects is None
+            else sum((shard["sessions"] for shard in shards), []),
+        )
 
-    hcp_data_setup(args["study_folder"], qunex_con_image, args["raw_data"])
+    with span("qpipeline_setup_step_seconds", step="setup_hcp"):
+        hcp_data_setup(
+            args["study_folder"], qunex_con_image, args["raw_data"], shards, workers
+        )
     os.remove(os.path.join(args["study_folder"], "hcp_batch.txt"))
     os.remove(os.path.join(args["study_folder"], "hcp_mapping_file.txt"))
     print("Finished setting up")
@@ -1,44 +1,135 @@
-from qpipeline.base.utils import container_path, run_cmd
+from qpipeline.base.utils import container_path
+from qpipeline.base.submission import session_flag, array_sessions
+from qpipeline.base.resources import stage_resources, job_options
+from qpipeline.base.session_staging import session_cmd
 
 
-def run_structural(args: dict, stage: str) -> dict:
+def run_structural_locally(args: dict, stage: str, sessions: list = None) -> None:
     """
-    Run QuNex HCP structural pipeline.
+    Run QuNex HCP structural stage on this
+    machine, running sessions in parallel.
 
     Parameters
     ----------
     args: dict
         Dictionary of command arguments
-        (study_folder, id, queue, is_flair).
+        (study_folder, is_flair, workers).
     stage: str
         Either 'pre_freesurfer', 'freesurfer'
         or 'post_freesurfer.
+    sessions: list
+        list of sessions to run. Default
+        is None (every session)
 
     Returns
     -------
-    dict: run_cmd output
-        Output from run_cmd.
+    None
     """
+    from qpipeline.base.local_runner import run_stage_locally
+
     print(f"Running: {stage.replace('_', '-').title()}", flush=True)
     print("-" * 75, flush=True)
-    print("\n")
-    qunex_con_image = container_path()
-    cmd = build_structural_cmd(
-        study_folder=args["study_folder"],
-        qunex_con_image=qunex_con_image,
-        queue=args.get("queue", ""),
-        stage=stage,
-        is_flair=args.get("is_flair", False),
+    qunex_con_image = container_path(args.get("stage_image"))
+    run_stage_locally(
+        args["study_folder"],
+        stage,
+        lambda session: session_cmd(
+            args,
+            session,
+            lambda study_folder: build_structural_cmd(
+                study_folder=study_folder,
+                qunex_con_image=qunex_con_image,
+                stage=stage,
+                is_flair=args.get("is_flair", False),
+                sessions=session,
+            ),
+        ),
+        stage_resources(args, stage, sessions),
+        args.get("workers"),
+        sessions,
+    )
+
+
+def submit_structural(
+    args: dict,
+    stage: str,
+    dependency: list = None,
+    sessions: list = None,
+    submission: str = None,
+    corresponding: bool = False,
+) -> list:
+    """
+    Submit a QuNex HCP structural stage
+    to the scheduler. With --array each
+    session is its own array task.
+
+    Parameters
+    ----------
+    args: dict
+        Dictionary of command arguments
+        (study_folder, queue, scheduler,
+        is_flair, array, max_running).
+    stage: str
+        Either 'pre_freesurfer', 'freesurfer'
+        or 'post_freesurfer.
+    dependency: list
+        Job IDs that must finish
+        successfully before this
+        stage starts. Default is None.
+    sessions: list
+        list of sessions to run. Default
+        is None (every session)
+
+    submission: str
+        id of submission. Default is
+        None (the time it is submitted)
+    corresponding: bool
+        each array task only waits on the
+        session of the same index of the
+        dependency. Default is False
+
+    Returns
+    -------
+    list: list object
+        list of job ids
+    """
+    from qpipeline.base.submission import submit_stage
+    from qpipeline.base.schedulers import get_scheduler
+    from qpipeline.base.image_staging import job_container
+
+    print(f"Submitting: {stage.replace('_', '-').title()}", flush=True)
+    qunex_con_image, stage_image = job_container(args.get("stage_image"))
+    cmd = session_cmd(
+        args,
+        session_flag(args, sessions),
+        lambda study_folder: build_structural_cmd(
+            study_folder=study_folder,
+            qunex_con_image=qunex_con_image,
+            stage=stage,
+            is_flair=args.get("is_flair", False),
+            sessions=session_flag(args, sessions),
+        ),
+    )
+    return submit_stage(
+        args["study_folder"],
+        cmd,
+        job_options(stage_resources(args, stage, sessions), stage),
+        get_scheduler(args.get("scheduler")),
+        array_sessions(args, sessions),
+        args.get("max_running"),
+        dependency,
+        stage_image,
+        submission,
+        corresponding,
     )
-    return run_cmd([cmd])
 
 
 def build_structural_cmd(
     study_folder: str,
     qunex_con_image: str,
-    queue: str,
     stage: str,
     is_flair: bool = False,
+    sessions: str = None,
 ) -> str:
     """
     Builds the QuNex structural command.
@@ -49,13 +140,14 @@ def build_structural_cmd(
         Path to study folder.
     qunex_con_image: str
         Container path.
-    queue: str
-        Cluster queue.
     stage: str
         Either 'pre_freesurfer' or 'freesurfer'.
     is_flair: bool
         If True and stage is 'freesurfer',
         add the --hcp_fs_flair flag.
+    sessions: str
+        Only run these sessions from
+        the batch file. Default is None
 
     Returns
     -------
@@ -72,9 +164,7 @@ def build_structural_cmd(
     if stage == "freesurfer" and is_flair:
         cmd += " \\\n      --hcp_fs_flair=TRUE"
 
-    if queue:
-        cmd += f""" \\
-      --bash_pre="module load qunex-img/0.100.0;module load cuda-img/9.1" \\
-      --scheduler="SLURM,time=24:00:00,ntasks=1,cpus-per-task=1,mem-per-cpu=50000,partition={queue},qos=img,gres=gpu:1,jobname={stage}" """
+    if sessions:
+        cmd += f" \\\n      --sessions={sessions}"
 
     return cmd
@@ -1,29 +1,74 @@
-from qpipeline.structural.qunex_structural_runner import run_structural
-from qpipeline.base.cluster_support import wait_for_me
+from qpipeline.structural.qunex_structural_runner import run_structural_locally
+from qpipeline.base.comlogs import sessions_to_run
+from qpipeline.base.run_manifest import queue_stages
 
 
-def run_module(module_cmd: str, args: dict) -> None:
+def expected_session_runtime(module_cmd: str) -> float:
+    """
+    Function to return roughly how long
+    a structural module takes for one
+    session, in seconds.
+
+    Parameters
+    ----------
+    module_cmd: str
+        str of module
+
+    Returns
+    -------
+    float: float object
+        expected seconds per session
+    """
+    return {
+        "pre_freesurfer": 1.5 * 3600,
+        "freesurfer": 6 * 3600,
+        "post_freesurfer": 1 * 3600,
+    }.get(module_cmd)
+
+
+def run_module(module_cmd: str, args: dict, sessions: list = None) -> None:
     """
     Function to run a structural module
+    on this machine
 
     Parameters
     ----------
     module_cmd: str
         str of module to be ran
-    sub_dir: str
-        str of subjs directory
     args: dict
         dictionary of cmd args
+    sessions: list
+        list of sessions to run. Default
+        is None (every session)
 
     Returns
     -------
     None
     """
-    cmd = run_structural(args, module_cmd)
-    wait_for_me(cmd["stdout"])
+    if sessions == []:
+        print(f"{module_cmd} already done for every session")
+        return None
+    run_structural_locally(args, module_cmd, sessions)
     print(f"{module_cmd} done")
 
 
+def structural_modules() -> list:
+    """
+    Function to return the structural
+    modules in the order they are ran
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    list: list object
+        list of modules
+    """
+    return ["pre_freesurfer", "freesurfer", "post_freesurfer"]
+
+
 def hcp_structual(args: dict) -> None:
     """
     Main function for the hcp structural
@@ -38,6 +83,12 @@ def hcp_structual(args: dict) -> None:
     -------
     None
     """
-    modules = ["pre_freesurfer", "freesurfer", "post_freesurfer"]
-    for module in modules:
-        run_module(module, args)
+    if args.get("queue"):
+        stages = structural_modules()
+        if args.get("chain"):
+            stages.append("diffusion")
+        queue_stages("structural", args, stages)
+        return None
+    sessions = sessions_to_run(args, structural_modules())
+    for module in structural_modules():
+        run_module(module, args, sessions[module])
@@ -0,0 +1,81 @@
+"""
+Tests of sizing jobs from the job history.
+
+Run with: python -m pytest tests
+"""
+
+import pytest
+from qpipeline.base.job_history import Job_History
+
+
+def completed_jobs(jobs: int, elapsed: float, maxrss: float) -> dict:
+    """
+    Function to make accounting data
+    of completed jobs
+    """
+    return {
+        str(job): {"state": "COMPLETED", "elapsed": elapsed, "maxrss": maxrss}
+        for job in range(jobs)
+    }
+
+
+@pytest.fixture
+def history(tmp_path) -> Job_History:
+    """
+    Fixture of a job history with five
+    completed one session jobs
+    """
+    history = Job_History(str(tmp_path / "job_history.db"))
+    history.record("slurm", "freesurfer", "hcp", 1, completed_jobs(5, 3600, 2000))
+    return history
+
+
+def right_size(history: Job_History, scheduler: str = "slurm") -> dict:
+    """
+    Function to right size a profile
+    for a one session freesurfer job
+    """
+    profile = {"time": "24:00:00", "memory": 16000}
+    history.right_size(profile, scheduler, "freesurfer", "hcp", 1)
+    return profile
+
+
+def test_right_size_from_completed(history):
+    assert right_size(history) == {"time": "01:25:00", "memory": 2500}
+
+
+def test_only_same_scheduler(history):
+    assert right_size(history, "local") == {"time": "24:00:00", "memory": 16000}
+
+
+def test_timeout_grows_time(history):
+    history.record(
+        "slurm",
+        "freesurfer",
+        "hcp",
+        1,
+        {"timeout": {"state": "TIMEOUT", "elapsed": 5100, "maxrss": 2000}},
+    )
+    assert right_size(history)["time"] == "02:08:00"
+
+
+def test_out_of_memory_grows_memory(history):
+    history.record(
+        "slurm",
+        "freesurfer",
+        "hcp",
+        1,
+        {"oom": {"state": "OUT_OF_MEMORY", "elapsed": 600, "maxrss": 2500}},
+    )
+    assert right_size(history)["memory"] == 3800
+
+
+def test_unknown_usage_keeps_defaults(history):
+    history.record(
+        "slurm",
+        "freesurfer",
+        "hcp",
+        1,
+        {"oom": {"state": "OUT_OF_MEMORY", "elapsed": 600, "maxrss": None}},
+    )
+    assert right_size(history) == {"time": "24:00:00", "memory": 16000}